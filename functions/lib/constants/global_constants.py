@@ -3,15 +3,204 @@ from pytz import timezone
 
 est_timezone = timezone('EST')
 
-dt = datetime.now(est_timezone)
-date_as_text = dt.strftime("%B %d, %Y")
-time_as_text = dt.strftime("%H:%M")
-datetime_as_text = date_as_text + " at " + time_as_text
-weekday_as_text = dt.strftime("%A")
 
-DELAY_BETWEEN_NEWS_FETCH = 0.51
+def get_date_context(dt=None):
+    # dates used in directives, titles and file names
+    # made for each run, a warm instance keeps this module loaded across days
+    dt = dt or datetime.now(est_timezone)
+    date_as_text = dt.strftime("%B %d, %Y")
+    time_as_text = dt.strftime("%H:%M")
+    return {
+        "date_as_text": date_as_text,
+        "time_as_text": time_as_text,
+        "datetime_as_text": date_as_text + " at " + time_as_text,
+        "weekday_as_text": dt.strftime("%A"),
+        "run_date": dt.strftime("%Y-%m-%d"),
+    }
+
+
 NUM_ARTICLES_PER_CATEGORY = 3
+# article text is cut at about this many characters (~1000 tokens) before it goes in the prompt
+MAX_ARTICLE_CHARS = 4000
+
+# prompt
+# the script prompt is kept under this many tokens
+PROMPT_MAX_TOKENS = 16000
+# max tokens for each section of the prompt, longest articles are trimmed first to fit
+PROMPT_SECTION_TOKEN_BUDGETS = {
+    "headlines": 4000,
+    "sports": 2000,
+    "tech": 2000,
+    "entertainment": 2000,
+    "previous_eps": 1000,
+}
+# articles in different feeds with titles at least this similar (0 to 1) are treated as the same story
+DUPLICATE_TITLE_SIMILARITY = 0.85
 PODCAST_LENGTH = "70 lines"
+# model that writes the script
+SCRIPT_MODEL = "gpt-4o-mini"
+# stream the script and start tts on each line as soon as it's written, instead of waiting for the whole script
+SCRIPT_STREAMING = True
+
+# news fetching
+# rss feed for each section of the podcast
+NEWS_FEEDS = {
+    "headlines": "https://abcnews.go.com/abcnews/topstories",
+    # "sports": "https://abcnews.go.com/abcnews/sportsheadlines",
+    "tech": "https://abcnews.go.com/abcnews/technologyheadlines",
+    "entertainment": "https://abcnews.go.com/abcnews/entertainmentheadlines",
+}
+# seconds before giving up on a feed or article page
+NEWS_FETCH_TIMEOUT = 10
+# connections shared by every feed in a run
+NEWS_MAX_CONNECTIONS = 20
+# avoid overwhelming servers: max requests in flight to one host
+# and min seconds between starting requests to that host
+NEWS_MAX_CONCURRENCY_PER_HOST = 4
+NEWS_MIN_INTERVAL_PER_HOST = 0.15
+# extra articles requested per feed so slow or failed pages can be dropped
+NEWS_EXTRA_ARTICLES_PER_FEED = 3
+NEWS_USER_AGENT = "Mozilla/5.0 (compatible; PersonalPodcasts/1.0; +https://personal-podcasts.vercel.app)"
+# feeds and article pages are cached on local disk (kept between warm invocations)
+HTTP_CACHE_DIR = "/tmp/http-cache"
+HTTP_CACHE_MAX_BYTES = 100 * 1024 * 1024
+# seconds before a cached page is deleted
+HTTP_CACHE_TTL = 3 * 24 * 60 * 60
+# seconds a cached page is used without asking the server if it changed
+FEED_CACHE_FRESH_SECONDS = 0
+ARTICLE_CACHE_FRESH_SECONDS = 60 * 60
+
+# article summaries
+# each article is condensed once and the summary goes in the prompt instead of the page text
+ARTICLE_SUMMARY_MODEL = "gpt-4o-mini"
+ARTICLE_SUMMARY_MAX_WORDS = 120
+# articles shorter than this many characters go in the prompt as they are
+ARTICLE_SUMMARY_MIN_CHARS = 800
+# articles summarized at the same time
+ARTICLE_SUMMARY_MAX_WORKERS = 8
+# seconds a summary is kept
+ARTICLE_SUMMARY_TTL = 7 * 24 * 60 * 60
+
+# episode memory
+# the script prompt gets the topics and callbacks of this many recent episodes
+EPISODE_MEMORY_MAX_EPISODES = 5
+EPISODE_MEMORY_MAX_TOPICS = 8
+EPISODE_MEMORY_MAX_CALLBACKS = 3
+# model that pulls the topics and callbacks out of each script
+EPISODE_MEMORY_MODEL = "gpt-4o-mini"
+
+# story index
+# articles covered in the last few days are only used when a feed doesn't have enough new ones
+STORY_INDEX_MAX_AGE_DAYS = 7
+STORY_INDEX_MAX_STORIES = 500
+# titles where at least this share of their words (0 to 1) are in both are the same story
+STORY_TITLE_SIMILARITY = 0.7
+# minhash values kept per title, and how many of them make up each lookup band
+# more rows per band means fewer stories compared, but more similar titles missed
+STORY_MINHASH_NUM_HASHES = 32
+STORY_MINHASH_ROWS_PER_BAND = 3
+
+# text to speech
+TTS_MODEL = "tts-1"
+# number of tts requests sent at the same time
+TTS_MAX_WORKERS = 8
+# most characters openai accepts in one tts request. longer lines are split at sentence ends
+TTS_INPUT_MAX_CHARS = 4096
+# longest new text a line of a published episode can be given (see episode_edits.py)
+RESYNTHESIZE_MAX_TEXT_CHARS = 2000
+# consecutive lines with the same voice are sent as one tts request up to this many characters.
+# fewer, bigger requests have less overhead and fewer seams, but less of the episode is made in parallel
+TTS_MERGE_MAX_CHARS = 1000
+# tts audio is cached on local disk (kept between warm invocations) and in the bucket while its run needs it (see tts_cache.py)
+TTS_CACHE_DIR = "/tmp/tts-cache"
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024
+TTS_CACHE_BUCKET_FOLDER = "tts-cache/"
+# a run's clips are deleted from the bucket once its audio is uploaded, or after this many days if it never is
+TTS_CACHE_BUCKET_MAX_AGE_DAYS = 2
+# clips uploaded to the bucket at the same time
+TTS_CACHE_UPLOAD_WORKERS = 2
+
+# audio
+AUDIO_FOLDER = "audio/testUser/podcastId/"
+# silence between clips to simulate a pause before speech
+AUDIO_GAP_BETWEEN_CLIPS_MS = 40
+# fade at the start and end of each clip to avoid popping when clips are combined
+AUDIO_FADE_MS = 5
+# episode audio is uploaded in chunks of this many bytes while it's generated (multiple of 256 KB)
+AUDIO_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# where the parts of an upload are kept until they're joined into the final file
+AUDIO_UPLOAD_TEMP_FOLDER = "uploads/tmp/"
+# format episodes are published in: "mp3", "opus" or "wav". tts clips are always wav
+AUDIO_CODEC = "mp3"
+# speech sounds fine well below music bitrates
+AUDIO_BITRATE = "64k"
+
+# rss
+# newest episodes kept in the feed
+RSS_MAX_ITEMS = 100
+# seconds podcast apps and cdns can reuse a feed before asking again
+RSS_CACHE_MAX_AGE = 300
+# seconds a warm instance serves its copy of a feed before checking the bucket for a newer one
+RSS_REVALIDATE_SECONDS = 60
+# podcasts whose settings a warm instance keeps for serving their feeds, least recently served are dropped first
+RSS_PODCAST_CACHE_MAX_ENTRIES = 500
+# rendered feeds a warm instance keeps in memory, least recently used are dropped first
+RSS_FEED_CACHE_MAX_ENTRIES = 100
+
+# podcasts
+# settings of the podcast that existed before podcasts were stored in the db
+# its files keep their original paths so its rss url doesn't change
+DEFAULT_PODCAST = {
+    "podcast_id": 1,
+    "user_id": "testUser",
+    "title": "Sam's Personal Podcast",
+    "description": "Personal Podcasts by Sam",
+    "feeds": NEWS_FEEDS,
+    "audio_folder": AUDIO_FOLDER,
+    "rss_folder": "rss/testUser/podcastId/",
+    "rss_file_name": "testRss.xml",
+    "feed_id": "testUsersPodcast",
+}
+# make an episode of the default podcast every day along with the ones in the db
+SCHEDULE_DEFAULT_PODCAST = True
+# each due podcast's episode is made by its own new_episode_task (see scheduler.py)
+# tasks running at once, attempts per task (a retry resumes the run) and seconds before the first retry
+EPISODE_TASK_MAX_CONCURRENT = 4
+EPISODE_TASK_MAX_ATTEMPTS = 3
+EPISODE_TASK_MIN_BACKOFF_SECONDS = 60
+# one episode has to finish within this
+EPISODE_TASK_TIMEOUT_SECONDS = 1800
+# openai requests in flight at once across every podcast on this instance
+OPENAI_MAX_CONCURRENCY = 16
+
+# openai rate limits
+# requests and tokens per minute for each model, from the account's limits page (https://platform.openai.com/settings/organization/limits)
+# models that aren't listed use the default. tts is only limited by requests
+OPENAI_RATE_LIMITS = {
+    "gpt-4o-mini": {"requests_per_minute": 5000, "tokens_per_minute": 2000000},
+    "tts-1": {"requests_per_minute": 500, "tokens_per_minute": None},
+    "default": {"requests_per_minute": 500, "tokens_per_minute": 200000},
+}
+# at most this many seconds of a limit can be used in one burst
+OPENAI_RATE_LIMIT_BURST_SECONDS = 10
+# tokens reserved for a chat response before its real usage is known
+OPENAI_COMPLETION_TOKENS_ESTIMATE = 1000
+# attempts per request when openai rate limits it or has an error
+OPENAI_MAX_ATTEMPTS = 5
+# seconds before the first retry when openai doesn't say how long to wait, doubles after each attempt
+OPENAI_RETRY_BASE_DELAY = 1
+OPENAI_RETRY_MAX_DELAY = 60
+
+# firestore
+# most writes one batch can commit (firestore's limit is 500)
+FIRESTORE_BATCH_MAX_WRITES = 500
+# docs per page when listing podcasts or episodes, and the most a caller can ask for
+LIST_PAGE_SIZE = 20
+LIST_MAX_PAGE_SIZE = 100
+
+# tracing
+# log every span as a json line. the end of run summary is always logged
+TRACE_LOG_SPANS = True
 
 
 TEST = "test2"
@@ -48,14 +237,15 @@ directive_entertainment = """ There should be a 'Entertainment' section of the p
     During this section, have the characters talk about these articles. 
     They are some latest entertainment articles: """
 
-directive_previous_eps = """Here are the last few episodes. 
-    Look at the scripts and try not to repeat things from previous episodes. 
+directive_previous_eps = """Here is what the last few episodes talked about, newest first. 
+    Try not to repeat these stories unless there is something new about them. 
     Also, feel free to make references to the things you talked about yesterday: """
 
 directive_fun_facts = """ At the end there should be a Fun Fact section where they say something interesting or a fun fact about today. 
     Or they could mention something that happened on this day years ago.  """
 
-directive_date = f""" Today's date is {weekday_as_text}, {datetime_as_text}. 
+# filled in with get_date_context() for each run
+directive_date = """ Today's date is {weekday_as_text}, {datetime_as_text}. 
     Make sure you greet the listener at the start of the podcast. In your greeting mention the current day of the week and the date. 
     E.g. 'Today is Monday, June 1st, 2025. Happy Monday! 
     If today is a holiday, wish the listener a happy [holiday] or happy national [xyz] day."""
@@ -69,3 +259,9 @@ section_directives = {
     "fun_facts": directive_fun_facts,
     "date": directive_date,
 }
+
+
+def get_section_directives(date_context=None):
+    # section directives with today's date filled in
+    date_context = date_context or get_date_context()
+    return dict(section_directives, date=directive_date.format(**date_context))
@@ -3,3 +3,5 @@ from firebase_functions.params import SecretParam
 
 
 OPENAI_KEY = SecretParam('OPENAI_KEY')
+# sent as "Authorization: Bearer <key>" to endpoints that change published episodes
+ADMIN_KEY = SecretParam('ADMIN_KEY')
@@ -0,0 +1,192 @@
+# offline benchmark of a whole episode run
+# runs the same pipeline as new_episode against the local stand-ins in lib/tests/fakes.py,
+# so no openai key, news site or firebase project is needed and results are repeatable.
+# reports wall time, peak python memory and time per stage for each episode length and tts concurrency.
+# every run is checked too (see check_run), so a faster change that breaks the episode fails here
+#
+# run from the functions folder:
+#   python -m lib.tests.benchmark
+#   python -m lib.tests.benchmark --lines 20,70,150 --tts-workers 1,4,8,16 --tts-latency 0.5
+#   python -m lib.tests.benchmark --warm    (keep caches between runs, like a warm instance)
+import argparse
+import contextlib
+import io
+import json
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from firebase_admin import firestore
+
+from lib.tests.fakes import NewsServer, FakeOpenAI, FakeBucket, FakeFirestore
+from lib.utils import tracing, pipeline
+from lib.utils.audio_assembly import parse_wav
+from lib.utils.http_cache import http_disk_cache
+from lib.utils.tts_cache import tts_disk_cache
+from lib.utils.podcasts import get_podcast_settings
+from lib.utils.pipeline import EpisodeRun, run_episode_pipeline
+from lib.utils.rss_feed import get_feed_path
+
+
+def parse_int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+def use_cache_folders(folder):
+    # points the instance's disk caches at a new folder
+    for disk_cache, name in [(http_disk_cache, "http-cache"), (tts_disk_cache, "tts-cache")]:
+        disk_cache.folder = f"{folder}/{name}"
+        disk_cache.total_bytes = None
+
+
+def check_run(run, bucket, db, num_lines):
+    # raises if the run didn't make a whole episode: every line in the audio's segments in order,
+    # the audio in the bucket, the episode in the feed and no tts clips left behind
+    problems = []
+    if run.data.get("status") != "complete":
+        problems.append(("status", run.data.get("status")))
+    episode = db.collection("episodes").document(run.data.get("episode_id", "missing")).get().to_dict() or {}
+    segments = episode.get("segments", [])
+    line_numbers = [line_number for segment in segments if not segment.get("chunk")
+                    for line_number in segment.get("line_numbers") or [segment["line_number"]]]
+    if line_numbers != list(range(num_lines)):
+        problems.append(("segment lines", line_numbers))
+    if any(segment["num_bytes"] <= 0 or segment["duration"] <= 0 for segment in segments):
+        problems.append(("empty segments", segments))
+
+    audio_blob = bucket.blob(episode.get("file_path") or "missing")
+    if not audio_blob.exists():
+        problems.append(("audio file", episode.get("file_path")))
+    else:
+        audio_blob.reload()
+        # encoded audio can't be checked against the segments without decoding it
+        if audio_blob.content_type == "audio/wav":
+            audio = parse_wav(audio_blob.download_as_bytes())
+            if segments and len(audio.pcm) != segments[-1]["byte_offset"] + segments[-1]["num_bytes"]:
+                problems.append(("audio size", len(audio.pcm), segments[-1]))
+
+    feed_blob = bucket.blob(get_feed_path(run.podcast))
+    if not feed_blob.exists() or episode.get("url", "missing") not in feed_blob.download_as_bytes().decode("utf-8"):
+        problems.append(("feed", episode.get("url")))
+    leftover_clips = [blob.name for blob in bucket.list_blobs("tts-cache/")]
+    if leftover_clips:
+        problems.append(("tts clips left", len(leftover_clips)))
+
+    if problems:
+        raise Exception("Benchmark episode is wrong:", problems)
+
+
+def run_benchmark_case(news_server, num_lines, tts_workers, args, db):
+    # runs one episode and returns its measurements
+    openai_client = FakeOpenAI(num_lines=num_lines, line_chars=args.line_chars, script_latency=args.script_latency,
+                               chat_latency=args.chat_latency, tts_latency=args.tts_latency,
+                               tts_latency_per_char=args.tts_latency_per_char, lines_per_turn=args.lines_per_turn)
+    bucket = FakeBucket()
+    podcast = get_podcast_settings("benchmark", {"user_id": "benchmark", "feeds": news_server.get_feeds()})
+
+    summaries = []
+    tracing.trace_listeners.append(summaries.append)
+    num_requests_before = news_server.num_requests
+    output = io.StringIO()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    try:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(output):
+            run = EpisodeRun.load_or_create(bucket, podcast)
+            run_episode_pipeline(run, openai_client, bucket, tts_workers)
+        check_run(run, bucket, db, num_lines)
+    except Exception:
+        print(output.getvalue())
+        raise
+    finally:
+        wall_seconds = time.perf_counter() - start_time
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        tracing.trace_listeners.remove(summaries.append)
+
+    spans = summaries[-1]["spans"] if summaries else {}
+    return {
+        "lines": num_lines,
+        "tts_workers": tts_workers,
+        "wall_seconds": wall_seconds,
+        "peak_memory_mb": peak_memory / 1024 / 1024,
+        "stage_seconds": {name.removeprefix("stage."): stats["seconds"] for name, stats in spans.items()
+                          if name.startswith("stage.")},
+        "openai_calls": dict(openai_client.calls),
+        "http_requests": news_server.num_requests - num_requests_before,
+        "firestore": dict(db.counters),
+        "audio_bytes": spans.get("audio.upload_finish", {}).get("totals", {}).get("bytes", 0),
+        "spans": spans,
+    }
+
+
+def format_result(result):
+    stages = " ".join(f"{stage} {seconds:6.2f}s" for stage, seconds in result["stage_seconds"].items())
+    calls = ", ".join(f"{name} {count}" for name, count in sorted(result["openai_calls"].items()))
+    return (f"{result['lines']:5d} lines {result['tts_workers']:3d} workers | "
+            f"wall {result['wall_seconds']:6.2f}s | peak {result['peak_memory_mb']:7.1f} MB | {stages} | "
+            f"openai: {calls} | http {result['http_requests']} | "
+            f"db reads {result['firestore']['reads']} writes {result['firestore']['writes']} "
+            f"commits {result['firestore']['commits']} | "
+            f"audio {result['audio_bytes'] / 1024 / 1024:.1f} MB")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Benchmark an episode run against local fakes")
+    parser.add_argument("--lines", type=parse_int_list, default=[20, 70], help="script lengths, comma separated")
+    parser.add_argument("--tts-workers", type=parse_int_list, default=[1, 4, 8], help="tts concurrency, comma separated")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each case")
+    parser.add_argument("--feeds", type=int, default=3, help="number of news feeds")
+    parser.add_argument("--line-chars", type=int, default=200, help="characters per script line")
+    parser.add_argument("--lines-per-turn", type=int, default=1, help="lines each host says in a row")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="seconds per feed or page request")
+    parser.add_argument("--script-latency", type=float, default=1.0, help="seconds to generate the script")
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="seconds per article summary")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="seconds per tts call")
+    parser.add_argument("--tts-latency-per-char", type=float, default=0.001, help="extra tts seconds per character")
+    parser.add_argument("--no-streaming", action="store_true", help="wait for the whole script before starting tts")
+    parser.add_argument("--warm", action="store_true", help="keep caches and the db between runs")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own logs")
+    parser.add_argument("--json", help="also write every result to this file")
+    return parser
+
+
+def run_benchmark(args):
+    # returns the result of every case
+    # nothing in the run should reach a real service
+    real_firestore_client = firestore.client
+    tracing.TRACE_LOG_SPANS = args.verbose
+    pipeline.SCRIPT_STREAMING = not args.no_streaming
+    results = []
+    db = FakeFirestore()
+    with tempfile.TemporaryDirectory() as cache_folder, \
+            NewsServer([f"feed{index}" for index in range(args.feeds)], latency=args.page_latency) as news_server:
+        firestore.client = lambda *client_args, **client_kwargs: db
+        try:
+            use_cache_folders(cache_folder)
+            for num_lines in args.lines:
+                for tts_workers in args.tts_workers:
+                    for repeat in range(args.repeat):
+                        if not args.warm:
+                            db = FakeFirestore()
+                            use_cache_folders(f"{cache_folder}/{num_lines}_{tts_workers}_{repeat}")
+                        result = run_benchmark_case(news_server, num_lines, tts_workers, args, db)
+                        results.append(result)
+                        print(format_result(result))
+        finally:
+            firestore.client = real_firestore_client
+    return results
+
+
+def main():
+    args = make_parser().parse_args()
+    results = run_benchmark(args)
+    print(f"process peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
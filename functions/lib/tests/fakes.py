@@ -0,0 +1,588 @@
+# local stand-ins for the services an episode run talks to, used by the benchmark
+# - NewsServer: http server with fixture rss feeds and article pages, with configurable latency
+# - FakeOpenAI: client with canned scripts, summaries, episode notes and wav clips, with configurable latency
+# - FakeBucket / FakeFirestore: storage bucket and firestore with the calls the app uses.
+#   the bucket keeps its objects in temp files rather than in memory, so the benchmark's peak
+#   memory is only what the pipeline itself holds and not everything it uploaded
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from lib.constants.global_constants import EPISODE_MEMORY_MAX_TOPICS
+from lib.utils.utility_functions import Line
+from lib.utils.episode_memory import EpisodeNotes
+
+
+# news sites
+
+TITLE_WORDS = ["council", "storm", "markets", "election", "launch", "vaccine", "court", "festival", "merger",
+               "wildfire", "league", "budget", "satellite", "strike", "museum", "border", "record", "summit"]
+
+
+def make_title(feed_name, index):
+    # different enough between stories that they aren't removed as duplicates
+    words = random.Random(f"{feed_name}/{index}").sample(TITLE_WORDS, 4)
+    return f"{words[0].title()} {words[1]} and {words[2]} after {words[3]} ({feed_name} #{index})"
+
+
+def make_feed_xml(base_url, feed_name, num_items):
+    items = "".join(f"""<item>
+<title>{make_title(feed_name, index)}</title>
+<link>{base_url}/article/{feed_name}/{index}</link>
+<description>Short description of {feed_name} story {index}.</description>
+</item>""" for index in range(num_items))
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>{feed_name}</title><link>{base_url}</link>{items}</channel></rss>""".encode("utf-8")
+
+
+def make_article_html(feed_name, index, num_paragraphs):
+    paragraphs = "".join(f"<p>Paragraph {paragraph} of {feed_name} story {index}. Officials said on Tuesday that the "
+                         f"plan would move ahead after months of debate, with 1,200 people expected to be affected "
+                         f"and a final decision due next week according to a statement.</p>"
+                         for paragraph in range(num_paragraphs))
+    return f"""<html><head><title>{feed_name} story {index}</title><script>var tracking = 1;</script></head>
+<body><nav><a href="/">Home</a><a href="/news">News</a><a href="/sports">Sports</a></nav>
+<header>Site header</header>
+<article><h1>{feed_name} story {index}</h1>{paragraphs}</article>
+<aside>Related: <a href="/x">other story</a></aside><footer>Copyright</footer></body></html>""".encode("utf-8")
+
+
+class NewsServer:
+    # serves /feed/<name> and /article/<name>/<index>
+    # every response waits latency seconds first. pages send an etag and answer conditional requests with 304
+    def __init__(self, feed_names, items_per_feed=10, paragraphs_per_article=20, latency=0.05):
+        self.feed_names = feed_names
+        self.items_per_feed = items_per_feed
+        self.paragraphs_per_article = paragraphs_per_article
+        self.latency = latency
+        self.num_requests = 0
+        self.lock = threading.Lock()
+
+        news_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                news_server.handle(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_feeds(self):
+        return {feed_name: f"{self.base_url}/feed/{feed_name}" for feed_name in self.feed_names}
+
+    def handle(self, request):
+        with self.lock:
+            self.num_requests += 1
+        time.sleep(self.latency)
+
+        parts = request.path.strip("/").split("/")
+        if parts[0] == "feed" and len(parts) == 2:
+            body, content_type = make_feed_xml(self.base_url, parts[1], self.items_per_feed), "application/rss+xml"
+        elif parts[0] == "article" and len(parts) == 3:
+            body, content_type = make_article_html(parts[1], parts[2], self.paragraphs_per_article), "text/html"
+        else:
+            request.send_response(404)
+            request.end_headers()
+            return
+
+        etag = f'"{len(body)}-{hash(body)}"'
+        if request.headers.get("If-None-Match") == etag:
+            request.send_response(304)
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.send_header("ETag", etag)
+        request.end_headers()
+        request.wfile.write(body)
+
+
+# openai
+
+TTS_SAMPLE_RATE = 24000
+# about how fast the voices talk
+TTS_CHARS_PER_SECOND = 15
+
+
+def make_wav(num_frames, sample_rate=TTS_SAMPLE_RATE):
+    # 16 bit mono wav with unknown sizes in the header, the way openai streams it
+    pcm = struct.pack(f"<{num_frames}h", *([600, -600] * (num_frames // 2) + [0] * (num_frames % 2)))
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE" +
+            b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16) +
+            b"data" + struct.pack("<I", 0xFFFFFFFF) + pcm)
+
+
+def make_script_line_text(line_number, num_chars):
+    text = f"Line {line_number}. Here is what happened in the news today, and why it matters to you. "
+    return (text * (num_chars // len(text) + 1))[:num_chars]
+
+
+class FakeSpeech:
+    def __init__(self, openai_client):
+        self.openai_client = openai_client
+
+    def create(self, model, voice, input, response_format="wav", **kwargs):
+        self.openai_client.count("tts")
+        time.sleep(self.openai_client.tts_latency + len(input) * self.openai_client.tts_latency_per_char)
+        num_frames = int(len(input) / TTS_CHARS_PER_SECOND * TTS_SAMPLE_RATE)
+        return SimpleNamespace(content=make_wav(num_frames))
+
+
+class FakeCompletions:
+    def __init__(self, openai_client):
+        self.openai_client = openai_client
+
+    def make_completion(self, message):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=message)],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0),
+        )
+
+    def create(self, model, messages, **kwargs):
+        # article summaries
+        self.openai_client.count("chat")
+        time.sleep(self.openai_client.chat_latency)
+        prompt = messages[0]["content"]
+        completion = self.make_completion(SimpleNamespace(content="Summary: " + prompt[-300:]))
+        completion.usage.prompt_tokens = len(prompt) // 4
+        return completion
+
+    def make_script_completion(self, messages, response_format):
+        voices = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
+        # each host says lines_per_turn lines in a row
+        script = [Line(voice=voices[line_number // self.openai_client.lines_per_turn % 2],
+                       text=make_script_line_text(line_number, self.openai_client.line_chars))
+                  for line_number in range(self.openai_client.num_lines)]
+        completion = self.make_completion(SimpleNamespace(parsed=response_format(script=script)))
+        completion.usage.prompt_tokens = len(messages[0]["content"]) // 4
+        return completion
+
+    def make_notes_completion(self, messages, response_format):
+        prompt = messages[0]["content"]
+        completion = self.make_completion(SimpleNamespace(parsed=response_format(
+            topics=[f"Topic {topic_number}" for topic_number in range(EPISODE_MEMORY_MAX_TOPICS)],
+            callbacks=["A running joke"],
+        )))
+        completion.usage.prompt_tokens = len(prompt) // 4
+        return completion
+
+    def parse(self, model, messages, response_format, **kwargs):
+        if response_format is EpisodeNotes:
+            # topics of a finished episode
+            self.openai_client.count("notes")
+            time.sleep(self.openai_client.chat_latency)
+            return self.make_notes_completion(messages, response_format)
+        # the episode script
+        self.openai_client.count("script")
+        time.sleep(self.openai_client.script_latency)
+        return self.make_script_completion(messages, response_format)
+
+    def stream(self, model, messages, response_format, **kwargs):
+        # the episode script, a few characters at a time over script_latency seconds
+        self.openai_client.count("script")
+        return FakeScriptStream(self.make_script_completion(messages, response_format), self.openai_client.script_latency)
+
+
+class FakeScriptStream:
+    CHARS_PER_EVENT = 20
+
+    def __init__(self, completion, latency):
+        self.completion = completion
+        self.latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def __iter__(self):
+        text = self.completion.choices[0].message.parsed.model_dump_json()
+        num_events = len(text) // self.CHARS_PER_EVENT + 1
+        for event_index in range(num_events):
+            time.sleep(self.latency / num_events)
+            delta = text[event_index * self.CHARS_PER_EVENT:(event_index + 1) * self.CHARS_PER_EVENT]
+            yield SimpleNamespace(type="content.delta", delta=delta)
+        yield SimpleNamespace(type="content.done")
+
+    def get_final_completion(self):
+        return self.completion
+
+
+class FakeOpenAI:
+    # latencies are in seconds. tts takes tts_latency plus tts_latency_per_char for each character
+    def __init__(self, num_lines=70, line_chars=200, script_latency=1.0, chat_latency=0.3,
+                 tts_latency=0.3, tts_latency_per_char=0.001, lines_per_turn=1):
+        self.num_lines = num_lines
+        self.line_chars = line_chars
+        self.lines_per_turn = max(1, lines_per_turn)
+        self.script_latency = script_latency
+        self.chat_latency = chat_latency
+        self.tts_latency = tts_latency
+        self.tts_latency_per_char = tts_latency_per_char
+        self.lock = threading.Lock()
+        self.calls = {}
+
+        self.audio = SimpleNamespace(speech=FakeSpeech(self))
+        completions = FakeCompletions(self)
+        self.chat = SimpleNamespace(completions=completions)
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def count(self, call_name):
+        with self.lock:
+            self.calls[call_name] = self.calls.get(call_name, 0) + 1
+
+
+# storage bucket
+
+class FakeBlobWriter(io.RawIOBase):
+    # stands in for the resumable upload writer, sends whole chunks like the real one
+    # the chunks go to a temp file, only the one being filled is in memory
+    def __init__(self, blob, chunk_size):
+        self.blob = blob
+        self.chunk_size = chunk_size or 1024 * 1024
+        self.buffer = bytearray()
+        self.file = blob.bucket.make_temp_file()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.file.write(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+            self.file.close()
+            self.blob.save_file(self.file.name)
+        super().close()
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.generation = None
+        self.time_created = None
+        self.updated = None
+        self.size = None
+        self.cache_control = None
+        self.public_url = f"https://storage.example.com/{bucket.name}/{name}"
+
+    def stored(self):
+        return self.bucket.objects.get(self.name)
+
+    def save(self, data, content_type=None, if_generation_match=None):
+        with self.bucket.make_temp_file() as temp_file:
+            temp_file.write(data)
+        self.save_file(temp_file.name, content_type, if_generation_match)
+
+    def save_file(self, temp_path, content_type=None, if_generation_match=None):
+        # the temp file becomes the object's data
+        with self.bucket.lock:
+            current = self.stored()
+            current_generation = current["generation"] if current else 0
+            if if_generation_match is not None and if_generation_match != current_generation:
+                os.remove(temp_path)
+                raise PreconditionFailed(self.name)
+            self.bucket.last_generation += 1
+            path = os.path.join(self.bucket.folder.name, str(self.bucket.last_generation))
+            os.replace(temp_path, path)
+            if current:
+                os.remove(current["path"])
+            self.bucket.objects[self.name] = {
+                "path": path,
+                "size": os.path.getsize(path),
+                "content_type": content_type or self.content_type,
+                "generation": self.bucket.last_generation,
+                "time_created": datetime.now(timezone.utc),
+            }
+        self.reload()
+
+    def reload(self):
+        stored = self.stored()
+        if stored is None:
+            raise NotFound(self.name)
+        self.content_type = stored["content_type"]
+        self.generation = stored["generation"]
+        self.time_created = stored["time_created"]
+        self.updated = stored["time_created"]
+        self.size = stored["size"]
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.save(data, content_type, if_generation_match)
+
+    def download_as_bytes(self, **kwargs):
+        self.reload()
+        with open(self.stored()["path"], "rb") as stored_file:
+            return stored_file.read()
+
+    def open(self, mode="rb", chunk_size=None, content_type=None, **kwargs):
+        self.content_type = content_type
+        return FakeBlobWriter(self, chunk_size)
+
+    def compose(self, sources, **kwargs):
+        with self.bucket.make_temp_file() as temp_file:
+            for source in sources:
+                source.reload()
+                with open(source.stored()["path"], "rb") as source_file:
+                    shutil.copyfileobj(source_file, temp_file)
+        self.save_file(temp_file.name)
+
+    def delete(self):
+        with self.bucket.lock:
+            stored = self.bucket.objects.pop(self.name, None)
+            if stored is None:
+                raise NotFound(self.name)
+            os.remove(stored["path"])
+
+    def exists(self):
+        return self.name in self.bucket.objects
+
+    def make_public(self):
+        pass
+
+
+class FakeBucket:
+    def __init__(self, name="benchmark-bucket"):
+        self.name = name
+        # removed with the bucket
+        self.folder = tempfile.TemporaryDirectory(prefix="fake-bucket-")
+        self.objects = {}
+        self.last_generation = 0
+        self.lock = threading.Lock()
+
+    def make_temp_file(self):
+        return tempfile.NamedTemporaryFile("wb", dir=self.folder.name, suffix=".tmp", delete=False)
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        blobs = []
+        for name in sorted(self.objects):
+            if name.startswith(prefix):
+                blob = FakeBlob(self, name)
+                blob.reload()
+                blobs.append(blob)
+        return blobs
+
+    def get_total_bytes(self):
+        return sum(stored["size"] for stored in self.objects.values())
+
+
+# firestore
+
+def resolve_server_values(data):
+    return {key: datetime.now(timezone.utc) if value is firestore.SERVER_TIMESTAMP else value
+            for key, value in data.items()}
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data, field_paths=None):
+        self.id = doc_id
+        self.exists = data is not None
+        if data is not None and field_paths is not None:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data) if self.data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self, field_paths=None):
+        self.collection.db.count("reads")
+        return FakeSnapshot(self.id, self.collection.docs.get(self.id), field_paths)
+
+    def set(self, data, merge=False):
+        # a write on its own is a commit of one write
+        self.collection.db.count("commits")
+        self.write(data, merge)
+
+    def write(self, data, merge=False):
+        self.collection.db.count("writes")
+        with self.collection.db.lock:
+            current = dict(self.collection.docs.get(self.id) or {}) if merge else {}
+            current.update(resolve_server_values(data))
+            self.collection.docs[self.id] = current
+
+    def update(self, data):
+        if self.id not in self.collection.docs:
+            raise NotFound(self.id)
+        self.set(data, merge=True)
+
+
+class FakeQuery:
+    OPERATORS = {
+        "==": lambda value, target: value == target,
+        "!=": lambda value, target: value != target,
+        "<": lambda value, target: value is not None and value < target,
+        "<=": lambda value, target: value is not None and value <= target,
+        ">": lambda value, target: value is not None and value > target,
+        ">=": lambda value, target: value is not None and value >= target,
+        "in": lambda value, target: value in target,
+    }
+
+    def __init__(self, collection, filters=(), orders=(), num_results=None, field_paths=None, start_after_values=None):
+        self.collection = collection
+        self.filters = list(filters)
+        self.orders = list(orders)
+        self.num_results = num_results
+        self.field_paths = field_paths
+        self.start_after_values = start_after_values
+
+    def copy(self, **changes):
+        query = FakeQuery(self.collection, self.filters, self.orders, self.num_results, self.field_paths,
+                          self.start_after_values)
+        query.__dict__.update(changes)
+        return query
+
+    def where(self, field_path, op_string, value):
+        return self.copy(filters=self.filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self.copy(orders=self.orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self.copy(num_results=count)
+
+    def select(self, field_paths):
+        return self.copy(field_paths=list(field_paths))
+
+    def start_after(self, document_fields):
+        if isinstance(document_fields, FakeSnapshot):
+            document_fields = dict(document_fields.to_dict(), __name__=document_fields.id)
+        return self.copy(start_after_values=[document_fields.get(field_path) for field_path, _ in self.orders])
+
+    @staticmethod
+    def get_order_value(doc, field_path):
+        # __name__ is the doc id, like in firestore
+        return doc[0] if field_path == "__name__" else doc[1].get(field_path)
+
+    @staticmethod
+    def get_sort_key(value):
+        # firestore orders values of different types by type: null, booleans, numbers, timestamps, strings
+        if value is None:
+            return (0, 0)
+        if isinstance(value, bool):
+            return (1, value)
+        if isinstance(value, (int, float)):
+            return (2, value)
+        if isinstance(value, datetime):
+            return (3, value)
+        return (4, str(value))
+
+    def stream(self):
+        with self.collection.db.lock:
+            docs = [(doc_id, dict(data)) for doc_id, data in self.collection.docs.items()]
+        docs = [(doc_id, data) for doc_id, data in docs
+                if all(self.OPERATORS[op_string](data.get(field_path), value)
+                       for field_path, op_string, value in self.filters)]
+        for field_path, direction in reversed(self.orders):
+            docs.sort(key=lambda doc: self.get_sort_key(self.get_order_value(doc, field_path)),
+                      reverse=direction == "DESCENDING")
+        if self.start_after_values is not None:
+            def order_values(doc):
+                return [self.get_order_value(doc, field_path) for field_path, _ in self.orders]
+            cursor_index = next((index for index, doc in enumerate(docs) if order_values(doc) == self.start_after_values), None)
+            docs = docs[cursor_index + 1:] if cursor_index is not None else docs
+        if self.num_results is not None:
+            docs = docs[:self.num_results]
+        self.collection.db.count("reads", len(docs))
+        return iter([FakeSnapshot(doc_id, data, self.field_paths) for doc_id, data in docs])
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.docs = {}
+        super().__init__(self)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self, doc_id or f"doc{len(self.docs)}_{time.time_ns()}")
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.operations = []
+
+    def set(self, reference, data, merge=False):
+        self.operations.append((reference, data, merge, False))
+
+    def update(self, reference, data):
+        self.operations.append((reference, data, True, True))
+
+    def commit(self):
+        self.db.count("commits")
+        # all or nothing, like a real batch
+        for reference, _, _, must_exist in self.operations:
+            if must_exist and reference.id not in reference.collection.docs:
+                raise NotFound(reference.id)
+        for reference, data, merge, _ in self.operations:
+            reference.write(data, merge=merge)
+        self.operations = []
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.RLock()
+        self.counters = {"reads": 0, "writes": 0, "commits": 0}
+
+    def count(self, counter_name, amount=1):
+        with self.lock:
+            self.counters[counter_name] += amount
+
+    def collection(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = FakeCollection(self, name)
+            return self.collections[name]
+
+    def get_all(self, references, field_paths=None):
+        return [reference.get(field_paths=field_paths) for reference in references]
+
+    def batch(self):
+        return FakeBatch(self)
@@ -1,28 +1,16 @@
 # test by visiting these paths
 
-import time
-import random
-import feedparser
-from feedgen.feed import FeedGenerator
 import json
-from datetime import datetime, timedelta
-from pytz import timezone
-import requests
-from bs4 import BeautifulSoup
-from pydantic import BaseModel
-from typing import Literal
-from functools import partial
 
 from firebase_functions import https_fn
-from firebase_admin import initialize_app
-from firebase_functions.params import SecretParam
-from firebase_functions import scheduler_fn
-from firebase_admin import firestore
-from firebase_admin import credentials
 from firebase_admin import storage
-from openai import OpenAI
 
-from lib.utils.utility_functions import *
+from lib.utils.utility_functions import (
+    get_audio_bytes_from_text, message_ai_structured, get_last_n_episodes, get_full_content_from_rss,
+)
+from lib.utils.clients import get_openai_client
+from lib.utils.listing import (stream_page_response, get_list_fields, PODCAST_LIST_FIELDS,
+                               EPISODE_LIST_FIELDS)
 from lib.constants.secrets import OPENAI_KEY
 from lib.constants.global_constants import directive
 
@@ -43,27 +31,29 @@ def storage_test(req: https_fn.Request) -> https_fn.Response:
     return https_fn.Response(f"blobs found {retText}")
 
 
+# ?numPodcasts=n (at most 100), ?pageToken= from the last page's next_page_token, ?fields=title,rss_url
 @https_fn.on_request()
-def get_n_podcasts(request, num_podcasts=100):
-    db = firestore.client()
-    num_podcasts = int(request.args.get('numPodcasts', 100))  # Default to 5
+def get_n_podcasts(request):
+    return stream_page_response('podcasts',
+                                get_list_fields(request.args.get('fields'), PODCAST_LIST_FIELDS),
+                                page_size=request.args.get('numPodcasts'),
+                                page_token=request.args.get('pageToken'))
 
-    podcasts = []
-    docs = db.collection('podcasts').order_by('created_at', direction='DESCENDING').limit(num_podcasts).stream()
-    
-    podcasts = list(map(lambda doc : {
-            'id': doc.id,
-            'data': doc.to_dict()
-        }, docs))
-
-    print ("podcasts is", podcasts)
 
-    return podcasts
+# same as get_n_podcasts, ?podcastId=x for one podcast's episodes
+@https_fn.on_request()
+def get_n_episodes(request):
+    podcast_id = request.args.get('podcastId')
+    return stream_page_response('episodes',
+                                get_list_fields(request.args.get('fields'), EPISODE_LIST_FIELDS),
+                                page_size=request.args.get('numEpisodes'),
+                                page_token=request.args.get('pageToken'),
+                                filters=[('podcast_id', '==', podcast_id)] if podcast_id else [])
 
 
 @https_fn.on_request(secrets=[OPENAI_KEY])
 def get_speech(request):
-    openai_client = OpenAI(api_key=OPENAI_KEY.value)
+    openai_client = get_openai_client()
 
     # print_in_red("before get_audio_bytes_from_text")
     audio_bytes = get_audio_bytes_from_text(
@@ -101,7 +91,7 @@ def news_test(req: https_fn.Request) -> https_fn.Response:
 @https_fn.on_request(secrets=[OPENAI_KEY])
 def open_test(req: https_fn.Request) -> https_fn.Response: 
     
-    openai_client = OpenAI(api_key=OPENAI_KEY.value)
+    openai_client = get_openai_client()
     response_message = message_ai_structured(openai_client, directive)
 
     print(response_message)
@@ -110,10 +100,10 @@ def open_test(req: https_fn.Request) -> https_fn.Response:
 
 @https_fn.on_request()
 def eps_test(req):
-    eps = get_last_n_episodes(5)
+    eps = get_last_n_episodes(5, fields=["created_at", "script_text"])
     trimmed_eps = [{
-        "created_at": this_ep.get("created_at"), 
-        "script_text": this_ep.get("script_text")
+        "created_at": this_ep["data"].get("created_at"), 
+        "script_text": this_ep["data"].get("script_text")
         } for this_ep in eps]
     print(trimmed_eps)
     return eps
\ No newline at end of file
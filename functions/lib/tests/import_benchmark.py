@@ -0,0 +1,72 @@
+# measures how long a cold start spends importing
+# each module is imported in a new python process, like a new function instance,
+# and the median over the repeats is reported.
+# --offenders lists the slowest imports under each module using python -X importtime
+#
+# run from the functions folder:
+#   python -m lib.tests.import_benchmark
+#   python -m lib.tests.import_benchmark --modules main,lib.utils.pipeline --repeat 9 --offenders 10
+import argparse
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    "main",
+    "lib.utils.clients",
+    "lib.utils.news_fetching",
+    "lib.utils.utility_functions",
+    "lib.utils.pipeline",
+    "openai",
+    "firebase_admin.firestore",
+    "firebase_admin.storage",
+]
+
+TIMING_CODE = """
+import sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(module):
+    # seconds to import the module in a new process
+    completed = subprocess.run([sys.executable, "-c", TIMING_CODE, module], capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise Exception("Error importing " + module + ":", completed.stderr.strip())
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def get_import_offenders(module, num_offenders):
+    # the imports that took longest, counting what they imported in turn
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True)
+    offenders = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        offenders.append((int(cumulative) / 1_000_000, name.strip()))
+    offenders.sort(reverse=True)
+    return offenders[1:num_offenders + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time cold imports of the functions' modules")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="modules to import, comma separated")
+    parser.add_argument("--repeat", type=int, default=5, help="new processes per module")
+    parser.add_argument("--offenders", type=int, default=0, help="show this many of the slowest nested imports")
+    args = parser.parse_args()
+
+    for module in [module for module in args.modules.split(",") if module]:
+        seconds = [time_import(module) for _ in range(args.repeat)]
+        print(f"{module:32s} median {statistics.median(seconds):6.3f}s  "
+              f"min {min(seconds):6.3f}s  max {max(seconds):6.3f}s")
+        if args.offenders:
+            for cumulative_seconds, name in get_import_offenders(module, args.offenders):
+                print(f"    {cumulative_seconds:6.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# run from the functions folder with: python -m pytest lib/tests
+import pytest
+
+from lib.utils.audio_assembly import WavJoiner, build_wav_header, parse_wav, splice_wav_clips
+
+
+SAMPLE_RATE = 1000
+# 10 ms at 1000 frames a second of 16 bit mono is 20 bytes
+GAP_MS = 10
+GAP_SIZE = 20
+
+
+def make_clip(num_frames, value):
+    # every sample of the clip has the same value, so its bytes can be found in the episode
+    pcm = value.to_bytes(2, "little", signed=True) * num_frames
+    return build_wav_header(len(pcm), 1, SAMPLE_RATE, 16) + pcm
+
+
+def join_episode(clips):
+    # clips are (num frames, sample value, line number)
+    joiner = WavJoiner(gap_ms=GAP_MS, fade_ms=0)
+    parts = []
+    for num_frames, value, line_number in clips:
+        parts += joiner.add_clip(make_clip(num_frames, value), line_number=line_number)
+    return b"".join([joiner.build_header()] + parts), joiner.segments
+
+
+def get_positions(segments):
+    return [(segment["line_number"], segment["byte_offset"], segment["num_bytes"], segment["duration"])
+            for segment in segments]
+
+
+def test_joined_segments_point_at_each_clip():
+    episode, segments = join_episode([(100, 1, 0), (200, 2, 1), (300, 3, 2)])
+    assert get_positions(segments) == [(0, 0, 200, 0.1), (1, 220, 400, 0.2), (2, 640, 600, 0.3)]
+    pcm = parse_wav(episode).pcm
+    assert pcm[220:620].tobytes() == make_clip(200, 2)[44:]
+    assert pcm[200:220].tobytes() == bytes(GAP_SIZE)
+
+
+def test_splice_moves_the_segments_after_a_shorter_clip():
+    episode, segments = join_episode([(100, 1, 0), (200, 2, 1), (300, 3, 2)])
+    joiner, parts = splice_wav_clips(parse_wav(episode), segments, {1: [(make_clip(50, 7), {"line_number": 1})]},
+                                     gap_ms=GAP_MS, fade_ms=0)
+    assert get_positions(joiner.segments) == [(0, 0, 200, 0.1), (1, 220, 100, 0.05), (2, 340, 600, 0.3)]
+    assert [segment["start_seconds"] for segment in joiner.segments] == [0, 0.11, 0.17]
+    assert joiner.duration == pytest.approx(0.47)
+
+    new_episode = b"".join([joiner.build_header()] + parts)
+    new_pcm = parse_wav(new_episode).pcm
+    assert len(new_pcm) == joiner.data_size == 940
+    # the untouched clips and gaps are copied as they were
+    assert new_pcm[0:220].tobytes() == parse_wav(episode).pcm[0:220].tobytes()
+    assert new_pcm[220:320].tobytes() == make_clip(50, 7)[44:]
+    assert new_pcm[340:940].tobytes() == make_clip(300, 3)[44:]
+
+
+def test_splice_replaces_every_part_of_a_split_line():
+    joiner = WavJoiner(gap_ms=GAP_MS, fade_ms=0)
+    parts = joiner.add_clip(make_clip(100, 1), line_number=0)
+    # line 1 was split in two, the second part has no gap before it
+    parts += joiner.add_clip(make_clip(100, 2), line_number=1, chunk=0)
+    parts += joiner.add_clip(make_clip(100, 2), with_gap=False, line_number=1, chunk=1)
+    parts += joiner.add_clip(make_clip(100, 3), line_number=2)
+    episode = b"".join([joiner.build_header()] + parts)
+    assert get_positions(joiner.segments) == [(0, 0, 200, 0.1), (1, 220, 200, 0.1), (1, 420, 200, 0.1), (2, 640, 200, 0.1)]
+
+    new_clips = {1: [(make_clip(150, 5), {"line_number": 1})]}
+    new_joiner, new_parts = splice_wav_clips(parse_wav(episode), joiner.segments, new_clips, gap_ms=GAP_MS, fade_ms=0)
+    assert get_positions(new_joiner.segments) == [(0, 0, 200, 0.1), (1, 220, 300, 0.15), (2, 540, 200, 0.1)]
+    assert len(b"".join(new_parts)) == 740
+
+
+def test_splice_rejects_segments_past_the_audio():
+    episode, segments = join_episode([(100, 1, 0)])
+    segments[0]["num_bytes"] += 2
+    with pytest.raises(ValueError):
+        splice_wav_clips(parse_wav(episode), segments, {}, gap_ms=GAP_MS, fade_ms=0)
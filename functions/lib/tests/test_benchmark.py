@@ -0,0 +1,14 @@
+# run from the functions folder with: python -m pytest lib/tests
+from lib.tests.benchmark import make_parser, run_benchmark
+
+
+def test_benchmark_runs_make_whole_episodes():
+    # a small run of every path of the benchmark with no latency, each case is checked by check_run
+    args = make_parser().parse_args(["--lines", "8", "--tts-workers", "1,4", "--feeds", "2", "--line-chars", "80",
+                                     "--page-latency", "0", "--script-latency", "0", "--chat-latency", "0",
+                                     "--tts-latency", "0", "--tts-latency-per-char", "0"])
+    results = run_benchmark(args)
+    assert [(result["lines"], result["tts_workers"]) for result in results] == [(8, 1), (8, 4)]
+    for result in results:
+        assert result["openai_calls"]["script"] == 1
+        assert result["audio_bytes"] > 0
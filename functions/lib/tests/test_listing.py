@@ -0,0 +1,57 @@
+# run from the functions folder with: python -m pytest lib/tests
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from lib.constants.global_constants import LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE
+from lib.tests.fakes import FakeFirestore
+from lib.utils import listing
+from lib.utils.listing import decode_page_token, encode_page_token, get_page_size, list_docs
+
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2024, 12, 8, 1, 24, 55, 123456, tzinfo=timezone.utc),
+    "Sun, 08 Dec 2024 01:24:55 GMT",
+    # a string that looks like a timestamp stays a string
+    "2024-12-08T01:24:55+00:00",
+    1733621095.5,
+    None,
+])
+def test_page_token_round_trips_created_at_with_its_type(created_at):
+    cursor = decode_page_token(encode_page_token("doc1", {"created_at": created_at, "title": "x"}))
+    assert cursor == {"created_at": created_at, "__name__": "doc1"}
+    assert type(cursor["created_at"]) is type(created_at)
+
+
+def test_no_token_for_a_created_at_a_token_cant_hold():
+    assert encode_page_token("doc1", {"created_at": {"seconds": 1}}) is None
+
+
+@pytest.mark.parametrize("page_token", ["not a token", "e30=", ""])
+def test_bad_page_tokens_are_value_errors(page_token):
+    with pytest.raises(ValueError):
+        decode_page_token(page_token)
+
+
+@pytest.mark.parametrize("page_size, expected", [(None, LIST_PAGE_SIZE), ("", LIST_PAGE_SIZE), ("5", 5), ("0", 1),
+                                                 ("100000", LIST_MAX_PAGE_SIZE)])
+def test_page_size_is_kept_in_range(page_size, expected):
+    assert get_page_size(page_size) == expected
+
+
+@pytest.mark.parametrize("page_size", ["ten", "1.5", "[]"])
+def test_non_numeric_page_size_is_a_value_error(page_size):
+    with pytest.raises(ValueError):
+        get_page_size(page_size)
+
+
+def test_list_docs_reads_past_the_page_size_limit(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(listing, "get_firestore_client", lambda: db)
+    start = datetime(2024, 12, 8, tzinfo=timezone.utc)
+    for index in range(LIST_MAX_PAGE_SIZE + 30):
+        db.collection("episodes").document(f"ep{index:03d}").set({"created_at": start + timedelta(minutes=index),
+                                                                  "title": str(index)})
+    docs = list_docs("episodes", ["title"], LIST_MAX_PAGE_SIZE + 10)
+    assert [doc_id for doc_id, data in docs] == [f"ep{index:03d}" for index in range(LIST_MAX_PAGE_SIZE + 29, 19, -1)]
+    assert len(list_docs("episodes", ["title"], 1000)) == LIST_MAX_PAGE_SIZE + 30
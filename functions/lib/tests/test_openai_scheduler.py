@@ -0,0 +1,117 @@
+# run from the functions folder with: python -m pytest lib/tests
+from types import SimpleNamespace
+
+import pytest
+
+from lib.utils import openai_scheduler
+from lib.utils.openai_scheduler import OpenAIScheduler, TokenBucket, get_retry_after
+
+
+def make_scheduler(tokens_per_minute=6000, requests_per_minute=600, max_attempts=3):
+    limits = {"default": {"requests_per_minute": requests_per_minute, "tokens_per_minute": tokens_per_minute}}
+    return OpenAIScheduler(rate_limits=limits, max_concurrency=4, max_attempts=max_attempts)
+
+
+def make_error(status_code, headers=None):
+    error = Exception(f"status {status_code}")
+    error.status_code = status_code
+    error.response = SimpleNamespace(headers=headers or {})
+    return error
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(openai_scheduler.time, "sleep", lambda seconds: None)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(60, burst_seconds=10)
+    bucket.updated_at = 100.0
+    assert bucket.capacity == 10
+    bucket.take(10, 100.0)
+    assert bucket.get_wait(1, 100.0) == pytest.approx(1.0)
+    assert bucket.get_wait(1, 101.0) == pytest.approx(0.0)
+    # never holds more than its capacity
+    bucket.refill(1000.0)
+    assert bucket.level == 10
+
+
+def test_token_bucket_waits_only_for_a_full_bucket_for_big_requests():
+    bucket = TokenBucket(60, burst_seconds=10)
+    bucket.updated_at = 0.0
+    bucket.take(10, 0.0)
+    assert bucket.get_wait(50, 0.0) == pytest.approx(10.0)
+
+
+def test_token_bucket_give_back_can_go_below_empty():
+    bucket = TokenBucket(60, burst_seconds=10)
+    bucket.updated_at = 0.0
+    bucket.give_back(-15)
+    bucket.refill(0.0)
+    assert bucket.level == -5
+    assert bucket.get_wait(1, 0.0) == pytest.approx(6.0)
+
+
+def test_retry_after_header_in_seconds_and_milliseconds():
+    assert get_retry_after(SimpleNamespace(headers={"retry-after": "3"})) == 3
+    assert get_retry_after(SimpleNamespace(headers={"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(SimpleNamespace(headers={})) is None
+
+
+def test_successful_request_settles_its_estimate_to_what_it_used():
+    scheduler = make_scheduler()
+    scheduler.run(lambda: "done", model="gpt", tokens=60, get_used_tokens=lambda result: 10)
+    tokens = scheduler.get_model("gpt")["tokens"]
+    tokens.refill(tokens.updated_at)
+    assert tokens.level == pytest.approx(tokens.capacity - 10, abs=1)
+
+
+def test_failed_attempts_give_back_their_tokens():
+    scheduler = make_scheduler()
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise make_error(503)
+        return "done"
+
+    assert scheduler.run(call, model="gpt", tokens=60, get_used_tokens=lambda result: 0) == "done"
+    assert len(attempts) == 3
+    tokens = scheduler.get_model("gpt")["tokens"]
+    tokens.refill(tokens.updated_at)
+    # nothing is left reserved by the two failed attempts
+    assert tokens.level == pytest.approx(tokens.capacity, abs=1)
+    assert scheduler.get_stats()["retries"] == 2
+
+
+def test_errors_not_worth_retrying_fail_at_once_and_give_back_their_tokens():
+    scheduler = make_scheduler()
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        raise make_error(400)
+
+    with pytest.raises(Exception):
+        scheduler.run(call, model="gpt", tokens=60)
+    assert len(attempts) == 1
+    tokens = scheduler.get_model("gpt")["tokens"]
+    tokens.refill(tokens.updated_at)
+    assert tokens.level == pytest.approx(tokens.capacity, abs=1)
+    assert scheduler.get_stats()["failed"] == 1
+    assert scheduler.get_stats()["in_flight"] == 0
+
+
+def test_rate_limit_pauses_the_model_for_retry_after():
+    scheduler = make_scheduler()
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise make_error(429, {"retry-after": "0"})
+        return "done"
+
+    assert scheduler.run(call, model="gpt") == "done"
+    assert scheduler.get_stats()["rate_limited"] == 1
@@ -0,0 +1,44 @@
+# run from the functions folder with: python -m pytest lib/tests
+import json
+
+from lib.utils.script_streaming import ScriptLineParser
+
+
+LINES = [
+    {"speaker": "host", "text": 'She said "rates {will} hold" and left'},
+    {"speaker": "guest", "text": "a backslash \\ then a quote \\\" and a ] and a }"},
+    {"speaker": "host", "text": "nested", "tags": {"mood": "calm", "list": [1, {"a": "}"}]}},
+]
+SCRIPT_TEXT = json.dumps({"title": "a {title} with [brackets]", "lines": LINES})
+
+
+def parse_in_chunks(text, chunk_size):
+    parser = ScriptLineParser()
+    lines = []
+    for start in range(0, len(text), chunk_size):
+        lines += parser.feed(text[start:start + chunk_size])
+    return lines
+
+
+def test_parses_every_line_in_one_chunk():
+    assert parse_in_chunks(SCRIPT_TEXT, len(SCRIPT_TEXT)) == LINES
+
+
+def test_escapes_and_braces_split_across_chunks():
+    # every chunk size puts escapes, quotes and braces at the edges of some chunks
+    for chunk_size in range(1, 12):
+        assert parse_in_chunks(SCRIPT_TEXT, chunk_size) == LINES
+
+
+def test_lines_come_out_as_soon_as_they_finish():
+    parser = ScriptLineParser()
+    first_line_end = SCRIPT_TEXT.index(json.dumps(LINES[0])) + len(json.dumps(LINES[0]))
+    assert parser.feed(SCRIPT_TEXT[:first_line_end - 1]) == []
+    assert parser.feed(SCRIPT_TEXT[first_line_end - 1:first_line_end]) == [LINES[0]]
+    assert parser.feed(SCRIPT_TEXT[first_line_end:]) == LINES[1:]
+
+
+def test_unfinished_line_is_not_returned():
+    parser = ScriptLineParser()
+    assert parser.feed('{"lines": [{"speaker": "host", "text": "cut \\"off') == []
+    assert parser.feed(' here\\" "}') == [{"speaker": "host", "text": 'cut "off here" '}]
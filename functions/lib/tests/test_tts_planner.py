@@ -0,0 +1,60 @@
+# run from the functions folder with: python -m pytest lib/tests
+from types import SimpleNamespace
+
+from lib.constants.global_constants import TTS_INPUT_MAX_CHARS
+from lib.utils.tts_planner import plan_tts_requests, plan_tts_requests_for_segments
+
+
+def make_script(*lines):
+    return [SimpleNamespace(voice=voice, text=text) for voice, text in lines]
+
+
+def get_plan(requests):
+    return [(request["line_numbers"], request["voice"], request["text"]) for request in requests]
+
+
+def make_segment(line_numbers, chunk=None):
+    segment = {"line_number": line_numbers[0], "line_numbers": line_numbers}
+    if chunk is not None:
+        segment.update(chunk=chunk, num_chunks=2)
+    return segment
+
+
+SCRIPT = make_script(("Fable", "one."), ("fable", "two."), ("nova", "three."), ("fable", "four."))
+LONG_TEXT = " ".join(["A sentence that goes on for a while."] * (TTS_INPUT_MAX_CHARS // 30))
+
+
+def test_consecutive_lines_with_the_same_voice_are_merged():
+    assert get_plan(plan_tts_requests(SCRIPT)) == [([0, 1], "fable", "one. two."), ([2], "nova", "three."),
+                                                   ([3], "fable", "four.")]
+
+
+def test_long_lines_are_split_and_never_merged():
+    script = make_script(("fable", "short."), ("fable", LONG_TEXT), ("fable", "after."))
+    requests = list(plan_tts_requests(script))
+    assert [(request["line_numbers"], request["chunk"], request["num_chunks"]) for request in requests] == [
+        ([0], 0, 1), ([1], 0, 2), ([1], 1, 2), ([2], 0, 1)]
+    assert all(len(request["text"]) <= TTS_INPUT_MAX_CHARS for request in requests)
+    assert " ".join(request["text"] for request in requests[1:3]) == LONG_TEXT
+
+
+def test_segments_keep_the_episode_clips():
+    # the episode was made with every line as its own clip, so nothing is merged again
+    segments = [make_segment([0]), make_segment([1]), make_segment([2]), make_segment([3])]
+    assert get_plan(plan_tts_requests_for_segments(SCRIPT, segments)) == [
+        ([0], "fable", "one."), ([1], "fable", "two."), ([2], "nova", "three."), ([3], "fable", "four.")]
+
+
+def test_segments_only_redo_the_clips_with_those_lines():
+    segments = [make_segment([0, 1]), make_segment([2]), make_segment([3])]
+    assert get_plan(plan_tts_requests_for_segments(SCRIPT, segments, redo_line_numbers=[1])) == [
+        ([0, 1], "fable", "one. two.")]
+    assert get_plan(plan_tts_requests_for_segments(SCRIPT, segments, redo_line_numbers=[2, 3])) == [
+        ([2], "nova", "three."), ([3], "fable", "four.")]
+
+
+def test_segments_of_a_split_line_are_one_clip():
+    script = make_script(("fable", "short."), ("nova", LONG_TEXT))
+    segments = [make_segment([0]), make_segment([1], chunk=0), make_segment([1], chunk=1)]
+    requests = plan_tts_requests_for_segments(script, segments, redo_line_numbers=[1])
+    assert [(request["line_numbers"], request["chunk"]) for request in requests] == [([1], 0), ([1], 1)]
@@ -0,0 +1,160 @@
+# condenses each article into a short summary once and shares it across episodes and podcasts
+# summaries are stored in the article_summaries collection, keyed by a hash of the article's url.
+# a stored summary is reused while the article's text hasn't changed (same content hash)
+# and it hasn't expired. expires_at can also be used as the collection's firestore ttl field
+# so old summaries are deleted on their own
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+from lib.constants.global_constants import (ARTICLE_SUMMARY_MODEL, ARTICLE_SUMMARY_MAX_WORDS, ARTICLE_SUMMARY_MIN_CHARS,
+                                            ARTICLE_SUMMARY_MAX_WORKERS, ARTICLE_SUMMARY_TTL)
+from lib.utils.utility_functions import message_ai
+from lib.utils.tracing import span, set_span_attributes, submit_in_context
+from lib.utils.db_writes import WriteBatch
+from lib.utils.clients import get_firestore_client
+
+
+SUMMARIES_COLLECTION = "article_summaries"
+# change when the summary prompt changes so old summaries aren't used
+SUMMARY_VERSION = f"v1_{ARTICLE_SUMMARY_MODEL}_{ARTICLE_SUMMARY_MAX_WORDS}"
+
+summary_directive = f"""Summarize this news article for the host of a news podcast in at most {ARTICLE_SUMMARY_MAX_WORDS} words.
+Keep the names, numbers, dates, places and quotes that matter. Leave out anything that isn't about the story.
+Only reply with the summary.
+"""
+
+# summaries being made on this instance, so podcasts generated at the same time
+# don't summarize the same article twice
+summaries_lock = threading.Lock()
+summaries_in_progress = {}
+
+
+def get_summary_key(url):
+    return hashlib.sha256((url or "").encode("utf-8")).hexdigest()
+
+
+def get_content_hash(content):
+    return hashlib.sha256(f"{SUMMARY_VERSION}\n{content}".encode("utf-8")).hexdigest()
+
+
+def needs_summary(article):
+    return bool(article.get("link")) and len(article.get("content") or "") >= ARTICLE_SUMMARY_MIN_CHARS
+
+
+def is_summary_usable(summary_data, content_hash):
+    if not summary_data or summary_data.get("content_hash") != content_hash or not summary_data.get("summary"):
+        return False
+    expires_at = summary_data.get("expires_at")
+    return expires_at is None or expires_at > datetime.now(timezone.utc)
+
+
+def load_summaries(keys):
+    # returns stored summaries by key. every key is read in one request
+    db = get_firestore_client()
+    refs = [db.collection(SUMMARIES_COLLECTION).document(key) for key in set(keys)]
+    if not refs:
+        return {}
+    return {doc.id: doc.to_dict() for doc in db.get_all(refs, field_paths=["summary", "content_hash", "expires_at"])
+            if doc.exists}
+
+
+def save_summary(writes, key, article, content_hash, summary):
+    # queued, summarize_articles saves every new summary in one commit
+    writes.set(SUMMARIES_COLLECTION, key, {
+        "url": article.get("link"),
+        "title": article.get("title"),
+        "content_hash": content_hash,
+        "summary": summary,
+        "model": ARTICLE_SUMMARY_MODEL,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ARTICLE_SUMMARY_TTL),
+    }, merge=False)
+
+
+def summarize_article(openai_client, article):
+    with span("summary.article", url=article.get("link"), characters=len(article.get("content") or "")) as summary_span:
+        message = summary_directive + f"\nTitle: {article.get('title')}\n\n{article.get('content')}"
+        summary = message_ai(openai_client, message=message, model=ARTICLE_SUMMARY_MODEL).strip()
+        summary_span.set(summary_characters=len(summary))
+    return summary
+
+
+def make_summary(openai_client, article, key, content_hash, writes):
+    # summarizes one article and queues it to be stored
+    # if another podcast on this instance is already summarizing it, waits for that one instead
+    with summaries_lock:
+        future = summaries_in_progress.get((key, content_hash))
+        is_owner = future is None
+        if is_owner:
+            future = summaries_in_progress[(key, content_hash)] = Future()
+    if not is_owner:
+        return future.result()
+
+    try:
+        summary = summarize_article(openai_client, article)
+        future.set_result(summary)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with summaries_lock:
+            summaries_in_progress.pop((key, content_hash), None)
+
+    save_summary(writes, key, article, content_hash, summary)
+    return summary
+
+
+def summarize_articles(articles_per_section, openai_client, max_workers=ARTICLE_SUMMARY_MAX_WORKERS):
+    # takes a list of article lists (one per section)
+    # returns the same lists with each article's content replaced by its summary
+    # an article keeps its page text if it's short or its summary couldn't be made
+    articles = [article for section_articles in articles_per_section for article in section_articles
+                if needs_summary(article)]
+    keys = {id(article): get_summary_key(article["link"]) for article in articles}
+    content_hashes = {id(article): get_content_hash(article["content"]) for article in articles}
+
+    try:
+        stored_summaries = load_summaries(keys.values())
+    except Exception as e:
+        print("Error loading article summaries: ", repr(e))
+        stored_summaries = {}
+
+    summaries = {}
+    articles_to_summarize = []
+    for article in articles:
+        summary_data = stored_summaries.get(keys[id(article)])
+        if is_summary_usable(summary_data, content_hashes[id(article)]):
+            summaries[id(article)] = summary_data["summary"]
+        else:
+            articles_to_summarize.append(article)
+    num_stored = len(summaries)
+
+    num_failed = 0
+    if articles_to_summarize:
+        writes = WriteBatch()
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {id(article): submit_in_context(executor, make_summary, openai_client, article,
+                                                      keys[id(article)], content_hashes[id(article)], writes)
+                       for article in articles_to_summarize}
+            for article in articles_to_summarize:
+                try:
+                    summaries[id(article)] = futures[id(article)].result()
+                except Exception as e:
+                    num_failed += 1
+                    print("Error summarizing article", article.get("link"), ": ", repr(e))
+        try:
+            writes.flush()
+        except Exception as e:
+            # the summaries can still be used for this episode
+            print("Error saving article summaries: ", repr(e))
+
+    num_kept = sum(len(section_articles) for section_articles in articles_per_section) - len(articles)
+    set_span_attributes(reused=num_stored, new=len(articles_to_summarize) - num_failed, failed=num_failed, kept_as_is=num_kept)
+
+    return [[dict(article, content=summaries[id(article)]) if id(article) in summaries else article
+             for article in section_articles]
+            for section_articles in articles_per_section]
@@ -0,0 +1,253 @@
+# functions for combining wav clips into one episode
+# reads each clip's header instead of guessing where the audio starts,
+# keeps the pcm payloads as memoryviews so clips are only copied once (into the final episode)
+# and writes one header that describes the whole episode.
+# the joiner also keeps a segment index: where each clip's audio is in the episode,
+# so single lines can be replaced later without making the rest again
+import struct
+import sys
+from array import array
+
+from lib.constants.global_constants import AUDIO_GAP_BETWEEN_CLIPS_MS, AUDIO_FADE_MS
+
+
+WAV_HEADER_SIZE = 44
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# fields of a segment that depend on where it is in the episode
+SEGMENT_POSITION_FIELDS = ["byte_offset", "num_bytes", "start_sample", "num_samples", "start_seconds", "duration"]
+
+
+class WavAudio:
+    # pcm audio from a wav file
+    # pcm is a memoryview into the original bytes, nothing is copied
+    def __init__(self, pcm, num_channels, sample_rate, bits_per_sample):
+        self.pcm = pcm
+        self.num_channels = num_channels
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+
+    @property
+    def block_align(self):
+        return self.num_channels * self.bits_per_sample // 8
+
+    @property
+    def audio_format(self):
+        return (self.num_channels, self.sample_rate, self.bits_per_sample)
+
+    @property
+    def num_frames(self):
+        return len(self.pcm) // self.block_align
+
+    @property
+    def duration(self):
+        return self.num_frames / self.sample_rate
+
+
+def parse_wav(audio_bytes):
+    # takes the bytes of a wav file
+    # returns WavAudio with the format from the fmt chunk and the data chunk's pcm
+    audio_view = memoryview(audio_bytes)
+    if len(audio_view) < 12 or audio_view[0:4] != b"RIFF" or audio_view[8:12] != b"WAVE":
+        raise ValueError("Audio is not a wav file")
+
+    audio_format = None
+    position = 12
+    while position + 8 <= len(audio_view):
+        chunk_id = audio_view[position:position + 4].tobytes()
+        chunk_size = struct.unpack_from("<I", audio_view, position + 4)[0]
+        chunk_start = position + 8
+
+        if chunk_id == b"fmt ":
+            format_tag, num_channels, sample_rate, _, _, bits_per_sample = struct.unpack_from("<HHIIHH", audio_view, chunk_start)
+            if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE):
+                raise ValueError("Unsupported wav encoding:", format_tag)
+            audio_format = (num_channels, sample_rate, bits_per_sample)
+        elif chunk_id == b"data":
+            if audio_format is None:
+                raise ValueError("Wav data chunk comes before fmt chunk")
+            # streamed wavs (like the ones from openai) use 0xFFFFFFFF as the size
+            # so the data chunk runs until the end of the file
+            chunk_end = min(chunk_start + chunk_size, len(audio_view))
+            wav_audio = WavAudio(None, *audio_format)
+            # drop any partial frame at the end
+            chunk_end -= (chunk_end - chunk_start) % wav_audio.block_align
+            wav_audio.pcm = audio_view[chunk_start:chunk_end]
+            return wav_audio
+
+        # chunks are padded to an even number of bytes
+        position = chunk_start + chunk_size + (chunk_size % 2)
+
+    raise ValueError("Wav file has no data chunk")
+
+
+def build_wav_header(data_size, num_channels, sample_rate, bits_per_sample):
+    block_align = num_channels * bits_per_sample // 8
+    return struct.pack("<4sI4s4sIHHIIHH4sI",
+                       b"RIFF", WAV_HEADER_SIZE - 8 + data_size, b"WAVE",
+                       b"fmt ", 16, WAVE_FORMAT_PCM, num_channels, sample_rate,
+                       sample_rate * block_align, block_align, bits_per_sample,
+                       b"data", data_size)
+
+
+def get_num_frames(milliseconds, sample_rate):
+    return int(sample_rate * milliseconds / 1000)
+
+
+def fade_pcm(pcm, fade_frames, num_channels, fade_in=True):
+    # takes the edge of a clip (16 bit pcm)
+    # returns a faded copy of it. only the edge is copied, not the whole clip
+    samples = array("h")
+    samples.frombytes(pcm)
+    # wav samples are little endian
+    if sys.byteorder == "big":
+        samples.byteswap()
+    num_samples = len(samples)
+    total_frames = num_samples // num_channels
+    for frame in range(total_frames):
+        volume = (frame if fade_in else total_frames - frame - 1) / fade_frames
+        for channel in range(num_channels):
+            index = frame * num_channels + channel
+            samples[index] = int(samples[index] * volume)
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def get_clip_parts(wav_audio, fade_frames):
+    # split a clip into faded start, untouched middle and faded end
+    # middle stays a memoryview into the original clip
+    pcm = wav_audio.pcm
+    if fade_frames <= 0 or wav_audio.bits_per_sample != 16:
+        return [pcm]
+
+    fade_frames = min(fade_frames, wav_audio.num_frames // 2)
+    fade_size = fade_frames * wav_audio.block_align
+    if fade_size == 0:
+        return [pcm]
+
+    return [fade_pcm(pcm[:fade_size], fade_frames, wav_audio.num_channels, fade_in=True),
+            pcm[fade_size:len(pcm) - fade_size],
+            fade_pcm(pcm[len(pcm) - fade_size:], fade_frames, wav_audio.num_channels, fade_in=False)]
+
+
+def build_segment(byte_offset, num_bytes, audio_format, **segment_fields):
+    # where one clip is in the episode
+    # byte_offset is from the start of the episode's pcm (the wav data chunk),
+    # samples are frames, so they're the same for every channel
+    num_channels, sample_rate, bits_per_sample = audio_format
+    block_align = num_channels * bits_per_sample // 8
+    return dict(segment_fields,
+                byte_offset=byte_offset,
+                num_bytes=num_bytes,
+                start_sample=byte_offset // block_align,
+                num_samples=num_bytes // block_align,
+                start_seconds=round(byte_offset / block_align / sample_rate, 3),
+                duration=round(num_bytes / block_align / sample_rate, 3))
+
+
+def get_duration(data_size, audio_format):
+    num_channels, sample_rate, bits_per_sample = audio_format
+    return data_size / (num_channels * bits_per_sample // 8) / sample_rate
+
+
+class WavJoiner:
+    # joins wav clips one at a time, in order
+    # fades each clip in and out so they join without popping
+    # puts a short silence between clips to simulate a pause between speakers
+    def __init__(self, gap_ms=AUDIO_GAP_BETWEEN_CLIPS_MS, fade_ms=AUDIO_FADE_MS):
+        self.gap_ms = gap_ms
+        self.fade_ms = fade_ms
+        self.audio_format = None
+        self.num_clips = 0
+        self.data_size = 0
+        self.segments = []
+
+    def set_format(self, wav_clip):
+        if self.audio_format is None:
+            self.audio_format = wav_clip.audio_format
+            self.gap = bytes(get_num_frames(self.gap_ms, wav_clip.sample_rate) * wav_clip.block_align)
+            self.fade_frames = get_num_frames(self.fade_ms, wav_clip.sample_rate)
+        elif wav_clip.audio_format != self.audio_format:
+            raise ValueError("Clips have different formats:", self.audio_format, wav_clip.audio_format)
+
+    def add_clip(self, clip_bytes, with_gap=True, **segment_fields):
+        # takes the bytes of the next wav clip
+        # and anything to keep in its segment (like its line number)
+        # returns the pcm parts to append to the episode for this clip
+        wav_clip = parse_wav(clip_bytes)
+        self.set_format(wav_clip)
+
+        parts = []
+        if with_gap and self.num_clips > 0:
+            parts.append(self.gap)
+            self.data_size += len(self.gap)
+        clip_parts = get_clip_parts(wav_clip, self.fade_frames)
+        parts.extend(clip_parts)
+
+        clip_size = sum(len(part) for part in clip_parts)
+        self.segments.append(build_segment(self.data_size, clip_size, self.audio_format, **segment_fields))
+        self.num_clips += 1
+        self.data_size += clip_size
+        return parts
+
+    def add_pcm(self, pcm, segment):
+        # takes pcm that's already in the episode format (gaps and faded clips from another episode)
+        # segment is the stored segment of a clip in it, or None for anything between clips
+        # returns the pcm parts to append
+        if segment is not None:
+            segment_fields = {key: value for key, value in segment.items() if key not in SEGMENT_POSITION_FIELDS}
+            self.segments.append(build_segment(self.data_size, len(pcm), self.audio_format, **segment_fields))
+            self.num_clips += 1
+        self.data_size += len(pcm)
+        return [pcm]
+
+    @property
+    def duration(self):
+        return get_duration(self.data_size, self.audio_format) if self.audio_format else 0
+
+    def build_header(self):
+        # header for every clip added so far
+        if self.audio_format is None:
+            raise ValueError("No clips have been added")
+        return build_wav_header(self.data_size, *self.audio_format)
+
+
+def splice_wav_clips(episode_audio, segments, new_clips, gap_ms=AUDIO_GAP_BETWEEN_CLIPS_MS, fade_ms=AUDIO_FADE_MS):
+    # replaces some clips of a joined episode without touching the rest of its audio
+    # takes the episode's WavAudio, its segments in order
+    # and {line number: [(new wav clip bytes, new clip fields), ...]} for the clips to replace, keyed by
+    # the line_number of their segment. every segment with that line number (the parts of a split line)
+    # is replaced by the new clips. clip fields are add_clip's with_gap and segment fields
+    # returns the joiner (with the new segments and header) and the episode's new pcm parts
+    joiner = WavJoiner(gap_ms=gap_ms, fade_ms=fade_ms)
+    joiner.set_format(episode_audio)
+    pcm = episode_audio.pcm
+    parts = []
+    position = 0
+    replaced_line_numbers = set()
+    for segment in segments:
+        segment_start = segment["byte_offset"]
+        segment_end = segment_start + segment["num_bytes"]
+        if segment_start < position or segment_end > len(pcm):
+            raise ValueError("Segment doesn't match the episode audio:", segment)
+        if segment["line_number"] in replaced_line_numbers:
+            # a later part of a clip that was already replaced, it had no gap before it
+            position = segment_end
+            continue
+        # the gap before the clip
+        if segment_start > position:
+            parts.extend(joiner.add_pcm(pcm[position:segment_start], None))
+        if segment["line_number"] in new_clips:
+            for clip_index, (clip_bytes, clip_fields) in enumerate(new_clips[segment["line_number"]]):
+                # the first clip goes where the old one was, after the gap that was just copied
+                if clip_index == 0:
+                    clip_fields = dict(clip_fields, with_gap=False)
+                parts.extend(joiner.add_clip(clip_bytes, **clip_fields))
+            replaced_line_numbers.add(segment["line_number"])
+        else:
+            parts.extend(joiner.add_pcm(pcm[segment_start:segment_end], segment))
+        position = segment_end
+    if position < len(pcm):
+        parts.extend(joiner.add_pcm(pcm[position:], None))
+    return joiner, parts
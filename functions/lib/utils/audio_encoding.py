@@ -0,0 +1,110 @@
+# encodes episode audio to a compressed format while it's being generated
+# pcm is piped into one ffmpeg process clip by clip and the encoded bytes are handed on
+# as ffmpeg produces them, so the whole episode is never held in memory or encoded at once.
+# cloud functions images don't have ffmpeg, so the static binary from the imageio-ffmpeg package is used
+# (or IMAGEIO_FFMPEG_EXE when it's set). ffmpeg on the path is only a fallback. without either, episodes stay wav
+import shutil
+import subprocess
+import threading
+
+from lib.constants.global_constants import AUDIO_CODEC, AUDIO_BITRATE
+
+
+AUDIO_CODECS = {
+    "wav": {"extension": "wav", "content_type": "audio/wav", "ffmpeg_args": None},
+    "mp3": {"extension": "mp3", "content_type": "audio/mpeg",
+            "ffmpeg_args": ["-c:a", "libmp3lame", "-b:a", AUDIO_BITRATE, "-f", "mp3"]},
+    "opus": {"extension": "ogg", "content_type": "audio/ogg",
+             "ffmpeg_args": ["-c:a", "libopus", "-b:a", AUDIO_BITRATE, "-application", "voip", "-f", "ogg"]},
+}
+# ffmpeg's raw pcm format for each wav bits per sample
+PCM_FORMATS = {8: "u8", 16: "s16le", 24: "s24le", 32: "s32le"}
+# bytes read from ffmpeg at a time
+ENCODER_READ_SIZE = 64 * 1024
+
+
+def get_ffmpeg_path():
+    # imported here since it's only needed once an episode is encoded
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError) as e:
+        print("Error getting ffmpeg from imageio-ffmpeg: ", repr(e))
+        return shutil.which("ffmpeg")
+
+
+def get_output_codec(codec=AUDIO_CODEC):
+    # returns the codec episodes will actually use
+    if codec not in AUDIO_CODECS:
+        raise Exception("Unknown audio codec:", codec)
+    if AUDIO_CODECS[codec]["ffmpeg_args"] and get_ffmpeg_path() is None:
+        print("Warning: ffmpeg not found, episode audio will be wav instead of", codec)
+        return "wav"
+    return codec
+
+
+class StreamingEncoder:
+    # takes raw pcm in order with write(), calls on_output with each piece of encoded audio
+    # on_output is called from the encoder's reader thread
+    def __init__(self, codec, audio_format, on_output):
+        num_channels, sample_rate, bits_per_sample = audio_format
+        self.on_output = on_output
+        self.error = None
+        self.stderr = b""
+        self.process = subprocess.Popen(
+            [get_ffmpeg_path(), "-hide_banner", "-loglevel", "error",
+             "-f", PCM_FORMATS[bits_per_sample], "-ar", str(sample_rate), "-ac", str(num_channels), "-i", "pipe:0",
+             *AUDIO_CODECS[codec]["ffmpeg_args"], "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        # ffmpeg blocks if its output isn't read, so output and errors are read while pcm is written
+        self.output_reader = threading.Thread(target=self.read_output, daemon=True)
+        self.error_reader = threading.Thread(target=self.read_errors, daemon=True)
+        self.output_reader.start()
+        self.error_reader.start()
+
+    def read_output(self):
+        try:
+            while True:
+                encoded = self.process.stdout.read(ENCODER_READ_SIZE)
+                if not encoded:
+                    break
+                self.on_output(encoded)
+        except Exception as e:
+            self.error = e
+            self.process.kill()
+
+    def read_errors(self):
+        self.stderr = self.process.stderr.read()
+
+    def write(self, pcm):
+        if self.error:
+            raise Exception("Error handling encoded audio:", repr(self.error))
+        try:
+            self.process.stdin.write(pcm)
+        except BrokenPipeError:
+            raise Exception("ffmpeg stopped while encoding:", self.finish_process())
+
+    def finish_process(self):
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        self.output_reader.join()
+        self.error_reader.join()
+        self.process.wait()
+        return self.stderr.decode("utf-8", "replace").strip()
+
+    def finish(self):
+        # waits for the rest of the encoded audio to be handed on
+        stderr = self.finish_process()
+        if self.error:
+            raise Exception("Error handling encoded audio:", repr(self.error))
+        if self.process.returncode != 0:
+            raise Exception("ffmpeg failed with code", self.process.returncode, stderr)
+
+    def abort(self):
+        self.process.kill()
+        self.finish_process()
+
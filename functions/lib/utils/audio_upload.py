@@ -0,0 +1,104 @@
+# uploads episode audio to the bucket while it is still being generated
+# pcm for each clip goes straight into a resumable upload of a temporary "body" object
+# so only one upload chunk is held in memory at a time.
+# the wav header depends on the total size, so it is uploaded last as its own object
+# and the bucket composes header + body into the final file
+from lib.constants.global_constants import AUDIO_UPLOAD_CHUNK_SIZE, AUDIO_UPLOAD_TEMP_FOLDER
+from lib.utils.audio_assembly import WavJoiner
+from lib.utils.audio_encoding import AUDIO_CODECS, StreamingEncoder
+
+
+class StreamingAudioUpload:
+    def __init__(self, bucket, file_path, content_type="audio/wav", chunk_size=AUDIO_UPLOAD_CHUNK_SIZE):
+        self.bucket = bucket
+        self.file_path = file_path
+        self.content_type = content_type
+        self.joiner = WavJoiner()
+
+        temp_path = AUDIO_UPLOAD_TEMP_FOLDER + file_path
+        self.header_blob = bucket.blob(temp_path + ".header")
+        self.body_blob = bucket.blob(temp_path + ".body")
+        self.body_writer = self.body_blob.open("wb", chunk_size=chunk_size, content_type="application/octet-stream")
+
+    def write_clip(self, clip_bytes, **segment_fields):
+        # clips must be written in episode order
+        for part in self.joiner.add_clip(clip_bytes, **segment_fields):
+            self.body_writer.write(part)
+
+    def finish(self):
+        # uploads whatever is left, then the header, and joins them
+        # returns the blob of the final file
+        self.body_writer.close()
+        self.header_blob.upload_from_string(self.joiner.build_header(), content_type="application/octet-stream")
+
+        blob = self.bucket.blob(self.file_path)
+        blob.content_type = self.content_type
+        blob.compose([self.header_blob, self.body_blob])
+
+        self.delete_temp_blobs()
+        return blob
+
+    def abort(self):
+        # stop uploading and clean up anything already in the bucket
+        try:
+            if not self.body_writer.closed:
+                self.body_writer.close()
+        except Exception as e:
+            print("Error closing audio upload", self.file_path, ": ", repr(e))
+        self.delete_temp_blobs()
+
+    def delete_temp_blobs(self):
+        for temp_blob in [self.header_blob, self.body_blob]:
+            try:
+                temp_blob.delete()
+            except Exception as e:
+                print("Error deleting", temp_blob.name, ": ", repr(e))
+
+
+class StreamingEncodedAudioUpload:
+    # same as StreamingAudioUpload, but the episode is encoded to codec on the way
+    # compressed formats don't need a header with the total size, so the encoded audio
+    # goes straight into a resumable upload of the final file
+    def __init__(self, bucket, file_path, codec, chunk_size=AUDIO_UPLOAD_CHUNK_SIZE):
+        self.bucket = bucket
+        self.file_path = file_path
+        self.codec = codec
+        self.joiner = WavJoiner()
+        self.encoder = None
+
+        self.blob = bucket.blob(file_path)
+        self.writer = self.blob.open("wb", chunk_size=chunk_size, content_type=AUDIO_CODECS[codec]["content_type"])
+
+    def write_clip(self, clip_bytes, **segment_fields):
+        # clips must be written in episode order
+        parts = self.joiner.add_clip(clip_bytes, **segment_fields)
+        if self.encoder is None:
+            # the encoder needs the format of the first clip
+            self.encoder = StreamingEncoder(self.codec, self.joiner.audio_format, self.writer.write)
+        for part in parts:
+            self.encoder.write(part)
+
+    def finish(self):
+        # encodes and uploads whatever is left
+        # returns the blob of the final file
+        if self.encoder is None:
+            raise ValueError("No clips have been added")
+        self.encoder.finish()
+        self.writer.close()
+        # size and content type of the finished upload
+        self.blob.reload()
+        return self.blob
+
+    def abort(self):
+        # stop encoding and remove the partial file
+        if self.encoder:
+            try:
+                self.encoder.abort()
+            except Exception as e:
+                print("Error stopping audio encoder", self.file_path, ": ", repr(e))
+        try:
+            if not self.writer.closed:
+                self.writer.close()
+            self.blob.delete()
+        except Exception as e:
+            print("Error removing audio upload", self.file_path, ": ", repr(e))
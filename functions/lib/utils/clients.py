@@ -0,0 +1,81 @@
+# clients kept for the life of the instance, so warm invocations reuse their connections
+# each one is made the first time it's needed, and its sdk is only imported then,
+# so a function that never uses openai doesn't pay to import it on a cold start.
+# firestore.client() is already kept per app by firebase_admin, it's here so everything is in one place.
+# the news client lives on its own event loop thread because an async http client
+# can only be used from the loop it was made on
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(name, create):
+    # returns the client with this name, making it with create() the first time
+    with clients_lock:
+        if name not in clients:
+            clients[name] = create()
+        return clients[name]
+
+
+def get_openai_client():
+    def create():
+        from openai import OpenAI
+        from lib.constants.secrets import OPENAI_KEY
+        # openai_scheduler does the retrying, so every attempt goes through its rate limits
+        return OpenAI(api_key=OPENAI_KEY.value, max_retries=0)
+    return get_client("openai", create)
+
+
+def get_firestore_client():
+    from firebase_admin import firestore
+    return firestore.client()
+
+
+def get_bucket():
+    def create():
+        from firebase_admin import storage
+        return storage.bucket()
+    return get_client("bucket", create)
+
+
+def get_news_loop():
+    # event loop that runs every news fetch on this instance
+    def create():
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="news-loop", daemon=True).start()
+        return loop
+    return get_client("news_loop", create)
+
+
+def run_on_news_loop(coroutine):
+    # runs the coroutine on the news loop and waits for its result
+    # the coroutine sees the caller's context variables (like its trace)
+    # can be called from any thread except the news loop's own
+    result = Future()
+
+    def start():
+        task = asyncio.ensure_future(coroutine)
+
+        def finish(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+        task.add_done_callback(finish)
+
+    get_news_loop().call_soon_threadsafe(start, context=contextvars.copy_context())
+    return result.result()
+
+
+def get_news_client():
+    # pooled http client for feeds and article pages, must be used on the news loop
+    def create():
+        from lib.utils.news_fetching import create_news_client
+        return create_news_client()
+    return get_client("news_http", create)
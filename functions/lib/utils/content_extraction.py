@@ -0,0 +1,125 @@
+# pulls the main article text out of a news page
+# uses lxml's c parser (installed with feedgen) instead of beautifulsoup's pure python one.
+# menus, footers, scripts and related links are removed, then the article is found with
+# the <article> tag or, failing that, by scoring blocks on how much paragraph text they hold.
+# the result is capped so one long article can't take over the prompt
+import re
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from lib.constants.global_constants import MAX_ARTICLE_CHARS
+
+
+# tags that never hold article text
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "nav", "header", "footer", "aside",
+                    "form", "button", "iframe", "svg", "canvas", "video", "audio", "select"]
+# class / id names of blocks that usually aren't part of the article
+BOILERPLATE_PATTERN = re.compile(
+    r"nav|menu|footer|header|sidebar|related|recommend|share|social|promo|newsletter|subscribe|"
+    r"comment|advert|sponsor|cookie|banner|breadcrumb|byline|caption|popup|modal|trending",
+    re.IGNORECASE)
+TEXT_TAGS = ["p", "h1", "h2", "h3", "h4", "li", "blockquote", "pre"]
+# an <article> with less text than this is probably a teaser card, not the story
+MIN_ARTICLE_TAG_CHARS = 200
+
+
+def normalize_whitespace(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def get_link_density(element):
+    text_length = len(normalize_whitespace(element.text_content()))
+    if text_length == 0:
+        return 1
+    link_length = sum(len(normalize_whitespace(link.text_content())) for link in element.iter("a"))
+    return link_length / text_length
+
+
+def get_text_blocks(element):
+    blocks = []
+    for text_element in element.iter(*TEXT_TAGS):
+        # skip blocks nested in another text block, their text is already counted
+        if any(ancestor.tag in TEXT_TAGS for ancestor in text_element.iterancestors()):
+            continue
+        text = normalize_whitespace(text_element.text_content())
+        if text:
+            blocks.append(text)
+    return blocks
+
+
+def remove_boilerplate(tree):
+    for element in list(tree.iter(*BOILERPLATE_TAGS)):
+        element.drop_tree()
+
+    for element in tree.xpath("//*[@class or @id]"):
+        if element.tag in ("html", "body", "article", "main"):
+            continue
+        names = (element.get("class") or "") + " " + (element.get("id") or "")
+        if not BOILERPLATE_PATTERN.search(names):
+            continue
+        # a block named like "page-with-sidebar" can still be wrapped around the whole story
+        paragraph_length = sum(len(block) for block in get_text_blocks(element))
+        if paragraph_length < MIN_ARTICLE_TAG_CHARS or get_link_density(element) > 0.5:
+            element.drop_tree()
+
+
+def find_article_tag(tree):
+    # the <article> with the most paragraph text
+    best_element, best_length = None, 0
+    for element in tree.iter("article"):
+        length = sum(len(block) for block in get_text_blocks(element))
+        if length > best_length:
+            best_element, best_length = element, length
+    return best_element if best_length >= MIN_ARTICLE_TAG_CHARS else None
+
+
+def find_densest_block(tree):
+    # each paragraph adds its length to its parent and half of it to its grandparent
+    # blocks made mostly of links (menus, related stories) score lower
+    scores = {}
+    for paragraph in tree.iter("p", "pre", "blockquote"):
+        length = len(normalize_whitespace(paragraph.text_content()))
+        if length < 25:
+            continue
+        parent = paragraph.getparent()
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + length
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + length / 2
+
+    if not scores:
+        return None
+    return max(scores, key=lambda element: scores[element] * (1 - get_link_density(element)))
+
+
+def cap_text(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    # cut at the last sentence that fits, or the last word if there isn't one
+    cut_text = text[:max_chars]
+    sentence_ends = [match.start() for match in re.finditer(r"[.!?]\s", cut_text)]
+    if sentence_ends and sentence_ends[-1] > max_chars // 2:
+        return cut_text[:sentence_ends[-1] + 1]
+    return cut_text.rsplit(" ", 1)[0]
+
+
+def extract_main_content(page_content, max_chars=MAX_ARTICLE_CHARS):
+    # takes the html of a page
+    # returns the text of the article on it, at most max_chars long
+    try:
+        tree = lxml_html.fromstring(page_content)
+    except (etree.ParserError, ValueError):
+        return ""
+
+    remove_boilerplate(tree)
+
+    main_element = find_article_tag(tree)
+    if main_element is None:
+        main_element = find_densest_block(tree)
+    blocks = get_text_blocks(main_element) if main_element is not None else []
+    text = "\n".join(blocks) if blocks else normalize_whitespace(tree.text_content())
+
+    return cap_text(text, max_chars)
@@ -0,0 +1,96 @@
+# groups firestore writes so an episode run makes a few commits instead of a write per record
+# writes are queued on a WriteBatch and sent together when it's flushed. the pipeline flushes its
+# run's batch at every stage boundary, so whatever a stage wrote (run checkpoint, episode doc,
+# podcast status, ...) is committed together and all or nothing.
+# writes to the same doc in one batch become one write where later fields win. if two of them
+# set the same map field the later map replaces the earlier one, so queue whole maps.
+# every commit is counted and timed per instance (get_write_stats) and is a db.commit span in the current trace
+import threading
+import time
+
+from lib.constants.global_constants import FIRESTORE_BATCH_MAX_WRITES
+from lib.utils.clients import get_firestore_client
+from lib.utils.tracing import span
+
+
+write_stats = {"commits": 0, "writes": 0, "queued": 0, "seconds": 0.0, "max_seconds": 0.0, "errors": 0}
+write_stats_lock = threading.Lock()
+
+
+def record_commit(num_writes, num_queued, seconds, failed=False):
+    with write_stats_lock:
+        write_stats["commits"] += 1
+        write_stats["writes"] += num_writes
+        write_stats["queued"] += num_queued
+        write_stats["seconds"] += seconds
+        write_stats["max_seconds"] = max(write_stats["max_seconds"], seconds)
+        if failed:
+            write_stats["errors"] += 1
+
+
+def get_write_stats():
+    # writes made by this instance since it started
+    with write_stats_lock:
+        return dict(write_stats)
+
+
+class WriteBatch:
+    # safe to queue writes from several threads
+    def __init__(self, db=None, max_writes=FIRESTORE_BATCH_MAX_WRITES):
+        self.db = db
+        self.max_writes = max_writes
+        self.lock = threading.Lock()
+        # (collection name, doc id) -> {"data": ..., "merge": ...}, in the order they were first queued
+        self.pending = {}
+        self.num_queued = 0
+
+    def set(self, collection_name, doc_id, data, merge=True):
+        # merge is true by default for safety, to avoid accidentally deleting data
+        key = (collection_name, str(doc_id))
+        with self.lock:
+            self.num_queued += 1
+            pending_write = self.pending.get(key)
+            if pending_write is None:
+                self.pending[key] = {"data": dict(data), "merge": merge}
+            elif merge:
+                pending_write["data"].update(data)
+            else:
+                self.pending[key] = {"data": dict(data), "merge": False}
+
+    def discard(self):
+        # drops everything queued since the last flush
+        with self.lock:
+            self.pending, self.num_queued = {}, 0
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def flush(self):
+        # commits everything queued so far, in batches of at most max_writes
+        # returns the number of writes made
+        with self.lock:
+            pending, num_queued = self.pending, self.num_queued
+            self.pending, self.num_queued = {}, 0
+        if not pending:
+            return 0
+
+        db = self.db or get_firestore_client()
+        writes = list(pending.items())
+        for start in range(0, len(writes), self.max_writes):
+            chunk = writes[start:start + self.max_writes]
+            batch = db.batch()
+            for (collection_name, doc_id), pending_write in chunk:
+                batch.set(db.collection(collection_name).document(doc_id), pending_write["data"],
+                          merge=pending_write["merge"])
+
+            start_time = time.perf_counter()
+            with span("db.commit", writes=len(chunk)):
+                try:
+                    batch.commit()
+                except Exception:
+                    record_commit(len(chunk), 0, time.perf_counter() - start_time, failed=True)
+                    raise
+            # queued writes are counted with the first commit they went out in
+            record_commit(len(chunk), num_queued if start == 0 else 0, time.perf_counter() - start_time)
+        return len(writes)
@@ -0,0 +1,82 @@
+# small key/value cache of files on local disk
+# when the folder gets bigger than max_bytes the least recently used files are deleted
+# on cloud functions /tmp lives in memory and is kept between warm invocations
+import os
+import threading
+
+
+class DiskLruCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+
+    def get_path(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key):
+        # returns the cached bytes or None
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = cache_file.read()
+            # mark as recently used
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, value):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.get_path(key)
+        # write to a temp file first so readers never see half a file
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(value)
+
+        with self.lock:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+            if self.total_bytes is not None:
+                self.total_bytes += len(value) - old_size
+            self.evict()
+
+    def delete(self, key):
+        with self.lock:
+            try:
+                size = os.path.getsize(self.get_path(key))
+                os.remove(self.get_path(key))
+                if self.total_bytes is not None:
+                    self.total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def list_entries(self):
+        # (path, size, last used time) for every file in the cache
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        # must be called with the lock held
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.list_entries())
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        # oldest first
+        for path, size, _ in sorted(self.list_entries(), key=lambda entry: entry[2]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except FileNotFoundError:
+                pass
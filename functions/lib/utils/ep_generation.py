@@ -1,134 +1,244 @@
 # functions specifically used for generating an episode
-import json
-
-from lib.constants.global_constants import directive, section_directives, date_as_text, time_as_text
-
-from lib.utils.utility_functions import get_full_content_from_rss, get_last_n_episodes, get_audio_bytes_from_text
-
-def build_full_directive(): 
-    headline_articles = get_full_content_from_rss('https://abcnews.go.com/abcnews/topstories') 
-
-    headlines_section_of_text_for_ai = section_directives.get("headlines")
-    for this_article in headline_articles:
-        headlines_section_of_text_for_ai += f"Title: {this_article.get("title")}, Content: {this_article.get("content")}. "
-    
-    
-    # sports_articles = get_full_content_from_rss('https://abcnews.go.com/abcnews/sportsheadlines') 
-
-    # sports_section_of_text_for_ai = section_directives.get("sports")
-    # for this_article in sports_articles:
-    #     sports_section_of_text_for_ai += f"Title: {this_article.get("title")}, Content: {this_article.get("content")}. "
-    
-    
-    tech_articles = get_full_content_from_rss('https://abcnews.go.com/abcnews/technologyheadlines') 
-
-    tech_section_of_text_for_ai = section_directives.get("tech")
-    for this_article in tech_articles:
-        tech_section_of_text_for_ai += f"Title: {this_article.get("title")}, Content: {this_article.get("content")}. "
-    
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.constants.global_constants import (directive, get_section_directives, get_date_context, NEWS_FEEDS, DEFAULT_PODCAST,
+                                            TTS_MAX_WORKERS, AUDIO_FOLDER)
+
+from lib.utils.utility_functions import get_audio_bytes_from_text
+from lib.utils.news_fetching import get_full_content_from_rss_feeds
+from lib.utils.audio_upload import StreamingAudioUpload, StreamingEncodedAudioUpload
+from lib.utils.audio_encoding import AUDIO_CODECS, get_output_codec
+from lib.utils.tts_cache import TtsCache
+from lib.utils.tts_planner import plan_tts_requests
+from lib.utils.article_summaries import summarize_articles
+from lib.utils.episode_memory import load_episode_memory, format_episode_memory
+from lib.utils.story_index import StoryIndex, load_story_index, prefer_new_articles, make_story
+from lib.utils.prompt_builder import PromptBuilder, dedupe_articles, format_token_report
+from lib.utils.tracing import span, submit_in_context
+
+
+def build_full_directive(feeds=NEWS_FEEDS, openai_client=None, date_context=None,
+                         podcast_id=DEFAULT_PODCAST["podcast_id"]):
+    # fetch every section's feed at the same time
+    # with an openai client, articles go in the prompt as summaries instead of their full text
+    # stories the podcast covered in the last few days are only used when a feed is short on new ones
+    # returns the directive and the stories in it, to add to the podcast's story index once the episode is saved
+    section_directives = get_section_directives(date_context)
+    sections = list(feeds.keys())
+    with span("db.story_index") as index_span:
+        try:
+            story_index = load_story_index(podcast_id)
+        except Exception as e:
+            print("Error loading story index: ", repr(e))
+            story_index = StoryIndex()
+        index_span.set(stories=len(story_index))
+
+    urls = [feeds[section] for section in sections]
+    with span("news.fetch", feeds=len(sections)) as fetch_span:
+        articles_per_section = get_full_content_from_rss_feeds(urls, story_index=story_index)
+        articles_per_section, num_covered = prefer_new_articles(articles_per_section, story_index)
+        fetch_span.set(articles=sum(len(articles) for articles in articles_per_section), covered_articles=num_covered)
+    # the same story is often in top stories and a category feed
+    articles_per_section, num_duplicates = dedupe_articles(articles_per_section)
+    if openai_client:
+        with span("summaries"):
+            articles_per_section = summarize_articles(articles_per_section, openai_client)
+
+    prompt_builder = PromptBuilder()
+    prompt_builder.add_text("directive", directive)
+    for section, articles in zip(sections, articles_per_section):
+        # podcasts can have sections without their own directive
+        intro = section_directives.get(section) or f"Here are the latest {section} articles: "
+        prompt_builder.add_articles(section, intro, articles)
+
+    prompt_builder.add_text("date", section_directives.get("date"))
+    prompt_builder.add_text("fun_facts", section_directives.get("fun_facts"))
+
+    # only the topics of recent episodes, not their scripts
+    with span("db.episode_memory") as memory_span:
+        try:
+            memory_entries = load_episode_memory(podcast_id)
+        except Exception as e:
+            print("Error loading episode memory: ", repr(e))
+            memory_entries = []
+        memory_span.set(episodes=len(memory_entries))
+    if memory_entries:
+        prompt_builder.add_budgeted_text("previous_eps", section_directives.get("previous_eps"),
+                                         format_episode_memory(memory_entries))
+
+    with span("prompt.build") as prompt_span:
+        full_directive, token_report = prompt_builder.build()
+        prompt_span.set(duplicate_articles=num_duplicates,
+                        **{f"{name}_tokens": tokens for name, tokens in token_report.items()})
+    print(format_token_report(token_report) + f", {num_duplicates} duplicate articles removed, "
+          f"{num_covered} already covered articles used")
+
+    stories = [make_story(article) for articles in articles_per_section for article in articles]
+    return full_directive, stories
+
+
+
+# generate audio for one tts request (one or more lines, or part of a long line, see tts_planner.py)
+# uses the tts cache when one is given
+# failed tts calls are retried by openai_scheduler, which knows which errors are worth it and how long to wait
+# returns audio bytes and stats about the call
+def synthesize_tts_request(tts_request, openai_client, tts_cache=None):
+    line_number = tts_request["line_numbers"][0]
+    with span("tts.request", line_number=line_number, lines=len(tts_request["line_numbers"])) as request_span:
+        start_time = time.perf_counter()
+        source = "tts"
+        try:
+            if tts_cache:
+                audio_bytes, source = tts_cache.get_audio_bytes_from_text(openai_client=openai_client, 
+                                    text=tts_request["text"],
+                                    voice=tts_request["voice"])
+            else:
+                audio_bytes = get_audio_bytes_from_text(openai_client=openai_client, 
+                                    text=tts_request["text"],
+                                    voice=tts_request["voice"])
+        except Exception as e:
+            raise Exception(f"Failed to generate audio for line {line_number}") from e
+
+        request_stats = {
+            "line_number": line_number,
+            "line_numbers": tts_request["line_numbers"],
+            "chunk": tts_request["chunk"],
+            "num_chunks": tts_request["num_chunks"],
+            "voice": tts_request["voice"],
+            "characters": len(tts_request["text"]),
+            "text_hash": get_text_hash(tts_request["text"]),
+            "source": source,
+            "seconds": time.perf_counter() - start_time,
+            "bytes": len(audio_bytes),
+        }
+        request_span.set(**{key: request_stats[key] for key in ["voice", "characters", "source", "bytes"]})
+    return audio_bytes, request_stats
+
+
+# generate audio for every tts request using a pool of workers
+# tts_requests can be a list or an iterator of requests that are still being planned
+# yields (request, audio bytes, stats) in order as soon as each request and the ones before it are done
+# only a limited number of requests run ahead of the one being waited on, so memory stays bounded
+def synthesize_requests_in_order(tts_requests, openai_client, max_workers=TTS_MAX_WORKERS, tts_cache=None):
+    max_workers = max(1, max_workers)
+    max_requests_ahead = max_workers * 2
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # (request, future) of submitted requests that haven't been yielded, in order
+        pending_requests = deque()
+        try:
+            for tts_request in tts_requests:
+                pending_requests.append((tts_request, submit_in_context(executor, synthesize_tts_request, tts_request,
+                                                                        openai_client, tts_cache)))
+                # hand over finished requests while waiting for the next one, wait when too far ahead
+                while pending_requests and (pending_requests[0][1].done() or len(pending_requests) >= max_requests_ahead):
+                    done_request, future = pending_requests.popleft()
+                    yield done_request, *future.result()
+
+            while pending_requests:
+                done_request, future = pending_requests.popleft()
+                yield done_request, *future.result()
+        finally:
+            # a request failed (or the caller stopped early), don't keep paying for the rest
+            for _, future in pending_requests:
+                future.cancel()
+
+
+# generate audio for every line of the script, with the requests planned by tts_planner.py
+# podcast_script can be a list or an iterator of lines that are still being written
+# yields (request, audio bytes, stats) in script order
+def synthesize_script_in_order(podcast_script, openai_client, max_workers=TTS_MAX_WORKERS, tts_cache=None):
+    return synthesize_requests_in_order(plan_tts_requests(podcast_script), openai_client, max_workers, tts_cache)
+
+
+# print how long tts took per request so concurrency can be tuned
+def report_tts_latency(all_request_stats, total_seconds, max_workers=TTS_MAX_WORKERS):
+    if not all_request_stats:
+        return
     
-    entertainment_articles = get_full_content_from_rss('https://abcnews.go.com/abcnews/entertainmentheadlines') 
+    request_seconds = sorted(request_stats["seconds"] for request_stats in all_request_stats)
+    num_lines = len({line_number for request_stats in all_request_stats for line_number in request_stats["line_numbers"]})
+    print(f"tts: {len(request_seconds)} requests for {num_lines} lines with {max_workers} workers in {total_seconds:.2f}s")
+    print(f"    per request: min {request_seconds[0]:.2f}s, "
+          f"median {request_seconds[len(request_seconds) // 2]:.2f}s, "
+          f"p90 {request_seconds[int(len(request_seconds) * 0.9)]:.2f}s, "
+          f"max {request_seconds[-1]:.2f}s, "
+          f"sum {sum(request_seconds):.2f}s")
+    for request_stats in all_request_stats:
+        print(f"    lines {format_line_numbers(request_stats)}: {request_stats['seconds']:.2f}s, "
+              f"{request_stats['characters']} chars, from {request_stats['source']}")
+
+
+def format_line_numbers(request_stats):
+    # like "3-5", or "7 (part 2 of 3)" for part of a split line
+    line_numbers = request_stats["line_numbers"]
+    text = str(line_numbers[0]) if len(line_numbers) == 1 else f"{line_numbers[0]}-{line_numbers[-1]}"
+    if request_stats["num_chunks"] > 1:
+        text += f" (part {request_stats['chunk'] + 1} of {request_stats['num_chunks']})"
+    return text
+
+
+# take podcast script (list or iterator of podcast lines with voices)
+# generate audio for lines in parallel
+# upload each line to the bucket as soon as it's ready, in script order, encoded to the episode codec
+# with tts_cache_folder, clips are also kept in that bucket folder so a retry of the run doesn't pay for them again
+# returns file name, public url, size, content type, duration and segment index of the episode audio
+def stream_audio_from_script_to_bucket(podcast_script, openai_client, bucket, max_workers=TTS_MAX_WORKERS, audio_folder=AUDIO_FOLDER,
+                                       date_context=None, tts_cache_folder=None):
+    codec = get_output_codec()
+    audio_file_name = get_audio_file_name(AUDIO_CODECS[codec]["extension"], date_context)
+    if codec == "wav":
+        audio_upload = StreamingAudioUpload(bucket, audio_folder + audio_file_name)
+    else:
+        audio_upload = StreamingEncodedAudioUpload(bucket, audio_folder + audio_file_name, codec)
+    tts_cache = TtsCache(bucket, tts_cache_folder)
+
+    start_time = time.perf_counter()
+    all_request_stats = []
+    try:
+        for _, audio_bytes, request_stats in synthesize_script_in_order(podcast_script, openai_client, max_workers, tts_cache):
+            with span("audio.write_clip", bytes=len(audio_bytes)):
+                audio_upload.write_clip(audio_bytes, **get_clip_fields(request_stats))
+            all_request_stats.append(request_stats)
+        with span("audio.upload_finish") as finish_span:
+            blob = audio_upload.finish()
+            finish_span.set(bytes=blob.size)
+    except Exception:
+        audio_upload.abort()
+        raise
+    finally:
+        tts_cache.finish()
+    report_tts_latency(all_request_stats, time.perf_counter() - start_time, max_workers=max_workers)
+    print(tts_cache.get_summary())
 
-    entertainment_section_of_text_for_ai = section_directives.get("entertainment")
-    for this_article in entertainment_articles:
-        entertainment_section_of_text_for_ai += f"Title: {this_article.get("title")}, Content: {this_article.get("content")}. "
-    
-
-
-    previous_eps = get_last_n_episodes(5)
-    # trimming eps to help ai focus on important content
-    trimmed_eps = [{
-        "created_at": this_ep.get("created_at"), 
-        "script_text": this_ep.get("script_text")
-        } for this_ep in previous_eps]
-    previous_eps_as_text = json.dumps(trimmed_eps, default=str)
-    previous_eps_section = section_directives.get("previous_eps") + previous_eps_as_text
-
-    fun_facts_section = section_directives.get("fun_facts")
-    
-    
-    current_datetime_section = section_directives.get("date")
-
-    return (directive 
-                    + headlines_section_of_text_for_ai
-                    #  + sports_section_of_text_for_ai
-                    + tech_section_of_text_for_ai
-                    + entertainment_section_of_text_for_ai 
-                    + current_datetime_section
-                    + fun_facts_section
-                    + previous_eps_section)
-
-
-
-# take podcast script (list of podcast lines with voices)
-# generate audio for lines individually
-# combine individual audio segments into full podcast
-# returns list of audio bytes
-def get_audio_from_script(podcast_script, openai_client):
-    audio_bytes = []
-    for script_line in podcast_script:
-        audio_bytes.append(get_audio_bytes_from_text(openai_client=openai_client, 
-                            text=script_line.text,
-                            voice=script_line.voice.lower()))
-
-    delay_length_between_audio_clips = 2000
-    def fade_in_audio(audio_bytes):
-        # mute first and last 100 bytes of audio (set to 0)
-        # helps with combining clips without popping
-        # actually removing some kind of meta data from beginning
-        # can't do this to first clip
-
-        CHANGE_RANGE = 100
-        audio_length = len(audio_bytes)
-        if audio_length <= CHANGE_RANGE:
-            return audio_bytes
-        
-        audio_list = list(audio_bytes)
-
-        for i in range(0, CHANGE_RANGE):
-            # mute first 100 bytes
-            audio_list[i] = 0
-        #     # mute last 100 bytes
-            audio_list[audio_length - i - 1] = 0
-        
-        # add some empty space at the beginning
-        # to simulate a pause before speech
-        audio_list = [0] * delay_length_between_audio_clips + audio_list
-
-        return bytes(audio_list)
-    
-    def sum_bytes(bytes_list):
-        if not bytes_list or len(bytes_list) < 1:
-            raise ValueError("Bad input for bytes_list")
-        if len(bytes_list) == 1:
-            return bytes_list[0]
+    blob.make_public()
 
-        combined_bytes = bytes_list[0]
-        for i in range(1, len(bytes_list)):
-            combined_bytes += bytes_list[i]
-        
-        return combined_bytes
+    return {"file_name": audio_file_name, "file_path": audio_folder + audio_file_name, "url": blob.public_url,
+            "size": blob.size, "content_type": blob.content_type,
+            "duration": round(audio_upload.joiner.duration, 3), "segments": audio_upload.joiner.segments}
 
 
-    combined_audio_bytes = audio_bytes[0]
-    if len(audio_bytes) > 1:
-        combined_audio_bytes += sum_bytes( list(map(fade_in_audio, audio_bytes[1:])))
+def get_text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-    return combined_audio_bytes
 
+# what a clip's segment in the episode's segment index keeps about it
+# line_number is the clip's first line. chunk and num_chunks are only kept for the parts of a split line
+def get_segment_fields(request_stats):
+    segment_fields = {key: request_stats[key] for key in ["line_number", "line_numbers", "voice", "text_hash"]}
+    if request_stats["num_chunks"] > 1:
+        segment_fields.update(chunk=request_stats["chunk"], num_chunks=request_stats["num_chunks"])
+    return segment_fields
 
-def upload_audio(combined_audio_bytes, bucket): 
-    
-    audio_file_name = "daily_update_" + date_as_text + "_" + time_as_text + ".wav"
-    file_path = "audio/testUser/podcastId/" + audio_file_name
 
-    
-    blob = bucket.blob(file_path)
-    
-    # Upload the audio bytes
-    blob.upload_from_string(combined_audio_bytes, content_type="audio/wav") 
-    blob.make_public()
+# arguments for write_clip: the clip's segment fields, and no gap before the later parts of a split line
+def get_clip_fields(request_stats):
+    return dict(get_segment_fields(request_stats), with_gap=request_stats["chunk"] == 0)
 
-    audio_url = blob.public_url
 
-    return {"file_name": audio_file_name, "url": audio_url}
+def get_audio_file_name(extension="wav", date_context=None):
+    date_context = date_context or get_date_context()
+    return "daily_update_" + date_context["date_as_text"] + "_" + date_context["time_as_text"] + "." + extension
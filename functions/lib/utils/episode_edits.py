@@ -0,0 +1,165 @@
+# makes chosen lines of a published episode again and splices them into its audio
+# the episode's segment index (saved with the episode) says where each clip is and which lines are in it.
+# a line is made again with the other lines of its clip (see tts_planner.py), with the same requests as before.
+# wav episodes only have those clips replaced, every other byte is copied as it is.
+# mp3 and opus can't be cut at a clip without decoding them, so those episodes are joined again
+# from every clip's audio and encoded again. clips come from this instance's tts disk cache,
+# and any that aren't there go to tts again (the run's clips in the bucket are gone once its audio was uploaded)
+from firebase_admin import firestore
+
+from lib.constants.global_constants import AUDIO_UPLOAD_TEMP_FOLDER, TTS_MAX_WORKERS, RESYNTHESIZE_MAX_TEXT_CHARS
+from lib.utils.utility_functions import Podcast
+from lib.utils.audio_assembly import parse_wav, splice_wav_clips
+from lib.utils.audio_encoding import AUDIO_CODECS
+from lib.utils.audio_upload import StreamingEncodedAudioUpload
+from lib.utils.ep_generation import synthesize_requests_in_order, get_clip_fields
+from lib.utils.tts_cache import TtsCache
+from lib.utils.tts_planner import plan_tts_requests_for_segments
+from lib.utils.podcasts import load_podcast
+from lib.utils.rss_feed import update_episode_in_feed
+from lib.utils.db_writes import WriteBatch
+from lib.utils.clients import get_firestore_client
+from lib.utils.tracing import span
+
+
+def get_codec_from_file_path(file_path):
+    extension = file_path.rsplit(".", 1)[-1]
+    for codec, codec_settings in AUDIO_CODECS.items():
+        if codec_settings["extension"] == extension:
+            return codec
+    raise Exception("Unknown episode audio type:", file_path)
+
+
+def find_episode(episode_id):
+    # returns the episode's doc, or None if there's no such episode
+    doc = get_firestore_client().collection("episodes").document(episode_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def load_episode(episode_id):
+    episode = find_episode(episode_id)
+    if episode is None:
+        raise Exception("Episode not found:", episode_id)
+    return episode
+
+
+def get_lines_error(episode, line_numbers, new_texts=None):
+    # returns why the lines can't be made again, or None if they can
+    # only lines in the episode's segment index can be made again
+    if not episode.get("segments"):
+        return "episode has no segment index"
+    indexed_line_numbers = {line_number for segment in episode["segments"]
+                            for line_number in segment.get("line_numbers") or [segment["line_number"]]}
+    for line_number in sorted(set(line_numbers) | set(new_texts or {})):
+        if line_number not in indexed_line_numbers:
+            return f"line {line_number} is not in the episode"
+    for line_number, text in (new_texts or {}).items():
+        if not isinstance(text, str) or not text.strip():
+            return f"text for line {line_number} is empty"
+        if len(text) > RESYNTHESIZE_MAX_TEXT_CHARS:
+            return f"text for line {line_number} is longer than {RESYNTHESIZE_MAX_TEXT_CHARS} characters"
+    return None
+
+
+def get_episode_file_path(episode, podcast):
+    # older episodes only have their file name
+    return episode.get("file_path") or podcast["audio_folder"] + episode["file_name"]
+
+
+def splice_wav_episode(bucket, file_path, segments, new_clips):
+    # returns the episode's blob and the joiner with its new segments
+    blob = bucket.blob(file_path)
+    episode_audio = parse_wav(blob.download_as_bytes())
+    joiner, parts = splice_wav_clips(episode_audio, segments, new_clips)
+    # one upload replaces the whole file, so listeners never get a half written episode
+    blob.upload_from_string(b"".join([joiner.build_header()] + parts), content_type="audio/wav")
+    return blob, joiner
+
+
+def rejoin_encoded_episode(bucket, file_path, codec, script, segments, openai_client, tts_cache, max_workers=TTS_MAX_WORKERS):
+    # the new clips are already in the tts cache, so those come from there
+    # (a clip that isn't in the cache goes to tts again)
+    # returns the episode's blob and the joiner with its new segments
+    temp_blob = bucket.blob(AUDIO_UPLOAD_TEMP_FOLDER + file_path)
+    audio_upload = StreamingEncodedAudioUpload(bucket, temp_blob.name, codec)
+    try:
+        tts_requests = plan_tts_requests_for_segments(script, segments)
+        for _, audio_bytes, request_stats in synthesize_requests_in_order(tts_requests, openai_client, max_workers, tts_cache):
+            audio_upload.write_clip(audio_bytes, **get_clip_fields(request_stats))
+        audio_upload.finish()
+    except Exception:
+        audio_upload.abort()
+        raise
+
+    # swapped in at once, like the wav upload
+    blob = bucket.blob(file_path)
+    blob.content_type = AUDIO_CODECS[codec]["content_type"]
+    blob.compose([temp_blob])
+    try:
+        temp_blob.delete()
+    except Exception as e:
+        print("Error deleting", temp_blob.name, ": ", repr(e))
+    return blob, audio_upload.joiner
+
+
+def resynthesize_episode_lines(episode_id, line_numbers, openai_client, bucket, new_texts=None, max_workers=TTS_MAX_WORKERS,
+                               episode=None):
+    # line_numbers are the lines to make again (like ones that were mispronounced)
+    # new_texts is {line number: text} for lines to rewrite, they're always made again
+    # the other lines in the same clips as those lines are made again with them
+    # episode is the episode's doc when the caller already has it
+    # updates the episode's audio, record and feed item
+    # returns the lines that were made again and the episode's new duration, size and segments
+    new_texts = new_texts or {}
+    episode = episode or load_episode(episode_id)
+    lines_error = get_lines_error(episode, line_numbers, new_texts)
+    if lines_error:
+        raise Exception("Can't make lines again:", episode_id, lines_error)
+    podcast = load_podcast(episode.get("podcast_id"))
+    script = Podcast.model_validate_json(episode["script_text"]).script
+
+    line_numbers = sorted(set(line_numbers) | set(new_texts))
+    for line_number, text in new_texts.items():
+        script[line_number] = script[line_number].model_copy(update={"text": text})
+
+    tts_cache = TtsCache()
+    tts_requests = plan_tts_requests_for_segments(script, episode["segments"], line_numbers)
+    line_numbers = sorted({line_number for tts_request in tts_requests for line_number in tts_request["line_numbers"]})
+    # the new clips replace the old clip they're in, which is keyed by the line number of its segment
+    clip_line_numbers = {segment["line_number"] for segment in episode["segments"]}
+    new_clips = {}
+    with span("tts.resynthesize", lines=len(line_numbers), requests=len(tts_requests)):
+        # without the cache, since the cached audio for the same text is what's being replaced
+        clip_line_number = None
+        for tts_request, audio_bytes, request_stats in synthesize_requests_in_order(tts_requests, openai_client, max_workers):
+            tts_cache.put(tts_request["text"], tts_request["voice"], audio_bytes)
+            if tts_request["line_numbers"][0] in clip_line_numbers:
+                clip_line_number = tts_request["line_numbers"][0]
+            new_clips.setdefault(clip_line_number, []).append((audio_bytes, get_clip_fields(request_stats)))
+
+    file_path = get_episode_file_path(episode, podcast)
+    codec = get_codec_from_file_path(file_path)
+    with span("audio.splice", codec=codec) as splice_span:
+        if codec == "wav":
+            blob, joiner = splice_wav_episode(bucket, file_path, episode["segments"], new_clips)
+        else:
+            blob, joiner = rejoin_encoded_episode(bucket, file_path, codec, script, episode["segments"], openai_client,
+                                                  tts_cache, max_workers)
+        blob.reload()
+        blob.make_public()
+        splice_span.set(bytes=blob.size)
+
+    duration = round(joiner.duration, 3)
+    writes = WriteBatch()
+    writes.set("episodes", episode_id, {
+        "script_text": Podcast(script=script).model_dump_json(),
+        "segments": joiner.segments,
+        "duration": duration,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
+    writes.flush()
+    # the feed has the file's size
+    update_episode_in_feed(bucket, blob.public_url, blob.size, podcast)
+
+    return {"episode_id": episode_id, "lines": line_numbers, "duration": duration, "size": blob.size,
+            "segments": joiner.segments}
@@ -0,0 +1,98 @@
+# a short record of what each podcast's recent episodes talked about
+# after an episode is made, its topics and callbacks (running jokes, promised follow ups, ...) are
+# pulled out of the script and added to the podcast's doc in the episode_memory collection.
+# the next script prompt gets those few lines instead of the last few episodes' whole scripts
+from typing import List
+
+from pydantic import BaseModel
+from firebase_admin import firestore
+
+from lib.constants.global_constants import (EPISODE_MEMORY_MODEL, EPISODE_MEMORY_MAX_EPISODES, EPISODE_MEMORY_MAX_TOPICS,
+                                            EPISODE_MEMORY_MAX_CALLBACKS)
+from lib.utils.utility_functions import message_ai_structured
+from lib.utils.openai_scheduler import PRIORITY_CHAT
+from lib.utils.clients import get_firestore_client
+
+
+MEMORY_COLLECTION = "episode_memory"
+
+notes_directive = f"""Here is the script of today's episode of a daily news podcast.
+List the topics it covered, at most {EPISODE_MEMORY_MAX_TOPICS}. Each topic should be a few words that name the specific story,
+like "Fed holds interest rates" instead of "economy".
+Also list at most {EPISODE_MEMORY_MAX_CALLBACKS} callbacks: running jokes, things the hosts promised to follow up on,
+or moments a later episode could refer back to. Leave callbacks empty if there aren't any.
+Script:
+"""
+
+
+class EpisodeNotes(BaseModel):
+    topics: List[str]
+    callbacks: List[str]
+
+
+# memory doc example:
+# {
+#     "podcast_id": "PIiVCmdQfcGeSE7BZMj5",
+#     "entries": [
+#         {
+#             "episode_id": "ep_1733621011000_1234",
+#             "date": "Sunday, December 08, 2024",
+#             "topics": ["Fed holds interest rates", "Lakers beat the Celtics"],
+#             "callbacks": ["Samuel promised to try the new pizza place"]
+#         }
+#     ],  newest first
+#     "updated_at": "Sun, 08 Dec 2024 01:24:55 GMT"
+# }
+def get_memory_ref(podcast_id):
+    return get_firestore_client().collection(MEMORY_COLLECTION).document(str(podcast_id))
+
+
+def load_episode_memory(podcast_id):
+    # returns the podcast's recent entries, newest first
+    # only the entries field is read
+    doc = get_memory_ref(podcast_id).get(field_paths=["entries"])
+    if not doc.exists:
+        return []
+    return (doc.to_dict() or {}).get("entries") or []
+
+
+def format_episode_memory(entries):
+    # one short line per episode for the script prompt
+    lines = []
+    for entry in entries:
+        line = f"{entry.get('date')}: " + "; ".join(entry.get("topics") or [])
+        if entry.get("callbacks"):
+            line += ". Callbacks: " + "; ".join(entry["callbacks"])
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def make_episode_notes(openai_client, podcast_response):
+    script_text = "\n".join(f"{line.voice}: {line.text}" for line in podcast_response.script)
+    notes = message_ai_structured(openai_client, message=notes_directive + script_text, structure=EpisodeNotes,
+                                  model=EPISODE_MEMORY_MODEL, priority=PRIORITY_CHAT)
+    if notes is None:
+        raise Exception("Error getting notes for episode")
+    return notes
+
+
+def add_to_episode_memory(podcast_id, episode_id, date, notes, writes=None):
+    # adds the episode to the front of the podcast's memory and drops the oldest entries
+    # adding the same episode again replaces its entry, so a retried run doesn't add it twice
+    # writes is the run's WriteBatch, when there is one
+    entries = [entry for entry in load_episode_memory(podcast_id) if entry.get("episode_id") != episode_id]
+    entries.insert(0, {
+        "episode_id": episode_id,
+        "date": date,
+        "topics": notes.topics[:EPISODE_MEMORY_MAX_TOPICS],
+        "callbacks": notes.callbacks[:EPISODE_MEMORY_MAX_CALLBACKS],
+    })
+    memory = {
+        "podcast_id": str(podcast_id),
+        "entries": entries[:EPISODE_MEMORY_MAX_EPISODES],
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+    if writes is not None:
+        writes.set(MEMORY_COLLECTION, str(podcast_id), memory, merge=False)
+    else:
+        get_memory_ref(podcast_id).set(memory)
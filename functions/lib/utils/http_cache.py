@@ -0,0 +1,82 @@
+# cache for rss feeds and article pages
+# keeps the etag / last-modified validators, the body and the parsed result of each url
+# so the next request can be conditional and a 304 is served from cache without re-parsing.
+# entries older than the ttl are dropped, and the disk cache keeps the folder under its size limit
+import hashlib
+import json
+import time
+
+from lib.constants.global_constants import HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, HTTP_CACHE_TTL
+from lib.utils.disk_cache import DiskLruCache
+
+
+# shared by every run on this instance
+http_disk_cache = DiskLruCache(HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES)
+
+
+class HttpCache:
+    def __init__(self, disk_cache=http_disk_cache, ttl=HTTP_CACHE_TTL):
+        self.disk_cache = disk_cache
+        self.ttl = ttl
+
+    def get_key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def load(self, url):
+        # returns dict with etag, last_modified, fetched_at and parsed, or None
+        key = self.get_key(url)
+        entry_text = self.disk_cache.get(key + ".json")
+        if entry_text is None:
+            return None
+
+        entry = json.loads(entry_text)
+        if entry.get("url") != url or time.time() - entry.get("fetched_at", 0) > self.ttl:
+            self.delete(url)
+            return None
+        return entry
+
+    def load_body(self, url):
+        return self.disk_cache.get(self.get_key(url) + ".body")
+
+    def get_conditional_headers(self, entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self, url, response, parsed, parser_name=None):
+        # parsed must be json serializable
+        # parser_name records how parsed was made, so it can be redone from the body if the parser changes
+        key = self.get_key(url)
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "parser": parser_name,
+            "parsed": parsed,
+        }
+        try:
+            self.disk_cache.put(key + ".body", response.content)
+            self.disk_cache.put(key + ".json", json.dumps(entry).encode("utf-8"))
+        except OSError as e:
+            # the cache should never stop an episode from being made
+            print("Error writing http cache for", url, ": ", repr(e))
+
+    def refresh(self, url, entry):
+        # server said the page hasn't changed, restart its ttl
+        entry["fetched_at"] = time.time()
+        self.update(url, entry)
+
+    def update(self, url, entry):
+        try:
+            self.disk_cache.put(self.get_key(url) + ".json", json.dumps(entry).encode("utf-8"))
+        except OSError as e:
+            print("Error writing http cache for", url, ": ", repr(e))
+
+    def delete(self, url):
+        key = self.get_key(url)
+        self.disk_cache.delete(key + ".json")
+        self.disk_cache.delete(key + ".body")
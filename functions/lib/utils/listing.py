@@ -0,0 +1,129 @@
+# lists podcasts and episodes a page at a time, newest first
+# only the requested fields are read (select), so big fields like script_text and segments
+# aren't paid for unless they're asked for. the next page starts after the last doc of the one
+# before it (start_after), using a page token made from that doc's created_at and id, so every
+# page costs the same no matter how far into the collection it is.
+# docs are handed on as they're read, and stream_page_response writes them out the same way
+import base64
+import json
+from datetime import datetime
+
+from lib.constants.global_constants import LIST_PAGE_SIZE, LIST_MAX_PAGE_SIZE
+from lib.utils.clients import get_firestore_client
+
+
+ORDER_FIELD = "created_at"
+# fields listed when the caller doesn't ask for others
+PODCAST_LIST_FIELDS = ["user_id", "title", "description", "cover_image_url", "rss_url", "active",
+                       "last_run_status", "last_episode_date", "created_at", "updated_at"]
+EPISODE_LIST_FIELDS = ["episode_id", "podcast_id", "user_id", "title", "description", "url", "duration", "topics",
+                       "created_at"]
+
+
+def encode_page_token(doc_id, data):
+    # created_at is kept with its type: older docs have it as a string, and firestore only matches
+    # a cursor value against docs whose value has the same type
+    # returns None when created_at is something a token can't hold
+    created_at = data.get(ORDER_FIELD)
+    if isinstance(created_at, datetime):
+        token = {"id": doc_id, ORDER_FIELD: created_at.isoformat()}
+    elif created_at is None or isinstance(created_at, (str, int, float)):
+        token = {"id": doc_id, ORDER_FIELD: created_at, "type": "value"}
+    else:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(token).encode("utf-8")).decode("ascii")
+
+
+def decode_page_token(page_token):
+    # returns the cursor for start_after
+    try:
+        token = json.loads(base64.urlsafe_b64decode(page_token.encode("ascii")))
+        created_at = token[ORDER_FIELD]
+        if token.get("type") != "value" and created_at is not None:
+            created_at = datetime.fromisoformat(created_at)
+        return {ORDER_FIELD: created_at, "__name__": token["id"]}
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Bad page token:", page_token) from e
+
+
+def get_page_size(page_size):
+    # page_size can come straight from a request's args
+    try:
+        page_size = int(page_size or LIST_PAGE_SIZE)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Bad page size:", page_size) from e
+    return max(1, min(page_size, LIST_MAX_PAGE_SIZE))
+
+
+def list_page(collection_name, fields, page_size=LIST_PAGE_SIZE, page_token=None, filters=()):
+    # yields (doc id, data) for one page of docs, newest first, as they're read
+    # filters are (field, op, value) like ("podcast_id", "==", "abc")
+    # a filtered list needs a composite index on the filtered field and created_at
+    query = get_firestore_client().collection(collection_name)
+    for field_path, op_string, value in filters:
+        query = query.where(field_path, op_string, value)
+    # the doc id breaks ties between docs created at the same time
+    query = query.order_by(ORDER_FIELD, direction="DESCENDING").order_by("__name__", direction="DESCENDING")
+    # created_at is always read, the next page token needs it
+    query = query.select(list(dict.fromkeys(list(fields) + [ORDER_FIELD])))
+    if page_token:
+        query = query.start_after(decode_page_token(page_token))
+    for doc in query.limit(get_page_size(page_size)).stream():
+        yield doc.id, doc.to_dict()
+
+
+def list_docs(collection_name, fields, num_docs, filters=()):
+    # returns (doc id, data) for the newest num_docs docs, reading as many pages as that takes
+    docs = []
+    page_token = None
+    while len(docs) < num_docs:
+        page_size = min(num_docs - len(docs), LIST_MAX_PAGE_SIZE)
+        page = list(list_page(collection_name, fields, page_size, page_token, filters))
+        docs += page
+        if len(page) < page_size:
+            break
+        page_token = encode_page_token(*page[-1])
+        if page_token is None:
+            print("Error making page token for", collection_name, page[-1][0], ": ", repr(page[-1][1].get(ORDER_FIELD)))
+            break
+    return docs
+
+
+def stream_page_response(collection_name, fields, page_size=LIST_PAGE_SIZE, page_token=None, filters=()):
+    # json response that's written as the docs are read:
+    # {"items": [{"id": ..., "data": {...}}, ...], "next_page_token": ...}
+    # next_page_token is null on the last page
+    # imported here so the generators that list episodes don't load it
+    from firebase_functions import https_fn
+
+    try:
+        page_size = get_page_size(page_size)
+    except ValueError:
+        return https_fn.Response("bad page size", status=400)
+    if page_token:
+        # checked before the response starts, so a bad token is a 400 instead of a broken stream
+        try:
+            decode_page_token(page_token)
+        except ValueError:
+            return https_fn.Response("bad pageToken", status=400)
+
+    def generate():
+        yield '{"items": ['
+        num_items = 0
+        last_doc = None
+        for doc_id, data in list_page(collection_name, fields, page_size, page_token, filters):
+            yield ("," if num_items else "") + json.dumps({"id": doc_id, "data": data}, default=str)
+            num_items += 1
+            last_doc = (doc_id, data)
+        next_page_token = encode_page_token(*last_doc) if num_items == page_size else None
+        if num_items == page_size and next_page_token is None:
+            # the body is already partly sent, so the list ends here instead of failing
+            print("Error making page token for", collection_name, last_doc[0], ": ", repr(last_doc[1].get(ORDER_FIELD)))
+        yield '], "next_page_token": ' + json.dumps(next_page_token) + '}'
+
+    return https_fn.Response(generate(), status=200, content_type="application/json")
+
+
+def get_list_fields(fields_arg, default_fields):
+    # ?fields=title,url picks the fields, otherwise the defaults are read
+    return [field for field in fields_arg.split(",") if field] if fields_arg else default_fields
@@ -0,0 +1,211 @@
+# fetches news articles from rss feeds concurrently
+# all feeds share one pooled http client
+# each host gets its own concurrency and rate limit instead of a global sleep
+# each feed over-fetches a few articles and keeps the first n that succeed,
+# the rest are cancelled.
+# feeds and pages go through the http cache, so unchanged ones come back as 304s
+# with a story index, stories the podcast already covered are only fetched if a feed is short on new ones
+import asyncio
+import time
+from urllib.parse import urlparse
+
+import httpx
+import feedparser
+
+from lib.constants.global_constants import (NUM_ARTICLES_PER_CATEGORY, NEWS_FETCH_TIMEOUT, NEWS_MAX_CONNECTIONS,
+                                            NEWS_MAX_CONCURRENCY_PER_HOST, NEWS_MIN_INTERVAL_PER_HOST,
+                                            NEWS_EXTRA_ARTICLES_PER_FEED, NEWS_USER_AGENT, FEED_CACHE_FRESH_SECONDS,
+                                            ARTICLE_CACHE_FRESH_SECONDS, MAX_ARTICLE_CHARS)
+from lib.utils.http_cache import HttpCache
+from lib.utils.content_extraction import extract_main_content
+from lib.utils.tracing import span, set_span_attributes
+from lib.utils.clients import get_news_client, run_on_news_loop
+
+
+# articles that don't have any useful text to scrape
+SKIPPED_TITLES = ["LIVE:  ABC News Live"]
+# stored with cached results. change these when a parser changes so cached pages are parsed again
+FEED_PARSER = "feed_entries_v1"
+ARTICLE_PARSER = f"main_content_v1_{MAX_ARTICLE_CHARS}"
+
+
+def parse_feed(feed_content):
+    # only keep what's needed from each entry so it can be cached as json
+    feed = feedparser.parse(feed_content)
+    return [{
+        "title": entry.get("title"),
+        "link": entry.get("link"),
+        "summary": entry.get("summary", ""),
+    } for entry in feed.entries]
+
+
+class HostLimiter:
+    # limits how many requests can be in flight to one host
+    # and how soon after the last request a new one can start
+    def __init__(self, max_concurrency=NEWS_MAX_CONCURRENCY_PER_HOST, min_interval=NEWS_MIN_INTERVAL_PER_HOST):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.min_interval = min_interval
+        self.next_start = 0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            # reserve the next start slot before sleeping so waiting requests queue up in order
+            now = time.monotonic()
+            start_at = max(now, self.next_start)
+            self.next_start = start_at + self.min_interval
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+        except BaseException:
+            # cancelled while waiting for a slot
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+
+
+class NewsFetcher:
+    def __init__(self, client, http_cache=None, story_index=None):
+        self.client = client
+        self.http_cache = http_cache or HttpCache()
+        self.story_index = story_index
+        self.host_limiters = {}
+        self.counters = {"fresh": 0, "not_modified": 0, "downloaded": 0, "covered": 0}
+
+    def get_host_limiter(self, url):
+        host = urlparse(url).netloc
+        if host not in self.host_limiters:
+            self.host_limiters[host] = HostLimiter()
+        return self.host_limiters[host]
+
+    async def get(self, url, headers=None):
+        async with self.get_host_limiter(url):
+            response = await self.client.get(url, headers=headers)
+        # httpx treats 304 as an error, but it's the answer we want from a conditional request
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    async def get_parsed(self, url, parse, parser_name, fresh_seconds=0):
+        # returns parse(page body) for url, using the http cache
+        # cached results younger than fresh_seconds are used without asking the server,
+        # older ones are revalidated with a conditional request
+        entry = self.http_cache.load(url)
+        if entry and entry.get("parser") != parser_name:
+            # cached with an older parser, parse the cached body again
+            body = self.http_cache.load_body(url)
+            if body is None:
+                entry = None
+            else:
+                entry["parsed"] = parse(body)
+                entry["parser"] = parser_name
+                self.http_cache.update(url, entry)
+
+        if entry and time.time() - entry["fetched_at"] < fresh_seconds:
+            self.counters["fresh"] += 1
+            set_span_attributes(cache="fresh")
+            return entry["parsed"]
+
+        response = await self.get(url, headers=self.http_cache.get_conditional_headers(entry))
+        if response.status_code == 304 and entry:
+            self.counters["not_modified"] += 1
+            set_span_attributes(cache="not_modified")
+            self.http_cache.refresh(url, entry)
+            return entry["parsed"]
+
+        self.counters["downloaded"] += 1
+        set_span_attributes(cache="downloaded", bytes=len(response.content))
+        parsed = parse(response.content)
+        self.http_cache.save(url, response, parsed, parser_name)
+        return parsed
+
+    async def get_feed_entries(self, url):
+        with span("news.feed", url=url) as feed_span:
+            try:
+                entries = await self.get_parsed(url, parse_feed, FEED_PARSER, fresh_seconds=FEED_CACHE_FRESH_SECONDS)
+            except httpx.HTTPStatusError as e:
+                raise Exception("Failed to get RSS feed. Status code:", e.response.status_code)
+            feed_span.set(entries=len(entries))
+
+        return [entry for entry in entries if entry.get("title") not in SKIPPED_TITLES]
+
+    async def get_article(self, entry):
+        with span("news.article", url=entry["link"]) as article_span:
+            content = await self.get_parsed(entry["link"], extract_main_content, ARTICLE_PARSER, fresh_seconds=ARTICLE_CACHE_FRESH_SECONDS)
+            article_span.set(characters=len(content or ""))
+        return {"title": entry["title"], "link": entry["link"], "content": content}
+
+    def get_summary(self):
+        return f"news fetch: {self.counters['downloaded']} downloaded, " \
+               f"{self.counters['not_modified']} not modified, {self.counters['fresh']} served from cache, " \
+               f"{self.counters['covered']} already covered entries pushed back"
+
+    async def get_articles_from_feed(self, url, num_articles=NUM_ARTICLES_PER_CATEGORY):
+        # takes rss feed url
+        # fetches the first n + extra articles at the same time
+        # returns the first n that load, in feed order, with covered stories only filling in for new ones that fail
+        entries = await self.get_feed_entries(url)
+        num_candidates = num_articles + NEWS_EXTRA_ARTICLES_PER_FEED
+        num_new = len(entries)
+        if self.story_index:
+            # covered stories go after the new ones, so they only fill the candidates the new ones leave.
+            # they're only used when not enough new ones load, and prefer_new_articles ranks them last
+            entries, num_covered = self.story_index.demote_covered(entries)
+            self.counters["covered"] += num_covered
+            num_new = len(entries) - num_covered
+        candidates = entries[0:num_candidates]
+
+        async def get_indexed_article(index, entry):
+            return index, await self.get_article(entry)
+
+        tasks = [asyncio.create_task(get_indexed_article(index, entry)) for index, entry in enumerate(candidates)]
+        articles_by_index = {}
+        num_new_loaded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    index, article = await next_done
+                except Exception as e:
+                    print("Error getting article from", url, ": ", repr(e))
+                    continue
+
+                articles_by_index[index] = article
+                if index < num_new:
+                    num_new_loaded += 1
+                if num_new_loaded >= num_articles:
+                    break
+        finally:
+            # stragglers are no longer needed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return [articles_by_index[index] for index in sorted(articles_by_index)[:num_articles]]
+
+
+def create_news_client():
+    return httpx.AsyncClient(
+        timeout=NEWS_FETCH_TIMEOUT,
+        limits=httpx.Limits(max_connections=NEWS_MAX_CONNECTIONS, max_keepalive_connections=NEWS_MAX_CONNECTIONS),
+        headers={"User-Agent": NEWS_USER_AGENT},
+        follow_redirects=True,
+    )
+
+
+async def fetch_articles_from_feeds(urls, num_articles=NUM_ARTICLES_PER_CATEGORY, client=None, story_index=None):
+    # the instance's pooled client is used unless one is given
+    fetcher = NewsFetcher(client or get_news_client(), story_index=story_index)
+    articles_per_feed = await asyncio.gather(*[fetcher.get_articles_from_feed(url, num_articles) for url in urls])
+    print(fetcher.get_summary())
+    return articles_per_feed
+
+
+def get_full_content_from_rss_feeds(urls, num_articles=NUM_ARTICLES_PER_CATEGORY, story_index=None):
+    # takes a list of rss feed urls
+    # fetches all feeds in parallel on the instance's news loop, so warm invocations reuse its connections
+    # story_index (a StoryIndex) has the stories to avoid
+    # returns a list of article lists, one per feed, in the same order as urls
+    return run_on_news_loop(fetch_articles_from_feeds(urls, num_articles, story_index=story_index))
+
@@ -0,0 +1,266 @@
+# every openai request on this instance goes through openai_scheduler, so parallel tts and
+# episodes generated at the same time share the account's rate limits instead of running into 429s
+# - each model has token buckets for its requests and tokens per minute (OPENAI_RATE_LIMITS).
+#   a chat request reserves its estimated tokens up front and the difference is settled once its usage is known
+# - requests wait in one priority queue, so the script gets ahead of article summaries and those get ahead of tts.
+#   a request that's waiting on its model's limits doesn't hold up requests for other models
+# - rate limited and failed requests (429, 5xx, dropped connections) are tried again after the
+#   Retry-After openai sends, or a jittered exponential backoff. a 429 pauses the whole model for that long
+# - queue depth, throttling and retries are counted per instance (get_stats) and in the current trace
+import heapq
+import itertools
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from lib.constants.global_constants import (OPENAI_RATE_LIMITS, OPENAI_RATE_LIMIT_BURST_SECONDS, OPENAI_MAX_CONCURRENCY,
+                                            OPENAI_MAX_ATTEMPTS, OPENAI_RETRY_BASE_DELAY, OPENAI_RETRY_MAX_DELAY)
+from lib.utils.tracing import set_span_attributes, count
+
+
+# lower goes first
+PRIORITY_SCRIPT = 0
+PRIORITY_CHAT = 1
+PRIORITY_TTS = 2
+# errors worth trying again
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# longest a waiting request sleeps before looking at the queue again
+MAX_CHECK_SECONDS = 1.0
+
+
+class TokenBucket:
+    # refills at rate_per_minute and holds at most burst_seconds of it
+    # a request bigger than the bucket only has to wait for it to be full
+    def __init__(self, rate_per_minute, burst_seconds=OPENAI_RATE_LIMIT_BURST_SECONDS):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_wait(self, amount, now):
+        # seconds until amount can be taken
+        self.refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount, now):
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        # a negative amount takes more, the bucket can go below empty and later requests wait it out
+        self.level = min(self.capacity, self.level + amount)
+
+
+def get_retry_after(response):
+    # seconds openai asked us to wait, or None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            retry_at = parsedate_to_datetime(retry_after)
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_connection_error(error):
+    # imported here since it's only needed once a request has failed
+    from openai import APIConnectionError
+    return isinstance(error, APIConnectionError)
+
+
+def get_backoff_delay(attempt):
+    # half of the delay is fixed and half is random, so requests that failed together don't retry together
+    delay = min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class OpenAIScheduler:
+    def __init__(self, rate_limits=OPENAI_RATE_LIMITS, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 max_attempts=OPENAI_MAX_ATTEMPTS):
+        self.rate_limits = rate_limits
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.condition = threading.Condition()
+        # (priority, order, model, tokens) of every request waiting to start
+        self.waiting = []
+        self.order = itertools.count()
+        self.in_flight = 0
+        # model -> its buckets and how long it's paused after a 429
+        self.models = {}
+        self.stats = {"requests": 0, "throttled": 0, "rate_limited": 0, "retries": 0, "failed": 0,
+                      "wait_seconds": 0.0, "max_wait_seconds": 0.0, "max_queue_depth": 0}
+
+    def get_model(self, model):
+        if model not in self.models:
+            limits = self.rate_limits.get(model) or self.rate_limits["default"]
+            self.models[model] = {
+                "requests": TokenBucket(limits["requests_per_minute"]),
+                "tokens": TokenBucket(limits["tokens_per_minute"]) if limits.get("tokens_per_minute") else None,
+                "paused_until": 0,
+            }
+        return self.models[model]
+
+    def get_wait(self, model, tokens, now):
+        # seconds until the model's limits let this request start
+        model_limits = self.get_model(model)
+        wait = max(model_limits["paused_until"] - now, model_limits["requests"].get_wait(1, now))
+        if model_limits["tokens"] and tokens:
+            wait = max(wait, model_limits["tokens"].get_wait(tokens, now))
+        return wait
+
+    def get_next(self, now):
+        # the request that should start next: the first one in priority order that its model's limits allow
+        # only the first request for each model is looked at, so a big request isn't passed by small ones forever
+        seen_models = set()
+        for entry in sorted(self.waiting):
+            _, _, model, tokens = entry
+            if model in seen_models:
+                continue
+            seen_models.add(model)
+            if self.get_wait(model, tokens, now) <= 0:
+                return entry
+        return None
+
+    def acquire(self, model, priority, tokens):
+        # blocks until the request can start, returns the seconds it waited
+        start_time = time.monotonic()
+        entry = (priority, next(self.order), model, tokens)
+        throttled = False
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self.waiting))
+            while True:
+                now = time.monotonic()
+                if self.get_next(now) is entry and self.in_flight < self.max_concurrency:
+                    break
+                wait = self.get_wait(model, tokens, now)
+                throttled = throttled or wait > 0
+                self.condition.wait(min(wait, MAX_CHECK_SECONDS) if wait > 0 else MAX_CHECK_SECONDS)
+
+            self.waiting.remove(entry)
+            heapq.heapify(self.waiting)
+            self.in_flight += 1
+            model_limits = self.get_model(model)
+            model_limits["requests"].take(1, now)
+            if model_limits["tokens"] and tokens:
+                model_limits["tokens"].take(tokens, now)
+
+            waited = time.monotonic() - start_time
+            self.stats["requests"] += 1
+            self.stats["throttled"] += throttled
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            # whoever is next may be able to start too
+            self.condition.notify_all()
+        if throttled:
+            count("openai_throttled")
+        return waited
+
+    def release(self, model, tokens, used_tokens=None):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+        if used_tokens is not None:
+            self.settle_tokens(model, tokens, used_tokens)
+
+    def settle_tokens(self, model, tokens, used_tokens):
+        # gives back what a request reserved but didn't use, or takes what it used on top
+        with self.condition:
+            model_limits = self.get_model(model)
+            if model_limits["tokens"]:
+                model_limits["tokens"].give_back(tokens - used_tokens)
+            self.condition.notify_all()
+
+    def get_retry_delay(self, error, attempt):
+        # seconds to wait before trying again, or None if the error isn't worth trying again
+        status_code = getattr(error, "status_code", None)
+        if status_code is None and not is_connection_error(error):
+            return None
+        if status_code is not None and status_code not in RETRY_STATUS_CODES:
+            return None
+        retry_after = get_retry_after(getattr(error, "response", None))
+        if retry_after is not None:
+            return min(retry_after, OPENAI_RETRY_MAX_DELAY)
+        return get_backoff_delay(attempt)
+
+    def pause_model(self, model, seconds):
+        # nothing else goes to the model until it's had time to recover
+        with self.condition:
+            model_limits = self.get_model(model)
+            model_limits["paused_until"] = max(model_limits["paused_until"], time.monotonic() + seconds)
+            self.stats["rate_limited"] += 1
+
+    def run(self, call, model, priority=PRIORITY_CHAT, tokens=0, get_used_tokens=None):
+        # returns call()'s result, starting it once the model's limits and the queue allow
+        # tokens is the request's estimated prompt and completion tokens
+        # get_used_tokens(result) returns what it actually used, to settle the token bucket.
+        # a failed attempt is settled as using none
+        queue_seconds = 0.0
+        for attempt in range(1, self.max_attempts + 1):
+            queue_seconds += self.acquire(model, priority, tokens)
+            used_tokens = None
+            try:
+                result = call()
+                if get_used_tokens:
+                    used_tokens = get_used_tokens(result)
+                set_span_attributes(queue_seconds=queue_seconds, attempts=attempt)
+                return result
+            except Exception as e:
+                # a failed attempt's reserved tokens are given back, so retries don't drain the bucket
+                used_tokens = 0
+                delay = self.get_retry_delay(e, attempt)
+                if delay is None or attempt == self.max_attempts:
+                    with self.condition:
+                        self.stats["failed"] += 1
+                    set_span_attributes(queue_seconds=queue_seconds, attempts=attempt)
+                    raise
+                if getattr(e, "status_code", None) == 429:
+                    self.pause_model(model, delay)
+                    count("openai_rate_limited")
+                with self.condition:
+                    self.stats["retries"] += 1
+                count("openai_retries")
+                print(f"Error calling {model} (attempt {attempt}), trying again in {delay:.1f}s: ", repr(e))
+            finally:
+                self.release(model, tokens, used_tokens)
+            time.sleep(delay)
+
+    def get_stats(self):
+        # since the instance started, plus what's queued and running now
+        with self.condition:
+            return dict(self.stats, queue_depth=len(self.waiting), in_flight=self.in_flight)
+
+    def get_summary(self):
+        stats = self.get_stats()
+        return f"openai: {stats['requests']} requests, {stats['throttled']} throttled, " \
+               f"{stats['rate_limited']} rate limited, {stats['retries']} retries, {stats['failed']} failed, " \
+               f"{stats['wait_seconds']:.1f}s waiting ({stats['max_wait_seconds']:.1f}s max), " \
+               f"max queue depth {stats['max_queue_depth']}"
+
+
+openai_scheduler = OpenAIScheduler()
+
+
+def estimate_tokens(messages, completion_tokens):
+    # about 4 characters per token, without loading a tokenizer
+    return sum(len(message.get("content") or "") for message in messages) // 4 + completion_tokens
+
+
+def get_used_tokens(completion):
+    usage = getattr(completion, "usage", None)
+    return usage.prompt_tokens + usage.completion_tokens if usage else None
@@ -0,0 +1,317 @@
+# runs episode generation as stages with a checkpoint after each one
+# a run is stored in the episode_runs collection, keyed by run id.
+# the script is saved to the bucket under runs/<run id>/ as soon as it's generated,
+# and every line of audio is saved in the run's tts cache bucket folder as soon as it's synthesized,
+# so a retry of the same run picks up
+# at the first unfinished stage and only pays for lines that were never synthesized.
+# the run's tts cache folder is deleted once its audio is uploaded
+import time
+import random
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from lib.constants.global_constants import get_date_context, DEFAULT_PODCAST, SCRIPT_STREAMING
+from lib.utils.utility_functions import message_ai_structured, db_insert, Podcast
+from lib.utils.ep_generation import build_full_directive, stream_audio_from_script_to_bucket
+from lib.utils.rss_feed import add_episode_to_feed
+from lib.utils.tts_cache import get_run_cache_folder, delete_cache_folder
+from lib.utils.script_streaming import StreamingScript
+from lib.utils.episode_memory import make_episode_notes, add_to_episode_memory
+from lib.utils.story_index import add_to_story_index
+from lib.utils.db_writes import WriteBatch
+from lib.utils.clients import get_firestore_client
+from lib.utils.podcasts import RUNS_COLLECTION, get_run_date
+from lib.utils.tracing import start_trace, span, set_span_attributes
+
+
+RUNS_FOLDER = "runs/"
+# in order
+STAGES = ["script", "audio", "episode", "rss"]
+
+
+def get_run_key(podcast):
+    # all runs of one podcast on one day share a key
+    return f"{podcast['user_id']}_{podcast['podcast_id']}_{get_run_date()}"
+
+
+class EpisodeRun:
+    # changes to the run are queued on its write batch and committed at the end of each stage,
+    # with anything else the stage queued there
+    def __init__(self, run_id, data, bucket):
+        self.run_id = run_id
+        self.data = data
+        self.bucket = bucket
+        self.writes = WriteBatch()
+
+    @classmethod
+    def load_or_create(cls, bucket, podcast=DEFAULT_PODCAST, run_id=None):
+        # with a run id, that run is resumed (or created)
+        # without one, the latest unfinished run of today is resumed, or a new one is started
+        db = get_firestore_client()
+        runs = db.collection(RUNS_COLLECTION)
+
+        if run_id is None:
+            run_key = get_run_key(podcast)
+            unfinished_runs = [doc for doc in runs.where("run_key", "==", run_key).stream()
+                               if doc.to_dict().get("status") != "complete"]
+            if unfinished_runs:
+                latest_run = max(unfinished_runs, key=lambda doc: doc.to_dict().get("started_at", 0))
+                return cls(latest_run.id, latest_run.to_dict(), bucket)
+            run_id = run_key + "_" + str(round(time.time() * 1000))
+        else:
+            doc = runs.document(run_id).get()
+            if doc.exists:
+                return cls(run_id, doc.to_dict(), bucket)
+            run_key = get_run_key(podcast)
+
+        date_context = get_date_context()
+        data = {
+            "run_id": run_id,
+            "run_key": run_key,
+            "run_date": date_context["run_date"],
+            # a resumed run keeps the date it started on
+            "date_context": date_context,
+            "user_id": podcast["user_id"],
+            "podcast_id": podcast["podcast_id"],
+            # settings are saved with the run so a resumed run uses the same ones
+            "podcast": podcast,
+            "status": "running",
+            "completed_stages": [],
+            "started_at": time.time(),
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+        run = cls(run_id, data, bucket)
+        # committed when the pipeline starts
+        run.writes.set(RUNS_COLLECTION, run_id, data, merge=False)
+        return run
+
+    def is_done(self, stage):
+        return stage in self.data.get("completed_stages", [])
+
+    def update(self, data):
+        # queued until the stage ends
+        self.data.update(data)
+        self.writes.set(RUNS_COLLECTION, self.run_id, dict(data, updated_at=firestore.SERVER_TIMESTAMP))
+
+    def complete_stage(self, stage, results=None, flush=True):
+        # the stage's checkpoint is committed with everything else it queued
+        # (without flush, with the next stage that's completed)
+        completed_stages = self.data.get("completed_stages", []) + [stage]
+        data = dict(results or {}, completed_stages=completed_stages, status="running")
+        if completed_stages[-1] == STAGES[-1]:
+            data["status"] = "complete"
+        self.update(data)
+        if flush:
+            self.writes.flush()
+
+    def fail(self, error):
+        # what the failed stage queued is dropped, a retry makes it again
+        self.writes.discard()
+        self.update({"status": "failed", "error": repr(error)})
+        self.writes.flush()
+
+    @property
+    def podcast(self):
+        return self.data.get("podcast") or DEFAULT_PODCAST
+
+    @property
+    def date_context(self):
+        return self.data.get("date_context") or get_date_context()
+
+    def get_script_blob(self):
+        return self.bucket.blob(RUNS_FOLDER + self.run_id + "/script.json")
+
+    def save_script(self, podcast_response):
+        self.get_script_blob().upload_from_string(podcast_response.model_dump_json(), content_type="application/json")
+
+    def load_script(self):
+        return Podcast.model_validate_json(self.get_script_blob().download_as_bytes())
+
+
+def generate_script_stage(run, openai_client):
+    if run.is_done("script"):
+        try:
+            podcast_response = run.load_script()
+            set_span_attributes(from_checkpoint=True, lines=len(podcast_response.script))
+            return podcast_response
+        except NotFound:
+            print("script checkpoint missing for run", run.run_id, ", generating it again")
+
+    directive, stories = build_full_directive(feeds=run.podcast["feeds"], openai_client=openai_client,
+                                              date_context=run.date_context, podcast_id=run.data["podcast_id"])
+
+    podcast_response = message_ai_structured(openai_client=openai_client,
+                            message=directive
+                            )
+
+    try:
+        podcast_response.script
+    except Exception:
+        print("error getting script from podcast:", podcast_response)
+        raise Exception("Error getting script from podcast:", podcast_response)
+
+    set_span_attributes(lines=len(podcast_response.script))
+    run.save_script(podcast_response)
+    # the stories only go in the podcast's story index once the episode is saved
+    if not run.is_done("script"):
+        run.complete_stage("script", {"stories": stories})
+    else:
+        run.update({"stories": stories})
+    return podcast_response
+
+
+def generate_audio_stage(run, podcast_response, openai_client, bucket, tts_workers):
+    if run.is_done("audio"):
+        set_span_attributes(from_checkpoint=True)
+        return run.data["upload_results"]
+
+    # lines already synthesized by an earlier attempt come back from the tts cache
+    upload_results = stream_audio_from_script_to_bucket(podcast_response.script, openai_client, bucket, max_workers=tts_workers,
+                                                        audio_folder=run.podcast["audio_folder"],
+                                                        date_context=run.date_context,
+                                                        tts_cache_folder=get_run_cache_folder(run.run_id))
+    set_span_attributes(bytes=upload_results.get("size"))
+
+    run.complete_stage("audio", {"upload_results": upload_results})
+    return upload_results
+
+
+def generate_script_and_audio_stage(run, openai_client, bucket, tts_workers):
+    # streams the script and makes each line's audio as soon as the line is written
+    # finishes both the script and audio stages
+    directive, stories = build_full_directive(feeds=run.podcast["feeds"], openai_client=openai_client,
+                                              date_context=run.date_context, podcast_id=run.data["podcast_id"])
+
+    # the script is checkpointed as soon as the stream ends, not once its audio is uploaded,
+    # so if the audio fails a retry makes it from the same script and gets the lines already synthesized from the tts cache
+    def save_streamed_script(podcast_response):
+        with span("script.save", lines=len(podcast_response.script)):
+            run.save_script(podcast_response)
+            run.complete_stage("script", {"stories": stories})
+
+    streaming_script = StreamingScript(openai_client, directive, on_finished=save_streamed_script)
+    upload_results = stream_audio_from_script_to_bucket(streaming_script, openai_client, bucket, max_workers=tts_workers,
+                                                        audio_folder=run.podcast["audio_folder"],
+                                                        date_context=run.date_context,
+                                                        tts_cache_folder=get_run_cache_folder(run.run_id))
+    podcast_response = streaming_script.podcast
+    set_span_attributes(lines=len(podcast_response.script), bytes=upload_results.get("size"))
+
+    run.complete_stage("audio", {"upload_results": upload_results})
+    return podcast_response, upload_results
+
+
+def delete_run_tts_cache(run, bucket):
+    # the run's clips are only kept in the bucket until its audio is uploaded
+    try:
+        num_deleted = delete_cache_folder(bucket, get_run_cache_folder(run.run_id))
+        set_span_attributes(deleted_clips=num_deleted)
+    except Exception as e:
+        print("Error deleting tts cache of run", run.run_id, ": ", repr(e))
+
+
+def save_episode_stage(run, podcast_response, upload_results, openai_client):
+    if run.is_done("episode"):
+        return run.data["episode_id"]
+
+    # id is ep_[current time in ms]_[random number 0 to 9999]
+    # it's saved with the run so a retry doesn't make a second episode
+    episode_id = run.data.get("episode_id") or "ep_" + str(round(time.time() * 1000)) + "_" + str(random.randrange(0, 9999))
+    # queued, so the episode doc, its id on the run and the end of the stage are committed together
+    run.update({"episode_id": episode_id})
+
+    # the topics go in the episode's doc and in the podcast's memory for the next episode's prompt
+    with span("episode_notes"):
+        try:
+            notes = make_episode_notes(openai_client, podcast_response)
+        except Exception as e:
+            print("Error getting episode notes: ", repr(e))
+            notes = None
+
+    db_insert(collection_name="episodes", writes=run.writes, data={
+        "episode_id": episode_id,
+        "podcast_id": run.data["podcast_id"],
+        "user_id": run.data["user_id"],
+        "run_id": run.run_id,
+        "title": f"Daily Podcast for {run.date_context['date_as_text']}",
+        "description": f"This is your daily podcast for {run.date_context['date_as_text']}. "
+                       f"It was created at {run.date_context['time_as_text']}",
+        "script_text": podcast_response.model_dump_json(),
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+        "file_name": upload_results.get("file_name"),
+        "file_path": upload_results.get("file_path"),
+        "url": upload_results.get("url"),
+        # seconds
+        "duration": upload_results.get("duration", 0),
+        # where each line is in the audio, so lines can be made again later (see episode_edits.py)
+        "segments": upload_results.get("segments", []),
+        "audio_generated": True,
+        "topics": notes.topics if notes else [],
+    })
+
+    if notes:
+        with span("db.save_episode_memory"):
+            try:
+                add_to_episode_memory(run.data["podcast_id"], episode_id,
+                                      f"{run.date_context['weekday_as_text']}, {run.date_context['date_as_text']}", notes,
+                                      writes=run.writes)
+            except Exception as e:
+                print("Error updating episode memory: ", repr(e))
+
+    # the next runs push these stories back
+    if run.data.get("stories"):
+        with span("db.save_story_index", stories=len(run.data["stories"])):
+            try:
+                add_to_story_index(run.data["podcast_id"], run.data["stories"], writes=run.writes)
+            except Exception as e:
+                print("Error updating story index: ", repr(e))
+
+    run.complete_stage("episode")
+    return episode_id
+
+
+def publish_rss_stage(run, bucket, upload_results):
+    if run.is_done("rss"):
+        return run.data["rss_url"]
+
+    # only the new episode is rendered, the rest of the feed comes from its index
+    rss_url = add_episode_to_feed(bucket, url=upload_results.get("url"), length=upload_results.get("size"),
+                                  content_type=upload_results.get("content_type"), podcast=run.podcast)
+
+    run.complete_stage("rss", {"rss_url": rss_url})
+    return rss_url
+
+
+def run_episode_pipeline(run, openai_client, bucket, tts_workers):
+    # runs every stage that isn't done yet, each in its own span
+    # returns the rss url
+    with start_trace("episode run", run_id=run.run_id, podcast_id=run.data.get("podcast_id"),
+                     already_done=run.data.get("completed_stages", [])):
+        try:
+            # anything queued before the run started, like the new run's doc
+            run.writes.flush()
+            if SCRIPT_STREAMING and not run.is_done("script"):
+                # tts runs while the script is still being written
+                with span("stage.script_and_audio", tts_workers=tts_workers):
+                    podcast_response, upload_results = generate_script_and_audio_stage(run, openai_client, bucket,
+                                                                                       tts_workers)
+            else:
+                with span("stage.script"):
+                    podcast_response = generate_script_stage(run, openai_client)
+                with span("stage.audio", lines=len(podcast_response.script), tts_workers=tts_workers):
+                    upload_results = generate_audio_stage(run, podcast_response, openai_client, bucket, tts_workers)
+            with span("tts_cache.delete"):
+                delete_run_tts_cache(run, bucket)
+            with span("stage.episode"):
+                save_episode_stage(run, podcast_response, upload_results, openai_client)
+            with span("stage.rss") as rss_span:
+                rss_url = publish_rss_stage(run, bucket, upload_results)
+                rss_span.set(rss_url=rss_url)
+        except Exception as e:
+            run.fail(e)
+            raise
+
+    return rss_url
@@ -0,0 +1,92 @@
+# settings for each podcast and which ones still need today's episode
+# a podcast's settings are a dict like DEFAULT_PODCAST, built from its doc in the podcasts collection
+from firebase_admin import firestore
+
+from lib.constants.global_constants import DEFAULT_PODCAST, NEWS_FEEDS, SCHEDULE_DEFAULT_PODCAST, get_date_context
+from lib.utils.utility_functions import db_insert
+from lib.utils.clients import get_firestore_client
+
+
+RUNS_COLLECTION = "episode_runs"
+# only these fields are read when listing podcasts
+PODCAST_SETTINGS_FIELDS = ["user_id", "title", "description", "feeds", "active"]
+
+
+def get_run_date():
+    # episodes are daily, so a podcast has at most one finished run per date
+    return get_date_context()["run_date"]
+
+
+def get_podcast_settings(podcast_id, podcast_data):
+    # podcast_data is the podcast's doc
+    # podcasts can pick their own news feeds with a "feeds" field like NEWS_FEEDS
+    user_id = podcast_data.get("user_id", "testUser")
+    return {
+        "podcast_id": podcast_id,
+        "user_id": user_id,
+        "title": podcast_data.get("title") or DEFAULT_PODCAST["title"],
+        "description": podcast_data.get("description") or DEFAULT_PODCAST["description"],
+        "feeds": podcast_data.get("feeds") or NEWS_FEEDS,
+        "audio_folder": f"audio/{user_id}/{podcast_id}/",
+        "rss_folder": f"rss/{user_id}/{podcast_id}/",
+        "rss_file_name": "feed.xml",
+        "feed_id": f"{user_id}_{podcast_id}",
+    }
+
+
+def is_default_podcast(podcast_id):
+    return str(podcast_id) == str(DEFAULT_PODCAST["podcast_id"])
+
+
+def find_podcast(podcast_id=None):
+    # returns settings of one podcast from the db, the default podcast if no id is given,
+    # or None if there's no such podcast
+    if podcast_id is None or is_default_podcast(podcast_id):
+        return DEFAULT_PODCAST
+
+    doc = get_firestore_client().collection("podcasts").document(podcast_id).get()
+    if not doc.exists:
+        return None
+    return get_podcast_settings(doc.id, doc.to_dict())
+
+
+def load_podcast(podcast_id=None):
+    # like find_podcast, but a missing podcast is an error
+    podcast = find_podcast(podcast_id)
+    if podcast is None:
+        raise Exception("Podcast not found:", podcast_id)
+    return podcast
+
+
+def list_due_podcasts():
+    # returns settings of every active podcast that doesn't have a finished episode today
+    # the episode_runs query needs a composite index on run_date (ascending) and status (ascending):
+    # firebase console > firestore > indexes > add index, or in firestore.indexes.json:
+    # {"collectionGroup": "episode_runs", "queryScope": "COLLECTION",
+    #  "fields": [{"fieldPath": "run_date", "order": "ASCENDING"}, {"fieldPath": "status", "order": "ASCENDING"}]}
+    db = get_firestore_client()
+
+    finished_runs = db.collection(RUNS_COLLECTION) \
+        .where("run_date", "==", get_run_date()) \
+        .where("status", "==", "complete") \
+        .select(["podcast_id"]).stream()
+    finished_podcast_ids = {str(doc.to_dict().get("podcast_id")) for doc in finished_runs}
+
+    podcasts = [DEFAULT_PODCAST] if SCHEDULE_DEFAULT_PODCAST else []
+    for doc in db.collection("podcasts").select(PODCAST_SETTINGS_FIELDS).stream():
+        podcast_data = doc.to_dict()
+        if podcast_data.get("active") is False:
+            continue
+        podcasts.append(get_podcast_settings(doc.id, podcast_data))
+
+    return [podcast for podcast in podcasts if str(podcast["podcast_id"]) not in finished_podcast_ids]
+
+
+def update_podcast_status(podcast, status, data=None, writes=None):
+    # the default podcast isn't in the db, its status is only kept on its runs
+    if is_default_podcast(podcast["podcast_id"]):
+        return
+    db_insert(collection_name="podcasts", id=podcast["podcast_id"], writes=writes, data=dict(data or {},
+        last_run_status=status,
+        updated_at=firestore.SERVER_TIMESTAMP,
+    ))
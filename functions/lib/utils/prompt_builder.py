@@ -0,0 +1,145 @@
+# builds the prompt for script generation within a token budget
+# each section gets its own budget. articles that show up in more than one feed are only kept once,
+# and when a section is over budget its longest articles are trimmed first
+import re
+from difflib import SequenceMatcher
+from urllib.parse import urlparse
+
+from lib.constants.global_constants import PROMPT_MAX_TOKENS, PROMPT_SECTION_TOKEN_BUDGETS, DUPLICATE_TITLE_SIMILARITY
+
+# tiktoken isn't a requirement, without it tokens are estimated from the number of characters
+try:
+    import tiktoken
+    token_encoding = tiktoken.get_encoding("o200k_base")
+except ImportError:
+    token_encoding = None
+
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    if token_encoding:
+        return len(token_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if token_encoding:
+        text = token_encoding.decode(token_encoding.encode(text)[:max_tokens])
+    else:
+        text = text[:max_tokens * CHARS_PER_TOKEN]
+    # don't end in the middle of a word
+    return text.rsplit(" ", 1)[0] + "..."
+
+
+def normalize_url(url):
+    # same article can be linked with different tracking params
+    parsed_url = urlparse(url or "")
+    return (parsed_url.netloc.lower().removeprefix("www.") + parsed_url.path.rstrip("/")).lower()
+
+
+def normalize_title(title):
+    return re.sub(r"[^a-z0-9 ]", "", (title or "").lower()).strip()
+
+
+def dedupe_articles(articles_per_section):
+    # takes a list of article lists (one per section, most important section first)
+    # returns the same lists without articles that already showed up in an earlier list
+    # articles match on url or a similar enough title
+    seen_urls = set()
+    seen_titles = []
+    deduped_articles_per_section = []
+    num_removed = 0
+    for articles in articles_per_section:
+        deduped_articles = []
+        for article in articles:
+            url = normalize_url(article.get("link"))
+            title = normalize_title(article.get("title"))
+            is_duplicate = (url and url in seen_urls) or (title and any(
+                SequenceMatcher(None, title, seen_title).ratio() >= DUPLICATE_TITLE_SIMILARITY
+                for seen_title in seen_titles))
+            if is_duplicate:
+                num_removed += 1
+                continue
+
+            if url:
+                seen_urls.add(url)
+            if title:
+                seen_titles.append(title)
+            deduped_articles.append(article)
+        deduped_articles_per_section.append(deduped_articles)
+
+    return deduped_articles_per_section, num_removed
+
+
+def fit_articles_to_budget(articles, max_tokens):
+    # trims the longest article bodies first until they all fit in max_tokens
+    # every article ends up no longer than a shared cap, shorter ones aren't touched
+    content_tokens = [count_tokens(article.get("content") or "") for article in articles]
+    if sum(content_tokens) <= max_tokens:
+        return articles
+
+    # find the biggest cap where sum(min(tokens, cap)) fits
+    remaining_budget = max(0, max_tokens)
+    remaining_articles = len(articles)
+    cap = 0
+    for tokens in sorted(content_tokens):
+        if tokens * remaining_articles > remaining_budget:
+            cap = remaining_budget // remaining_articles
+            break
+        remaining_budget -= tokens
+        remaining_articles -= 1
+
+    return [dict(article, content=truncate_to_tokens(article.get("content") or "", cap)) if tokens > cap else article
+            for article, tokens in zip(articles, content_tokens)]
+
+
+def format_articles(articles):
+    return "".join(f"Title: {article.get('title')}, Content: {article.get('content')}. " for article in articles)
+
+
+class PromptBuilder:
+    # sections are added in the order they appear in the prompt
+    # fixed sections (directives) are never trimmed, budgeted ones are trimmed to fit
+    def __init__(self, max_tokens=PROMPT_MAX_TOKENS, section_budgets=PROMPT_SECTION_TOKEN_BUDGETS):
+        self.max_tokens = max_tokens
+        self.section_budgets = section_budgets
+        self.sections = []
+
+    def add_text(self, name, text):
+        self.sections.append({"name": name, "text": text, "tokens": count_tokens(text)})
+
+    def get_budget(self, name):
+        # a section never gets more than what's left of the whole prompt's budget
+        tokens_left = self.max_tokens - sum(section["tokens"] for section in self.sections)
+        return min(self.section_budgets.get(name, tokens_left), tokens_left)
+
+    def add_articles(self, name, intro, articles):
+        intro_tokens = count_tokens(intro)
+        # the budget covers the whole section, titles and formatting included
+        overhead_tokens = intro_tokens + count_tokens(format_articles([dict(article, content="") for article in articles]))
+        budget = self.get_budget(name)
+        articles = fit_articles_to_budget(articles, budget - overhead_tokens)
+        self.add_text(name, intro + format_articles(articles))
+
+    def add_budgeted_text(self, name, intro, text):
+        budget = self.get_budget(name)
+        self.add_text(name, intro + truncate_to_tokens(text, budget - count_tokens(intro)))
+
+    def build(self):
+        # returns the prompt and the number of tokens in each section
+        prompt = "".join(section["text"] for section in self.sections)
+        report = {section["name"]: section["tokens"] for section in self.sections}
+        report["total"] = count_tokens(prompt)
+        if report["total"] > self.max_tokens:
+            print("Warning: prompt is", report["total"], "tokens, over the limit of", self.max_tokens)
+        return prompt, report
+
+
+def format_token_report(report):
+    return "prompt tokens: " + ", ".join(f"{name} {tokens}" for name, tokens in report.items()) + \
+           ("" if token_encoding else " (estimated)")
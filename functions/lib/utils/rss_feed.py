@@ -0,0 +1,216 @@
+# keeps the podcast's rss feed up to date one episode at a time
+# the feed's items are kept in a small json index in the bucket next to the feed,
+# each with its <item> xml already rendered. publishing an episode renders one new item,
+# adds it to the index and joins the channel with the stored items,
+# instead of listing every audio file in the bucket and rebuilding the whole feed
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from feedgen.feed import FeedGenerator
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from lib.constants.global_constants import RSS_MAX_ITEMS, RSS_CACHE_MAX_AGE, RSS_FEED_CACHE_MAX_ENTRIES, DEFAULT_PODCAST
+from lib.utils.tracing import set_span_attributes
+
+
+RSS_INDEX_FILE_NAME = "feed_index.json"
+# tries before giving up when another instance updates the index at the same time
+MAX_INDEX_UPDATE_ATTEMPTS = 5
+
+# rendered feeds this instance has published or served, by feed path, least recently used first (see rss_serving.py)
+# at most RSS_FEED_CACHE_MAX_ENTRIES of them
+feed_cache = OrderedDict()
+feed_cache_lock = threading.Lock()
+
+
+def create_feed_generator(podcast=DEFAULT_PODCAST):
+    fg = FeedGenerator()
+    fg.load_extension('podcast')
+    fg.id(podcast["feed_id"])
+    fg.title(podcast["title"])
+    fg.author( {'name':'Personal Podcasts','email':'samshandymansolutions@gmail.com'} )
+    fg.link( href='https://personal-podcasts.vercel.app', rel='alternate' )
+    fg.logo('http://example.com/logo.jpg')
+    fg.subtitle(podcast["description"])
+    fg.language('en')
+    return fg
+
+
+def render_item_xml(url, length, content_type, created_at):
+    # returns the <item> xml for one episode
+    dt = created_at - timedelta(hours = 4)
+    human_readable_date = dt.strftime("%B %d, %Y")
+    human_readable_time = dt.strftime("%I:%M %p")
+
+    fg = create_feed_generator()
+    fe = fg.add_entry()
+    fe.title("Sam's Daily Podcast for " + human_readable_date)
+    fe.enclosure(url=url, length=int(length), type=content_type)
+    fe.pubDate(created_at)
+    fe.link(href=url)
+    fe.guid(url, permalink=True)
+    fe.description(f"""Sam's Daily Podcast for {human_readable_date}.
+This podcast was created entirely by AI.
+It covers the latest news stories and headlines.
+It was created at {human_readable_time}.
+The code to create it was written by Sam Inniss.
+Enjoy!  😎
+            """)
+
+    rss_text = fg.rss_str(pretty=True).decode("utf-8")
+    return rss_text[rss_text.index("    <item>"):rss_text.index("</item>") + len("</item>")] + "\n"
+
+
+def render_feed(items, podcast=DEFAULT_PODCAST):
+    # takes index items, newest first
+    # returns rss xml. only the channel is rendered, item xml comes from the index
+    channel_text = create_feed_generator(podcast).rss_str(pretty=True).decode("utf-8")
+    channel_end = channel_text.index("  </channel>")
+    return channel_text[:channel_end] + "".join(item["xml"] for item in items) + channel_text[channel_end:]
+
+
+def build_item(url, length, content_type, created_at):
+    return {
+        "guid": url,
+        "url": url,
+        "length": int(length),
+        "type": content_type,
+        "created_at": created_at.isoformat(),
+        "xml": render_item_xml(url, length, content_type, created_at),
+    }
+
+
+def build_index_from_bucket(bucket, podcast=DEFAULT_PODCAST):
+    # only used the first time, before the feed has an index
+    items = []
+    for file in bucket.list_blobs(prefix=podcast["audio_folder"]):
+        if file.content_type and file.content_type[0:5] == 'audio':
+            items.append(build_item(file.public_url, file.size, file.content_type, file.time_created))
+    items.sort(key=lambda item: item["created_at"], reverse=True)
+    return {"items": items[:RSS_MAX_ITEMS]}
+
+
+def get_index_path(podcast):
+    return podcast["rss_folder"] + RSS_INDEX_FILE_NAME
+
+
+def load_index(bucket, podcast=DEFAULT_PODCAST):
+    # returns the index and the generation it was read at (0 if it doesn't exist yet)
+    blob = bucket.blob(get_index_path(podcast))
+    try:
+        index_text = blob.download_as_bytes()
+    except NotFound:
+        return None, 0
+    return json.loads(index_text), blob.generation
+
+
+def save_index(bucket, index, generation, podcast=DEFAULT_PODCAST):
+    # fails with PreconditionFailed if the index changed since it was read
+    bucket.blob(get_index_path(podcast)).upload_from_string(json.dumps(index), content_type="application/json",
+                                                    if_generation_match=generation)
+
+
+def get_feed_path(podcast=DEFAULT_PODCAST):
+    return podcast["rss_folder"] + podcast["rss_file_name"]
+
+
+def remember_feed(feed_path, rss_bytes, generation, updated=None):
+    # keeps a rendered feed in memory with the headers it's served with
+    # the etag is a hash of the exact bytes, so it's a strong etag
+    cached_feed = {
+        "body": rss_bytes,
+        "etag": '"' + hashlib.sha256(rss_bytes).hexdigest()[:32] + '"',
+        "last_modified": updated or datetime.now(timezone.utc),
+        "generation": generation,
+        "checked_at": time.monotonic(),
+    }
+    with feed_cache_lock:
+        feed_cache[feed_path] = cached_feed
+        feed_cache.move_to_end(feed_path)
+        while len(feed_cache) > RSS_FEED_CACHE_MAX_ENTRIES:
+            feed_cache.popitem(last=False)
+    return cached_feed
+
+
+def get_cached_feed(feed_path):
+    # returns the feed this instance remembers, or None
+    with feed_cache_lock:
+        cached_feed = feed_cache.get(feed_path)
+        if cached_feed is not None:
+            feed_cache.move_to_end(feed_path)
+        return cached_feed
+
+
+def forget_feed(feed_path):
+    with feed_cache_lock:
+        feed_cache.pop(feed_path, None)
+
+
+def upload_feed(bucket, rss_text, podcast=DEFAULT_PODCAST):
+    # write the rss to a file in the blob storage
+    blob = bucket.blob(get_feed_path(podcast))
+    # apps that read the public file directly can cache it too
+    blob.cache_control = f"public, max-age={RSS_CACHE_MAX_AGE}"
+    rss_bytes = rss_text.encode("utf-8")
+    # blob.upload_from_string(rss_text, content_type="application/rss+xml")
+    blob.upload_from_string(rss_bytes, content_type="text/xml")
+    blob.make_public()
+    # this instance serves the new feed right away
+    remember_feed(get_feed_path(podcast), rss_bytes, blob.generation, blob.updated)
+    return blob.public_url
+
+
+def update_feed(bucket, update_items, podcast=DEFAULT_PODCAST):
+    # update_items takes the index's items and returns the new items
+    # saves the index, then renders and uploads the feed
+    # returns the public url of the feed
+    for attempt in range(1, MAX_INDEX_UPDATE_ATTEMPTS + 1):
+        index, generation = load_index(bucket, podcast)
+        if index is None:
+            index = build_index_from_bucket(bucket, podcast)
+
+        index["items"] = update_items(index["items"])
+        try:
+            save_index(bucket, index, generation, podcast)
+            break
+        except PreconditionFailed:
+            if attempt == MAX_INDEX_UPDATE_ATTEMPTS:
+                raise
+
+    rss_text = render_feed(index["items"], podcast)
+    set_span_attributes(items=len(index["items"]), index_attempts=attempt, bytes=len(rss_text))
+    return upload_feed(bucket, rss_text, podcast)
+
+
+def add_episode_to_feed(bucket, url, length, content_type="audio/wav", created_at=None, podcast=DEFAULT_PODCAST):
+    # adds one episode to the top of the feed and uploads the new feed
+    # returns the public url of the feed
+    created_at = created_at or datetime.now(timezone.utc)
+    new_item = build_item(url, length, content_type, created_at)
+
+    def update_items(items):
+        items = [item for item in items if item["guid"] != new_item["guid"]]
+        return ([new_item] + items)[:RSS_MAX_ITEMS]
+    return update_feed(bucket, update_items, podcast)
+
+
+def update_episode_in_feed(bucket, url, length, podcast=DEFAULT_PODCAST):
+    # re-renders an episode that's already in the feed, like after its audio was edited
+    # it keeps its place and date
+    def update_items(items):
+        return [build_item(url, length, item["type"], datetime.fromisoformat(item["created_at"]))
+                if item["guid"] == url else item
+                for item in items]
+    return update_feed(bucket, update_items, podcast)
+
+
+def generate_rss_text(bucket, podcast=DEFAULT_PODCAST):
+    # renders the feed from the index
+    index, _ = load_index(bucket, podcast)
+    if index is None:
+        index = build_index_from_bucket(bucket, podcast)
+    return render_feed(index["items"], podcast)
@@ -0,0 +1,115 @@
+# serves each podcast's rss feed from the feed file that publishing already renders
+# podcast apps poll feeds all day, so a poll should cost almost nothing:
+# - a warm instance keeps each feed in memory and only checks the bucket for a newer one
+#   (a metadata read) every RSS_REVALIDATE_SECONDS. publishing on the same instance replaces it right away
+# - responses have a strong etag and last-modified, so apps that send If-None-Match or
+#   If-Modified-Since with what they already have get an empty 304
+# - cache-control lets apps and any cdn in front of the function reuse the feed for a while
+# serving never writes to the bucket: a podcast with no feed file yet gets a 404 until its first episode is published
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from firebase_functions import https_fn
+from google.api_core.exceptions import NotFound
+
+from lib.constants.global_constants import RSS_CACHE_MAX_AGE, RSS_REVALIDATE_SECONDS, RSS_PODCAST_CACHE_MAX_ENTRIES
+from lib.utils.rss_feed import get_cached_feed, forget_feed, remember_feed, get_feed_path
+from lib.utils.podcasts import find_podcast
+
+
+# settings of the podcasts whose feeds this instance has served, by podcast id, least recently served first
+# only the feed path is needed from them and it doesn't change. podcast ids come from requests,
+# so only podcasts that exist are kept, and at most RSS_PODCAST_CACHE_MAX_ENTRIES of them
+feed_podcasts = OrderedDict()
+feed_podcasts_lock = threading.Lock()
+# how this instance's feed requests were answered, since it started
+feed_counters = {"memory_hits": 0, "revalidated": 0, "downloads": 0, "missing": 0, "not_modified": 0}
+feed_counters_lock = threading.Lock()
+
+
+def count(counter_name):
+    with feed_counters_lock:
+        feed_counters[counter_name] += 1
+
+
+def get_feed_podcast(podcast_id=None):
+    # returns the podcast's settings, or None if there's no such podcast
+    with feed_podcasts_lock:
+        podcast = feed_podcasts.get(podcast_id)
+        if podcast is not None:
+            feed_podcasts.move_to_end(podcast_id)
+            return podcast
+    podcast = find_podcast(podcast_id)
+    if podcast is None:
+        return None
+    with feed_podcasts_lock:
+        feed_podcasts[podcast_id] = podcast
+        feed_podcasts.move_to_end(podcast_id)
+        while len(feed_podcasts) > RSS_PODCAST_CACHE_MAX_ENTRIES:
+            feed_podcasts.popitem(last=False)
+    return podcast
+
+
+def load_feed(bucket, podcast):
+    # returns the cached feed, checking the bucket for a newer one when it's due
+    # returns None if the podcast's feed hasn't been published yet
+    feed_path = get_feed_path(podcast)
+    cached_feed = get_cached_feed(feed_path)
+    if cached_feed and time.monotonic() - cached_feed["checked_at"] < RSS_REVALIDATE_SECONDS:
+        count("memory_hits")
+        return cached_feed
+
+    blob = bucket.blob(feed_path)
+    try:
+        blob.reload()
+    except NotFound:
+        # publishing writes the feed file, so there's nothing to serve yet
+        count("missing")
+        forget_feed(feed_path)
+        return None
+
+    if cached_feed and cached_feed["generation"] == blob.generation:
+        count("revalidated")
+        cached_feed["checked_at"] = time.monotonic()
+        return cached_feed
+
+    count("downloads")
+    return remember_feed(feed_path, blob.download_as_bytes(), blob.generation, blob.updated)
+
+
+def is_not_modified(headers, cached_feed):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+        return "*" in etags or cached_feed["etag"] in etags
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            modified_since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if modified_since.tzinfo is None:
+            modified_since = modified_since.replace(tzinfo=timezone.utc)
+        # http dates only have whole seconds
+        return cached_feed["last_modified"].replace(microsecond=0) <= modified_since
+    return False
+
+
+def serve_feed(req, bucket, podcast):
+    cached_feed = load_feed(bucket, podcast)
+    if cached_feed is None:
+        return https_fn.Response("feed not found", status=404)
+    headers = {
+        "ETag": cached_feed["etag"],
+        "Last-Modified": format_datetime(cached_feed["last_modified"], usegmt=True),
+        "Cache-Control": f"public, max-age={RSS_CACHE_MAX_AGE}",
+    }
+    if is_not_modified(req.headers, cached_feed):
+        count("not_modified")
+        return https_fn.Response(status=304, headers=headers)
+    return https_fn.Response(cached_feed["body"], status=200, headers=headers, content_type="text/xml; charset=utf-8")
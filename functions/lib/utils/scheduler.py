@@ -0,0 +1,100 @@
+# makes today's episode for every podcast that's due
+# the daily schedule only lists the due podcasts and puts one task per podcast on the new_episode_task queue,
+# so each episode is made in its own invocation with its own timeout, and the schedule takes
+# about as long for a hundred podcasts as for one. the queue limits how many episodes are made at once
+# and tries a failed task again, which resumes its run where it stopped.
+# a task's id is its podcast and run date, so scheduling twice on one day doesn't make a second task
+# every openai call on an instance goes through the instance-wide openai_scheduler
+import re
+import time
+
+from firebase_admin import functions
+from firebase_admin.exceptions import AlreadyExistsError
+
+from lib.constants.global_constants import TTS_MAX_WORKERS
+from lib.utils.utility_functions import print_in_red
+from lib.utils.podcasts import list_due_podcasts, update_podcast_status, load_podcast, get_run_date
+from lib.utils.pipeline import EpisodeRun, run_episode_pipeline
+from lib.utils.openai_scheduler import openai_scheduler
+from lib.utils.tts_cache import delete_old_cache_folders
+
+
+EPISODE_TASK_FUNCTION = "new_episode_task"
+
+
+def get_task_id(podcast, run_date):
+    # task ids can only have letters, numbers, - and _
+    return re.sub(r"[^A-Za-z0-9_-]", "-", f"{podcast['podcast_id']}_{run_date}")
+
+
+def enqueue_due_podcasts(bucket, task_queue=None):
+    # returns what happened to each podcast ("queued", "already_queued" or "failed"), keyed by podcast id
+    # tts clips of runs that never finished their audio
+    try:
+        print_in_red(f"{delete_old_cache_folders(bucket)} old tts cache clips deleted")
+    except Exception as e:
+        print("Error deleting old tts cache clips: ", repr(e))
+
+    podcasts = list_due_podcasts()
+    print_in_red(f"{len(podcasts)} podcasts due")
+    if not podcasts:
+        return {}
+
+    task_queue = task_queue or functions.task_queue(EPISODE_TASK_FUNCTION)
+    run_date = get_run_date()
+    statuses = {}
+    for podcast in podcasts:
+        try:
+            task_queue.enqueue({"podcast_id": podcast["podcast_id"]},
+                               functions.TaskOptions(task_id=get_task_id(podcast, run_date)))
+            statuses[podcast["podcast_id"]] = "queued"
+        except AlreadyExistsError:
+            statuses[podcast["podcast_id"]] = "already_queued"
+        except Exception as e:
+            print("Error queueing episode for podcast", podcast["podcast_id"], ": ", repr(e))
+            statuses[podcast["podcast_id"]] = "failed"
+
+    print_in_red(f"{sum(status == 'queued' for status in statuses.values())} episodes queued, "
+                 f"{sum(status == 'already_queued' for status in statuses.values())} already queued, "
+                 f"{sum(status == 'failed' for status in statuses.values())} failed")
+    return statuses
+
+
+def run_podcast(podcast, openai_client, bucket, tts_workers=TTS_MAX_WORKERS):
+    # makes (or resumes) today's episode for one podcast
+    # returns its status. errors are recorded on the podcast and in the status
+    start_time = time.perf_counter()
+    run = None
+    try:
+        run = EpisodeRun.load_or_create(bucket, podcast)
+        # committed with the new run when the pipeline starts
+        update_podcast_status(podcast, "running", {"last_run_id": run.run_id}, writes=run.writes)
+
+        rss_url = run_episode_pipeline(run, openai_client, bucket, tts_workers)
+
+        update_podcast_status(podcast, "complete", {"last_run_id": run.run_id, "rss_url": rss_url,
+                                                    "last_episode_date": run.data.get("run_date")})
+        status = {"status": "complete", "rss_url": rss_url}
+    except Exception as e:
+        print("Error generating episode for podcast", podcast["podcast_id"], ": ", repr(e))
+        try:
+            update_podcast_status(podcast, "failed", {"last_run_id": run.run_id if run else None, "last_error": repr(e)})
+        except Exception as status_error:
+            print("Error updating status of podcast", podcast["podcast_id"], ": ", repr(status_error))
+        status = {"status": "failed", "error": repr(e)}
+
+    status["run_id"] = run.run_id if run else None
+    status["seconds"] = time.perf_counter() - start_time
+    return status
+
+
+def run_podcast_task(podcast_id, openai_client, bucket, tts_workers=TTS_MAX_WORKERS):
+    # what one new_episode_task does
+    # raises when the episode fails, so the queue tries the task again
+    podcast = load_podcast(podcast_id)
+    status = run_podcast(podcast, openai_client, bucket, tts_workers)
+    print_in_red(f"podcast {podcast_id}: {status['status']} in {status['seconds']:.1f}s")
+    print(openai_scheduler.get_summary())
+    if status["status"] != "complete":
+        raise Exception("Episode failed for podcast:", podcast_id, status.get("error"))
+    return status
@@ -0,0 +1,122 @@
+# streams the episode script from the model so audio can start before the whole script is written
+# the structured response looks like {"script": [{"voice": "...", "text": "..."}, ...]}.
+# ScriptLineParser reads it as it arrives and returns each line as soon as its object is closed,
+# and StreamingScript hands those lines out in order. when the stream ends the whole response is
+# validated against the Podcast model and must match the lines that were already handed out.
+# on_finished gets the Podcast right then, before the audio of the last lines is waited on
+import json
+import time
+from contextlib import ExitStack
+
+from lib.constants.global_constants import SCRIPT_MODEL, OPENAI_COMPLETION_TOKENS_ESTIMATE
+from lib.utils.utility_functions import Line, Podcast
+from lib.utils.openai_scheduler import openai_scheduler, estimate_tokens, get_used_tokens, PRIORITY_SCRIPT
+from lib.utils.tracing import span
+
+
+class ScriptLineParser:
+    # incremental parser for the script array
+    # only tracks strings, escapes and nesting, full json parsing is left to json.loads on each finished line
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        # depth of the script array once it has started
+        self.array_depth = None
+        self.line_start = None
+
+    def feed(self, text):
+        # takes the next piece of the response
+        # returns the dicts of lines that were finished by it
+        self.buffer += text
+        finished_lines = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if char == "[" and self.array_depth is None:
+                    self.array_depth = self.depth
+                elif char == "{" and self.array_depth is not None and self.depth == self.array_depth + 1:
+                    self.line_start = self.position
+            elif char in "}]":
+                if char == "}" and self.line_start is not None and self.depth == self.array_depth + 1:
+                    finished_lines.append(json.loads(self.buffer[self.line_start:self.position + 1]))
+                    self.line_start = None
+                self.depth -= 1
+            self.position += 1
+
+        # text before an unfinished line isn't needed anymore
+        keep_from = self.line_start if self.line_start is not None else self.position
+        self.buffer = self.buffer[keep_from:]
+        self.position -= keep_from
+        if self.line_start is not None:
+            self.line_start = 0
+        return finished_lines
+
+
+class StreamingScript:
+    # iterating yields each Line of the script as soon as the model has finished writing it
+    # after iterating, podcast holds the validated Podcast
+    # on_finished(podcast) is called once the stream has ended and the script is validated, so it can be saved
+    # while the audio of its last lines is still being made
+    # the scheduler's slot only covers starting the request. holding it while the script streams
+    # could keep the tts calls for this script's lines waiting. its tokens are settled once it's done
+    def __init__(self, openai_client, message, role="system", model=SCRIPT_MODEL, on_finished=None):
+        self.openai_client = openai_client
+        self.message_list = [{"role": role, "content": message}]
+        self.model = model
+        self.on_finished = on_finished
+        self.podcast = None
+
+    def __iter__(self):
+        parser = ScriptLineParser()
+        lines = []
+        start_time = time.perf_counter()
+        with span("openai.chat", detached=True, model=self.model, structured=True, streamed=True) as chat_span, \
+                ExitStack() as stack:
+            tokens = estimate_tokens(self.message_list, OPENAI_COMPLETION_TOKENS_ESTIMATE)
+            stream = openai_scheduler.run(lambda: stack.enter_context(self.openai_client.beta.chat.completions.stream(
+                model=self.model,
+                messages=self.message_list,
+                response_format=Podcast,
+            )), model=self.model, priority=PRIORITY_SCRIPT, tokens=tokens)
+
+            for event in stream:
+                if event.type != "content.delta":
+                    continue
+                for line_data in parser.feed(event.delta):
+                    line = Line.model_validate(line_data)
+                    if not lines:
+                        chat_span.set(first_line_seconds=time.perf_counter() - start_time)
+                    lines.append(line)
+                    yield line
+
+            completion = stream.get_final_completion()
+            used_tokens = get_used_tokens(completion)
+            if used_tokens is not None:
+                openai_scheduler.settle_tokens(self.model, tokens, used_tokens)
+            usage = getattr(completion, "usage", None)
+            if usage:
+                chat_span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            chat_span.set(lines=len(lines))
+
+        podcast = completion.choices[0].message.parsed
+        if podcast is None:
+            raise Exception("Error getting script from podcast:", completion.choices[0].message)
+        if podcast.script != lines:
+            # audio was already made from the streamed lines, so they have to be the script
+            raise Exception("Streamed script lines don't match the final script:", len(lines), len(podcast.script))
+        self.podcast = podcast
+        if self.on_finished:
+            self.on_finished(podcast)
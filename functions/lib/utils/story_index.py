@@ -0,0 +1,185 @@
+# the stories each podcast covered in the last few days, so they aren't fetched and discussed again
+# every article that goes in a script prompt is added to the podcast's doc in the story_index collection
+# with its url and a minhash of its title's words. the next run looks new feed entries up before their pages
+# are fetched: an entry with a covered url, or a title that shares most of its words with a covered one
+# (the same story with a reworded headline), is pushed behind the new entries so it's only used when a
+# feed doesn't have enough new ones.
+# near duplicates are found without comparing against every story: the minhash is split into bands and only
+# stories with an equal band (titles that similar almost always have one) have their words compared.
+# stories older than STORY_INDEX_MAX_AGE_DAYS are dropped when the index is loaded and when it's saved
+import hashlib
+import random
+import time
+
+from firebase_admin import firestore
+
+from lib.constants.global_constants import (NUM_ARTICLES_PER_CATEGORY, STORY_INDEX_MAX_AGE_DAYS, STORY_INDEX_MAX_STORIES, STORY_MINHASH_NUM_HASHES,
+                                            STORY_MINHASH_ROWS_PER_BAND, STORY_TITLE_SIMILARITY)
+from lib.utils.prompt_builder import normalize_url, normalize_title
+from lib.utils.clients import get_firestore_client
+
+
+STORY_INDEX_COLLECTION = "story_index"
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_MAX = (1 << 32) - 1
+# the same seed every time, so signatures saved by earlier runs can be compared with new ones
+minhash_params = [(random.Random(seed).randrange(1, MINHASH_PRIME), random.Random(-seed).randrange(0, MINHASH_PRIME))
+                  for seed in range(1, STORY_MINHASH_NUM_HASHES + 1)]
+
+
+def get_word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def get_minhash(title):
+    # list of STORY_MINHASH_NUM_HASHES 32 bit values, or None for a title without any words
+    # two titles have about as many values in common as they have words in common
+    word_hashes = {get_word_hash(word) for word in get_title_words(title)}
+    if not word_hashes:
+        return None
+    return [min(((a * word_hash + b) % MINHASH_PRIME) & MINHASH_MAX for word_hash in word_hashes)
+            for a, b in minhash_params]
+
+
+def encode_minhash(minhash):
+    # saved as hex since the list is compared and banded as it is
+    return "".join(format(value, "08x") for value in minhash) if minhash else ""
+
+
+def decode_minhash(minhash_text):
+    return [int(minhash_text[start:start + 8], 16) for start in range(0, len(minhash_text or ""), 8)] or None
+
+
+def get_title_words(title):
+    return set(normalize_title(title).split())
+
+
+def get_similarity(words_a, words_b):
+    # share of the two titles' words that are in both
+    return len(words_a & words_b) / len(words_a | words_b) if words_a or words_b else 0
+
+
+def get_bands(minhash):
+    # (band number, values) for each band of rows. titles that share enough words have at least one equal band
+    return [(band, tuple(minhash[start:start + STORY_MINHASH_ROWS_PER_BAND]))
+            for band, start in enumerate(range(0, len(minhash), STORY_MINHASH_ROWS_PER_BAND))]
+
+
+def make_story(article, covered_at=None):
+    # what's saved for each covered article
+    return {
+        "url": normalize_url(article.get("link")),
+        "minhash": encode_minhash(get_minhash(article.get("title"))),
+        "title": article.get("title"),
+        "covered_at": covered_at or time.time(),
+    }
+
+
+class StoryIndex:
+    def __init__(self, stories=(), min_similarity=STORY_TITLE_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.stories = []
+        self.urls = {}
+        # (band number, values) -> (title words, story) of stories with that band
+        self.bands = {}
+        for story in stories:
+            self.add(story)
+
+    def __len__(self):
+        return len(self.stories)
+
+    def add(self, story):
+        self.stories.append(story)
+        if story.get("url"):
+            self.urls[story["url"]] = story
+        minhash = decode_minhash(story.get("minhash"))
+        # a title without any words has nothing to match on
+        if minhash and len(minhash) == STORY_MINHASH_NUM_HASHES:
+            for band in get_bands(minhash):
+                self.bands.setdefault(band, []).append((get_title_words(story.get("title")), story))
+
+    def find(self, article):
+        # returns the covered story the article is, or None
+        url = normalize_url(article.get("link"))
+        if url and url in self.urls:
+            return self.urls[url]
+        minhash = get_minhash(article.get("title"))
+        if not minhash:
+            return None
+        # only stories that share a band are compared, by their actual words
+        words = get_title_words(article.get("title"))
+        for band in get_bands(minhash):
+            for story_words, story in self.bands.get(band, []):
+                if get_similarity(words, story_words) >= self.min_similarity:
+                    return story
+        return None
+
+    def demote_covered(self, articles):
+        # takes feed entries or articles (anything with a title and link)
+        # returns them with covered ones moved to the end, both in their original order,
+        # and the number that were covered
+        new_articles, covered_articles = [], []
+        for article in articles:
+            (covered_articles if self.find(article) else new_articles).append(article)
+        return new_articles + covered_articles, len(covered_articles)
+
+
+def prefer_new_articles(articles_per_section, story_index, num_articles=NUM_ARTICLES_PER_CATEGORY):
+    # takes a list of article lists, one per section
+    # returns the lists with covered stories after the new ones and at most num_articles in each,
+    # and the number of covered stories still in them
+    new_articles_per_section = []
+    num_covered_kept = 0
+    for articles in articles_per_section:
+        articles, num_covered = story_index.demote_covered(articles)
+        new_articles_per_section.append(articles[:num_articles])
+        num_covered_kept += max(0, min(num_articles, len(articles)) - (len(articles) - num_covered))
+    return new_articles_per_section, num_covered_kept
+
+
+# story index doc example:
+# {
+#     "podcast_id": "PIiVCmdQfcGeSE7BZMj5",
+#     "stories": [
+#         {
+#             "url": "abcnews.go.com/us/fed-holds-rates/story",
+#             "minhash": "9f3a61c20b7e4d15...",  (STORY_MINHASH_NUM_HASHES 8 character hex values)
+#             "title": "Fed holds interest rates steady",
+#             "covered_at": 1733621011.5  (seconds since epoch)
+#         }
+#     ],  newest first
+#     "updated_at": "Sun, 08 Dec 2024 01:24:55 GMT"
+# }
+def get_story_index_ref(podcast_id):
+    return get_firestore_client().collection(STORY_INDEX_COLLECTION).document(str(podcast_id))
+
+
+def load_stories(podcast_id, max_age_days=STORY_INDEX_MAX_AGE_DAYS):
+    # returns the podcast's covered stories that are young enough to still count, newest first
+    # only the stories field is read
+    doc = get_story_index_ref(podcast_id).get(field_paths=["stories"])
+    if not doc.exists:
+        return []
+    oldest = time.time() - max_age_days * 24 * 60 * 60
+    return [story for story in (doc.to_dict() or {}).get("stories") or [] if story.get("covered_at", 0) >= oldest]
+
+
+def load_story_index(podcast_id):
+    return StoryIndex(load_stories(podcast_id))
+
+
+def add_to_story_index(podcast_id, stories, writes=None):
+    # adds the stories to the front of the podcast's index and drops old ones
+    # a story that's covered again replaces its old entry, so a retried run doesn't add it twice
+    # writes is the run's WriteBatch, when there is one
+    new_urls = {story["url"] for story in stories}
+    old_stories = [story for story in load_stories(podcast_id) if story.get("url") not in new_urls]
+    index = {
+        "podcast_id": str(podcast_id),
+        "stories": (list(stories) + old_stories)[:STORY_INDEX_MAX_STORIES],
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+    if writes is not None:
+        writes.set(STORY_INDEX_COLLECTION, str(podcast_id), index, merge=False)
+    else:
+        get_story_index_ref(podcast_id).set(index)
@@ -0,0 +1,164 @@
+# timed spans and counters for an episode run
+# every span is logged as one json line (cloud logging reads these as structured logs)
+# and added to the run's trace, which logs a summary per span name when the run ends.
+# numbers set on a span (bytes, tokens, ...) are summed in the summary, and the values of
+# attributes in SUMMARY_COUNTED_ATTRIBUTES (cache hits, tts source, ...) are counted.
+# the current trace and span are kept in context variables, so spans started in asyncio tasks
+# are nested under the span that started them. thread pools need submit_in_context for the same
+import asyncio
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from lib.constants.global_constants import TRACE_LOG_SPANS
+
+
+# attributes whose values are counted in the summary, like cache=not_modified
+SUMMARY_COUNTED_ATTRIBUTES = ["status", "cache", "source"]
+# numbers that aren't amounts, so they aren't summed
+SUMMARY_IGNORED_ATTRIBUTES = ["line_number", "tts_workers"]
+
+# functions called with the summary of every finished trace, like the benchmark's collector
+trace_listeners = []
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def log_json(message, severity="INFO", **fields):
+    print(json.dumps(dict(fields, message=message, severity=severity), default=str))
+
+
+class Span:
+    def __init__(self, name, parent_name=None, attributes=None):
+        self.name = name
+        self.parent_name = parent_name
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+        self.seconds = 0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Trace:
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stats_by_span = {}
+        self.counters = {}
+
+    def record(self, span):
+        with self.lock:
+            stats = self.stats_by_span.setdefault(span.name, {"count": 0, "seconds": 0, "max_seconds": 0, "totals": {}})
+            stats["count"] += 1
+            stats["seconds"] += span.seconds
+            stats["max_seconds"] = max(stats["max_seconds"], span.seconds)
+            values = dict(span.attributes, status=span.status)
+            for key, value in values.items():
+                if key in SUMMARY_IGNORED_ATTRIBUTES:
+                    continue
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats["totals"][key] = stats["totals"].get(key, 0) + value
+                elif key in SUMMARY_COUNTED_ATTRIBUTES:
+                    total_key = f"{key}={value}"
+                    stats["totals"][total_key] = stats["totals"].get(total_key, 0) + 1
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get_summary(self):
+        with self.lock:
+            return {
+                "trace": self.name,
+                "trace_id": self.trace_id,
+                "seconds": time.perf_counter() - self.start_time,
+                "attributes": self.attributes,
+                "spans": {name: dict(stats, totals=dict(stats["totals"])) for name, stats in self.stats_by_span.items()},
+                "counters": dict(self.counters),
+            }
+
+    def log_summary(self):
+        summary = self.get_summary()
+        log_json(f"{self.name} summary", event="trace_summary", **summary)
+
+        # readable version of the same numbers
+        print(f"{self.name} took {summary['seconds']:.2f}s")
+        for name, stats in sorted(summary["spans"].items(), key=lambda item: -item[1]["seconds"]):
+            totals = ", ".join(f"{key} {round(value, 2)}" for key, value in sorted(stats["totals"].items()))
+            print(f"    {name}: {stats['count']}x, {stats['seconds']:.2f}s total, {stats['max_seconds']:.2f}s max"
+                  + (f" ({totals})" if totals else ""))
+        if summary["counters"]:
+            print("    counters: " + ", ".join(f"{name} {value}" for name, value in sorted(summary["counters"].items())))
+        return summary
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    # spans started inside this block (in this thread, its asyncio tasks,
+    # and tasks submitted with submit_in_context) are recorded in the trace
+    trace = Trace(name, **attributes)
+    trace_token = current_trace.set(trace)
+    span_token = current_span.set(None)
+    try:
+        yield trace
+    finally:
+        current_span.reset(span_token)
+        current_trace.reset(trace_token)
+        summary = trace.log_summary()
+        for listener in trace_listeners:
+            listener(summary)
+
+
+@contextmanager
+def span(name, detached=False, **attributes):
+    # times the block. attributes can be added while it runs with span.set(...)
+    # a detached span isn't made the current span. use it for blocks that yield to their caller,
+    # like a generator, so the caller's spans aren't nested under it
+    trace = current_trace.get()
+    parent = current_span.get()
+    this_span = Span(name, parent.name if parent else None, attributes)
+    token = None if detached else current_span.set(this_span)
+    start_time = time.perf_counter()
+    try:
+        yield this_span
+    except BaseException as e:
+        this_span.status = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+        this_span.set(error=repr(e))
+        raise
+    finally:
+        this_span.seconds = time.perf_counter() - start_time
+        if token:
+            current_span.reset(token)
+        if trace:
+            trace.record(this_span)
+        if TRACE_LOG_SPANS:
+            log_json(name, "ERROR" if this_span.status == "error" else "INFO", event="span",
+                     trace_id=trace.trace_id if trace else None, parent=this_span.parent_name,
+                     seconds=round(this_span.seconds, 4), status=this_span.status, **this_span.attributes)
+
+
+def set_span_attributes(**attributes):
+    # adds attributes to the innermost span, if there is one
+    this_span = current_span.get()
+    if this_span:
+        this_span.set(**attributes)
+
+
+def count(name, amount=1):
+    # adds to a counter of the current trace, if there is one
+    trace = current_trace.get()
+    if trace:
+        trace.count(name, amount)
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    # like executor.submit, but fn runs with the caller's trace and span
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,165 @@
+# content addressed cache for text to speech audio
+# audio is keyed by a hash of (model, voice, text) so intros, sign-offs
+# and lines from retried episodes are only paid for once.
+# checked in order: local disk (per instance), bucket, then openai
+# the bucket tier is only for resuming a run: clips are wav, many times the size of the published episode,
+# so they're kept in a folder of the run (get_run_cache_folder) that's deleted once its audio is uploaded.
+# runs that never finish are swept by delete_old_cache_folders. as a backstop the bucket can also have a
+# lifecycle rule that deletes objects under tts-cache/ older than TTS_CACHE_BUCKET_MAX_AGE_DAYS
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import NotFound
+
+from lib.constants.global_constants import (TTS_MODEL, TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_CACHE_BUCKET_FOLDER,
+                                            TTS_CACHE_BUCKET_MAX_AGE_DAYS, TTS_CACHE_UPLOAD_WORKERS)
+from lib.utils.disk_cache import DiskLruCache
+from lib.utils.utility_functions import get_audio_bytes_from_text
+
+
+# shared by every run on this instance
+tts_disk_cache = DiskLruCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+
+
+def get_tts_cache_key(text, voice, model=TTS_MODEL):
+    return hashlib.sha256(f"{model}\n{voice}\n{text}".encode("utf-8")).hexdigest()
+
+
+def get_run_cache_folder(run_id):
+    return TTS_CACHE_BUCKET_FOLDER + run_id + "/"
+
+
+def delete_cache_folder(bucket, bucket_folder):
+    # returns the number of clips deleted
+    num_deleted = 0
+    for blob in bucket.list_blobs(prefix=bucket_folder):
+        try:
+            blob.delete()
+            num_deleted += 1
+        except NotFound:
+            pass
+    return num_deleted
+
+
+def delete_old_cache_folders(bucket, max_age_days=TTS_CACHE_BUCKET_MAX_AGE_DAYS):
+    # deletes the clips of runs that stopped without finishing their audio
+    # returns the number of clips deleted
+    oldest = time.time() - max_age_days * 24 * 60 * 60
+    num_deleted = 0
+    for blob in bucket.list_blobs(prefix=TTS_CACHE_BUCKET_FOLDER):
+        if blob.time_created and blob.time_created.timestamp() < oldest:
+            try:
+                blob.delete()
+                num_deleted += 1
+            except NotFound:
+                pass
+    return num_deleted
+
+
+class TtsCache:
+    # without a bucket_folder only the disk tier is used
+    # clips are uploaded to the bucket in the background, call finish() to wait for them
+    def __init__(self, bucket=None, bucket_folder=None, disk_cache=tts_disk_cache):
+        self.bucket = bucket if bucket_folder else None
+        self.bucket_folder = bucket_folder
+        self.disk_cache = disk_cache
+        self.lock = threading.Lock()
+        self.counters = {"disk_hits": 0, "bucket_hits": 0, "misses": 0, "errors": 0}
+        # keys of the clips in the bucket folder, listed on the first lookup so a miss doesn't cost a download
+        self.bucket_keys = None
+        self.upload_executor = None
+        self.uploads = []
+
+    def count(self, counter_name):
+        with self.lock:
+            self.counters[counter_name] += 1
+
+    def save_to_disk(self, key, audio_bytes):
+        try:
+            self.disk_cache.put(key, audio_bytes)
+        except OSError as e:
+            self.count("errors")
+            print("Error writing tts cache to disk: ", repr(e))
+
+    def get_bucket_blob(self, key):
+        return self.bucket.blob(self.bucket_folder + key + ".wav")
+
+    def get_bucket_keys(self):
+        with self.lock:
+            if self.bucket_keys is None:
+                try:
+                    self.bucket_keys = {blob.name[len(self.bucket_folder):].removesuffix(".wav")
+                                        for blob in self.bucket.list_blobs(prefix=self.bucket_folder)}
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    print("Error listing tts cache in bucket: ", repr(e))
+                    self.bucket_keys = set()
+            return self.bucket_keys
+
+    def get_audio_bytes_from_text(self, openai_client, text="test", voice="alloy"):
+        # returns audio bytes and where they came from ("disk", "bucket" or "tts")
+        key = get_tts_cache_key(text, voice)
+
+        audio_bytes = self.disk_cache.get(key)
+        if audio_bytes is not None:
+            self.count("disk_hits")
+            return audio_bytes, "disk"
+
+        if self.bucket is not None and key in self.get_bucket_keys():
+            try:
+                audio_bytes = self.get_bucket_blob(key).download_as_bytes()
+                self.count("bucket_hits")
+                self.save_to_disk(key, audio_bytes)
+                return audio_bytes, "bucket"
+            except NotFound:
+                pass
+            except Exception as e:
+                # the cache should never stop an episode from being made
+                self.count("errors")
+                print("Error reading tts cache from bucket: ", repr(e))
+
+        self.count("misses")
+        audio_bytes = get_audio_bytes_from_text(openai_client=openai_client, text=text, voice=voice)
+        self.put(text, voice, audio_bytes)
+        return audio_bytes, "tts"
+
+    def put(self, text, voice, audio_bytes):
+        # stores audio for the text, replacing anything cached for it
+        key = get_tts_cache_key(text, voice)
+        self.save_to_disk(key, audio_bytes)
+        if self.bucket is not None:
+            # the tts worker goes on to its next request instead of waiting for the upload
+            with self.lock:
+                if self.upload_executor is None:
+                    self.upload_executor = ThreadPoolExecutor(max_workers=TTS_CACHE_UPLOAD_WORKERS)
+                self.uploads.append(self.upload_executor.submit(self.save_to_bucket, key, audio_bytes))
+
+    def save_to_bucket(self, key, audio_bytes):
+        try:
+            self.get_bucket_blob(key).upload_from_string(audio_bytes, content_type="audio/wav")
+            with self.lock:
+                if self.bucket_keys is not None:
+                    self.bucket_keys.add(key)
+        except Exception as e:
+            self.count("errors")
+            print("Error writing tts cache to bucket: ", repr(e))
+
+    def finish(self):
+        # waits for the clips still being uploaded
+        with self.lock:
+            upload_executor, self.upload_executor = self.upload_executor, None
+            uploads, self.uploads = self.uploads, []
+        for upload in uploads:
+            upload.result()
+        if upload_executor:
+            upload_executor.shutdown()
+
+    def get_summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+        lookups = counters["disk_hits"] + counters["bucket_hits"] + counters["misses"]
+        hit_rate = (lookups - counters["misses"]) / lookups if lookups else 0
+        return f"tts cache: {counters['disk_hits']} disk hits, {counters['bucket_hits']} bucket hits, " \
+               f"{counters['misses']} misses, {counters['errors']} errors ({hit_rate:.0%} hit rate)"
@@ -0,0 +1,105 @@
+# plans the tts requests for a script
+# scripts are mostly short lines, and every tts request pays for its own round trip and leading silence,
+# so consecutive lines with the same voice are sent as one request (up to TTS_MERGE_MAX_CHARS).
+# a line longer than tts accepts (TTS_INPUT_MAX_CHARS) is split at sentence ends into several requests.
+# each request keeps the line numbers it covers, so its clip's segment says which lines are in it.
+# merged lines are read as one passage by their speaker. clips still get the gap before them, except the
+# later parts of a split line, so the gaps between speakers are the same as with one request per line.
+# the plan only depends on the script, so a retried run makes the same requests and finds them in the tts cache
+import re
+
+from lib.constants.global_constants import TTS_INPUT_MAX_CHARS, TTS_MERGE_MAX_CHARS
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+# tts request example:
+# {
+#     "line_numbers": [3, 4],
+#     "voice": "fable",
+#     "text": "text of line 3 text of line 4",
+#     "chunk": 0,  which part of a split line this is
+#     "num_chunks": 1
+# }
+def make_request(line_numbers, voice, text, chunk=0, num_chunks=1):
+    return {"line_numbers": line_numbers, "voice": voice, "text": text, "chunk": chunk, "num_chunks": num_chunks}
+
+
+def split_long_text(text, max_chars=TTS_INPUT_MAX_CHARS):
+    # splits text into parts of at most max_chars, at sentence ends where possible,
+    # then between words, and only mid word when a word is longer than max_chars
+    if len(text) <= max_chars:
+        return [text]
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        pieces.append(sentence)
+
+    parts = []
+    for piece in pieces:
+        if parts and len(parts[-1]) + 1 + len(piece) <= max_chars:
+            parts[-1] += " " + piece
+        else:
+            parts.append(piece)
+    return parts
+
+
+def plan_tts_requests(podcast_script, line_numbers=None, max_merge_chars=TTS_MERGE_MAX_CHARS):
+    # podcast_script can be a list or an iterator of lines that are still being written
+    # line_numbers are the script line numbers of those lines, when they aren't 0, 1, 2, ...
+    # yields requests in script order. a request is only yielded once the line after it is known
+    # (or the script has ended), since that line could have been merged into it
+    group_line_numbers, group_texts, group_voice = [], [], None
+    for index, script_line in enumerate(podcast_script):
+        line_number = line_numbers[index] if line_numbers is not None else index
+        voice = script_line.voice.lower()
+        text = script_line.text
+
+        # a line too long for one request is never merged
+        too_long = len(text) > TTS_INPUT_MAX_CHARS
+        can_merge = (not too_long and group_line_numbers and voice == group_voice
+                     and group_line_numbers[-1] == line_number - 1
+                     and len(" ".join(group_texts + [text])) <= min(max_merge_chars, TTS_INPUT_MAX_CHARS))
+        if group_line_numbers and not can_merge:
+            yield make_request(group_line_numbers, group_voice, " ".join(group_texts))
+            group_line_numbers, group_texts = [], []
+
+        if too_long:
+            parts = split_long_text(text)
+            for chunk, part in enumerate(parts):
+                yield make_request([line_number], voice, part, chunk, len(parts))
+            continue
+
+        group_line_numbers.append(line_number)
+        group_texts.append(text)
+        group_voice = voice
+
+    if group_line_numbers:
+        yield make_request(group_line_numbers, group_voice, " ".join(group_texts))
+
+
+def plan_tts_requests_for_segments(podcast_script, segments, redo_line_numbers=None):
+    # plans the requests for an episode that was already made, keeping its clips:
+    # the lines of each clip (all the chunks of a split line count as one clip) are planned together,
+    # so a clip's lines are never merged with another clip's
+    # with redo_line_numbers, only the clips that have one of those lines are planned
+    # returns the requests in order
+    clip_line_numbers = []
+    for segment in segments:
+        segment_line_numbers = segment.get("line_numbers") or [segment["line_number"]]
+        # later chunks of a split line have the same lines as the first one
+        if not (clip_line_numbers and segment.get("chunk") and clip_line_numbers[-1] == segment_line_numbers):
+            clip_line_numbers.append(segment_line_numbers)
+
+    requests = []
+    for line_numbers in clip_line_numbers:
+        if redo_line_numbers is not None and not set(line_numbers) & set(redo_line_numbers):
+            continue
+        requests.extend(plan_tts_requests([podcast_script[line_number] for line_number in line_numbers], line_numbers,
+                                          max_merge_chars=TTS_INPUT_MAX_CHARS))
+    return requests
@@ -1,38 +1,29 @@
 # useful functions that might be used across multiple modules
-from lib.constants.global_constants import DELAY_BETWEEN_NEWS_FETCH, NUM_ARTICLES_PER_CATEGORY, date_as_text, time_as_text
+from lib.constants.global_constants import (NUM_ARTICLES_PER_CATEGORY, TTS_MODEL, SCRIPT_MODEL,
+                                            OPENAI_COMPLETION_TOKENS_ESTIMATE)
+from lib.utils.tracing import span
+from lib.utils.openai_scheduler import (openai_scheduler, estimate_tokens, get_used_tokens, PRIORITY_SCRIPT, PRIORITY_CHAT,
+                                        PRIORITY_TTS)
+from lib.utils.clients import get_firestore_client
+from lib.utils.listing import list_docs, EPISODE_LIST_FIELDS
 
 
-import time
-import feedparser
-from feedgen.feed import FeedGenerator
-from datetime import timedelta
-import requests
-from bs4 import BeautifulSoup
 from pydantic import BaseModel
 from typing import Literal
 
 from firebase_admin import firestore
-from firebase_admin import storage
 
 
 def print_in_red(text):
     print(f"\033[91m{text}\033[0m")
 
-def get_last_n_episodes(num_episodes=5):
-    db = firestore.client()
-    # num_episodes = int(request.args.get('numEpisodes', 5))  # Default to 5
-
-    episodes = []
-    docs = db.collection('episodes').order_by('created_at', direction='DESCENDING').limit(num_episodes).stream()
-    # print_in_red("docs:")
-    # print(docs)
-    for doc in docs:
-        episodes.append({
-            'id': doc.id,
-            'data': doc.to_dict()
-        })
-
-    return episodes
+# only the given fields are read, script_text and segments aren't unless they're asked for
+# podcast_id limits it to one podcast's episodes
+# more than LIST_MAX_PAGE_SIZE episodes are read a page at a time
+def get_last_n_episodes(num_episodes=5, fields=None, podcast_id=None):
+    filters = [("podcast_id", "==", podcast_id)] if podcast_id is not None else []
+    return [{'id': doc_id, 'data': data}
+            for doc_id, data in list_docs('episodes', fields or EPISODE_LIST_FIELDS, num_episodes, filters=filters)]
 
 
 # podcast example:
@@ -45,7 +36,14 @@ def get_last_n_episodes(num_episodes=5):
 #     "rss_url": "example.com",
 #     "title": "Daily Summary",
 #     "updated_at": "Sun, 08 Dec 2024 01:24:55 GMT",
-#     "user_id": "testUser"
+#     "user_id": "testUser",
+#     optional, read by the scheduler:
+#     "feeds": {"headlines": "https://abcnews.go.com/abcnews/topstories"},
+#     "active": true,
+#     written by the scheduler:
+#     "last_run_status": "complete",
+#     "last_run_id": "PIiVCmdQfcGeSE7BZMj5_testUser_2024-12-08_1733621011000",
+#     "last_episode_date": "2024-12-08"
 # }
 
 # episode example:
@@ -59,6 +57,7 @@ def get_last_n_episodes(num_episodes=5):
 #     "podcast_id": "1",
 #     "script_text": "{\"script\":[{\"voice\":\"fable\",\"text\":\"hi\"}]}",
 #     "title": "Daily Podcast for November",
+#     "topics": ["Fed holds interest rates", "Lakers beat the Celtics"],
 #     "updated_at": "Mon, 25 Nov 2024 01:29:28 GMT",
 #     "url": "https://1rfdbdyvforthaxq.publ",
 #     "user_id": "testUser"
@@ -68,7 +67,8 @@ collection_name_to_id_key = {
     "episodes" : "episode_id",
     "podcasts" : "podcast_id", 
 }
-def db_insert(data, collection_name="episodes", id=None):    
+# with writes (a WriteBatch from db_writes.py) the insert is queued on it
+def db_insert(data, collection_name="episodes", id=None, writes=None):    
     # if id not supplied, get id from data supplied
     if (id == None):
         # try:
@@ -76,7 +76,11 @@ def db_insert(data, collection_name="episodes", id=None):
         # except Exception as e:    
         #     print ("error getting id from data", e)
     
-    db = firestore.client()    
+    if writes is not None:
+        writes.set(collection_name, id, data, merge=True)
+        return
+
+    db = get_firestore_client()    
 
     # merge true for safety to avoid accidentally deleting data
     db.collection(collection_name).document(id).set(data, merge=True)
@@ -102,66 +106,23 @@ def db_update(data, collection_name="podcasts", id=None):
     if (id == None):
         id = data[collection_name_to_id_key[collection_name]]
 
-    db = firestore.client()    
+    db = get_firestore_client()    
     db.collection(collection_name).document(id).update(data)
 
 
 # voiceOptions = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
 def get_audio_bytes_from_text(openai_client, text="test", voice="alloy"):
-    response = openai_client.audio.speech.create(
-        model="tts-1",
-        voice=voice,
-        input=text,
-        response_format="wav"
-    )
-
-    return response.content
-
-
-
-def generate_rss_text():
-    bucket = storage.bucket()
-    blobFiles = bucket.list_blobs(prefix="audio/testUser/podcastId/")
-    # print('response is', blobFiles)
-
-    fg = FeedGenerator()
-    fg.load_extension('podcast')
-    fg.id('testUsersPodcast')
-    fg.title('Sam\'s Personal Podcast')
-    fg.author( {'name':'Personal Podcasts','email':'samshandymansolutions@gmail.com'} )
-    fg.link( href='https://personal-podcasts.vercel.app', rel='alternate' )
-    fg.logo('http://example.com/logo.jpg')
-    fg.subtitle('Personal Podcasts by Sam')
-    fg.language('en')
-    for file in blobFiles: 
-        # print_in_red(file.public_url)
-        # print_in_red(file.content_type)
-        if file.content_type and file.content_type[0:5] == 'audio':
-        # if file.content_type and file.content_type[0:5] == 'text/':
-            # print("file is", file) 
-            # print("updated at", type(file.time_created)) 
-            dt = file.time_created - timedelta(hours = 4)
-            human_readable_date = dt.strftime("%B %d, %Y")
-            human_readable_time = dt.strftime("%I:%M %p")
-
-            fe = fg.add_entry()
-            fe.title("Sam's Daily Podcast for " + human_readable_date)
-             
-            fe.enclosure(url=file.public_url, length=int(file.size),  type=file.content_type)
-            fe.pubDate(file.time_created)
-            fe.link(href=file.public_url)
-            fe.guid(file.public_url, permalink=True)  
-            fe.description(f"""Sam's Daily Podcast for {human_readable_date}. 
-This podcast was created entirely by AI. 
-It covers the latest news stories and headlines. 
-It was created at {human_readable_time}. 
-The code to create it was written by Sam Inniss.
-Enjoy!  😎
-            """)
-            # fe.author(name=file.author.name, email=file.author.email)
-    return fg.rss_str(pretty=True)
+    with span("openai.tts", voice=voice, characters=len(text)) as tts_span:
+        response = openai_scheduler.run(lambda: openai_client.audio.speech.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format="wav"
+        ), model=TTS_MODEL, priority=PRIORITY_TTS)
 
+        tts_span.set(bytes=len(response.content))
 
+    return response.content
 
 
 
@@ -171,7 +132,27 @@ class Line(BaseModel):
 class Podcast(BaseModel):
     script: list[Line]
 
-def message_ai_structured(openai_client, message="", role="system", chat_history=[], structure=Podcast):
+def set_usage(chat_span, completion):
+    # token counts reported by openai
+    usage = getattr(completion, "usage", None)
+    if usage:
+        chat_span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+def message_ai(openai_client, message="", role="system", model="gpt-4o-mini", priority=PRIORITY_CHAT):
+    # returns the text of the response
+    message_list = [{"role": role, "content": message}]
+    with span("openai.chat", model=model) as chat_span:
+        completion = openai_scheduler.run(lambda: openai_client.chat.completions.create(
+            model=model,
+            messages=message_list,
+        ), model=model, priority=priority, tokens=estimate_tokens(message_list, OPENAI_COMPLETION_TOKENS_ESTIMATE),
+           get_used_tokens=get_used_tokens)
+        set_usage(chat_span, completion)
+
+    return completion.choices[0].message.content
+
+def message_ai_structured(openai_client, message="", role="system", chat_history=[], structure=Podcast, model=SCRIPT_MODEL,
+                          priority=PRIORITY_SCRIPT):
     # chat history must be a list of dicts. Each dict must have role and system
     # not including latest message
 
@@ -180,11 +161,14 @@ def message_ai_structured(openai_client, message="", role="system", chat_history
     # try:
 
 
-    completion = openai_client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=message_list,
-        response_format=structure,
-    )
+    with span("openai.chat", model=model, structured=True) as chat_span:
+        completion = openai_scheduler.run(lambda: openai_client.beta.chat.completions.parse(
+            model=model,
+            messages=message_list,
+            response_format=structure,
+        ), model=model, priority=priority, tokens=estimate_tokens(message_list, OPENAI_COMPLETION_TOKENS_ESTIMATE),
+           get_used_tokens=get_used_tokens)
+        set_usage(chat_span, completion)
 
     parsed_response = completion.choices[0].message.parsed
 
@@ -197,53 +181,11 @@ def message_ai_structured(openai_client, message="", role="system", chat_history
 
 
 
-def get_full_content_from_rss(url, num_articles = NUM_ARTICLES_PER_CATEGORY):
+def get_full_content_from_rss(url, num_articles = NUM_ARTICLES_PER_CATEGORY, story_index=None):
     # takes rss feed url
-    # gets first n aricles
+    # gets first n aricles, preferring ones that aren't in story_index (a StoryIndex)
     # scrapes page
     # returns a list of dictionaries with all text on those pages
-
-    feed = feedparser.parse(url)
-    
-    if feed.status != 200:
-        raise Exception("Failed to get RSS feed. Status code:", feed.status) 
-
-    # [print(json.dumps(entry, indent=4)) for entry in feed.entries]
-
-    all_entries = feed.entries
-
-    full_content = []
-
-    local_num_articles = num_articles
-    # print ("all entries length", len(all_entries))
-    # TODO: fix this. When an article fails to load, we need to get another article to replace it
-    # right now, no article replaces it because incrementing local_num_articles doesn't work
-    for entry in all_entries[0:local_num_articles]:
-        # print("local num articles before", local_num_articles)
-        try:
-            response = requests.get(entry.link)
-            soup = BeautifulSoup(response.content, "html.parser") 
-            content = soup.get_text()
-
-            # print("content for", entry.title, "time is", time.time()) 
-
-            # skip live stream
-            if entry.title == "LIVE:  ABC News Live":
-                # since we couldn't get this article, fetch another article to take its place
-                local_num_articles = min(len(all_entries) - 1, local_num_articles + 1)
-                # print("local num articles after because of live", local_num_articles)
-                time.sleep(DELAY_BETWEEN_NEWS_FETCH)
-
-                continue
-
-            full_content.append({"title": entry.title, "content": content})
-            
-            # avoid overwhelming servers by putting a delay between requests    
-        except Exception as e:
-            print("Error getting ", entry.link, ": ", e)
-            # since we couldn't get this article, fetch another article to take its place
-            local_num_articles = min(len(all_entries) - 1, local_num_articles + 1)
-            # print("local num articles after because of exception", local_num_articles)
-
-        time.sleep(DELAY_BETWEEN_NEWS_FETCH)
-    return full_content
\ No newline at end of file
+    # imported here so modules that only need the helpers above don't load the news fetching libraries
+    from lib.utils.news_fetching import get_full_content_from_rss_feeds
+    return get_full_content_from_rss_feeds([url], num_articles, story_index=story_index)[0]
@@ -6,20 +6,23 @@
 # Deploy with `firebase deploy`
 # update timeout https://console.cloud.google.com/functions/list?env=gen2&invt=Abj4RQ&project=personal-podcasts-2
 
-import time
-import random
+# only what's needed to register the functions is imported here.
+# everything else (openai, firestore, news fetching, ...) is imported by the function that uses it,
+# so a cold start only pays for the libraries its function needs.
+# clients are kept in lib/utils/clients.py and reused by warm invocations.
+# python -m lib.tests.import_benchmark tracks how long these imports take
+import hmac
+
 from firebase_functions import https_fn
 from firebase_admin import initialize_app
 from firebase_functions import scheduler_fn
-from firebase_admin import firestore
-from firebase_admin import storage
-from openai import OpenAI
+from firebase_functions import tasks_fn
+from firebase_functions.options import RetryConfig, RateLimits
 
-from lib.constants.global_constants import date_as_text, time_as_text
-from lib.utils.utility_functions import print_in_red, message_ai_structured, db_insert
-from lib.utils.ep_generation import build_full_directive, get_audio_from_script, upload_audio
-from lib.tests.https_tests import generate_rss_text
-from lib.constants.secrets import OPENAI_KEY
+from lib.constants.global_constants import (TTS_MAX_WORKERS, EPISODE_TASK_MAX_CONCURRENT, EPISODE_TASK_MAX_ATTEMPTS,
+                                            EPISODE_TASK_MIN_BACKOFF_SECONDS, EPISODE_TASK_TIMEOUT_SECONDS)
+from lib.constants.secrets import OPENAI_KEY, ADMIN_KEY
+from lib.utils.clients import get_openai_client, get_bucket
 
 initialize_app(options={
     'storageBucket': 'personal-podcasts-2.firebasestorage.app'
@@ -29,91 +32,111 @@ initialize_app(options={
 # # functions 
 @https_fn.on_request()
 def https_generate_rss_text(req):
-    return generate_rss_text()
+    # serves the feed that publishing rendered, with etag / 304 support
+    # visit url with ?podcastId=x for a podcast from the db, otherwise the default podcast's feed is served
+    from lib.utils.rss_serving import get_feed_podcast, serve_feed
+    podcast = get_feed_podcast(req.args.get("podcastId"))
+    if podcast is None:
+        return https_fn.Response("podcast not found", status=404)
+    return serve_feed(req, get_bucket(), podcast)
 
 # generate new episode by visiting url 
 @https_fn.on_request(secrets=[OPENAI_KEY])
 def new_episode_https(req: https_fn.Request) -> https_fn.Response: 
     return new_episode(req=req)
 
-# target for scheduler to generate new episode
-@scheduler_fn.on_schedule(schedule="every day 09:00", secrets=[OPENAI_KEY])
+# target for scheduler: puts one new_episode_task per podcast that's due on the task queue
+@scheduler_fn.on_schedule(schedule="every day 09:00")
 def new_episode_schedule(event: scheduler_fn.ScheduledEvent):
-    return new_episode(event=event)
+    from lib.utils.scheduler import enqueue_due_podcasts
+    enqueue_due_podcasts(get_bucket())
+
+# makes (or resumes) today's episode of one podcast, each in its own invocation
+# the queue runs a few at once and tries a failed one again, which resumes its run
+@tasks_fn.on_task_dispatched(retry_config=RetryConfig(max_attempts=EPISODE_TASK_MAX_ATTEMPTS,
+                                                      min_backoff_seconds=EPISODE_TASK_MIN_BACKOFF_SECONDS),
+                             rate_limits=RateLimits(max_concurrent_dispatches=EPISODE_TASK_MAX_CONCURRENT),
+                             timeout_sec=EPISODE_TASK_TIMEOUT_SECONDS, secrets=[OPENAI_KEY])
+def new_episode_task(req: tasks_fn.CallableRequest) -> None:
+    from lib.utils.scheduler import run_podcast_task
+    run_podcast_task(req.data["podcast_id"], get_openai_client(), get_bucket())
 
 def new_episode(req=None, event=None):
-    openai_client = OpenAI(api_key=OPENAI_KEY.value)
-    # generate script
-
-    directive = build_full_directive()
-    
-    print_in_red("about to generate script")
-    podcast_response = message_ai_structured(openai_client=openai_client,
-                            message=directive
-                            )
-    print_in_red("script generated")
+    from lib.utils.pipeline import EpisodeRun, run_episode_pipeline
+    from lib.utils.podcasts import load_podcast
 
-    try:
-        podcast_script = podcast_response.script
-    except Exception:
-        print("error getting script from podcast:", podcast_response)
-        raise Exception("Error getting script from podcast:", podcast_response) 
-
-    # print("podcast script is", podcast_response.model_dump_json()) 
-
-    
-    # create a new function with openai built in
-    
-    combined_audio_bytes = get_audio_from_script(podcast_script, openai_client)
-    
-    print_in_red("audio generated and combined")
+    openai_client = get_openai_client()
+    bucket = get_bucket()
 
-    bucket = storage.bucket()
+    # number of tts workers can be tuned by visiting url with ?ttsWorkers=n
+    tts_workers = int(req.args.get("ttsWorkers", TTS_MAX_WORKERS)) if req else TTS_MAX_WORKERS
 
-    upload_results = upload_audio(combined_audio_bytes, bucket)
+    # visit url with ?podcastId=x for a podcast from the db, otherwise the default podcast is used
+    podcast = load_podcast(req.args.get("podcastId") if req else None)
 
-    print_in_red("audio uploaded to bucket")
-    
+    # a rerun picks up today's unfinished run where it stopped
+    # visit url with ?runId=x to resume a specific run
+    run_id = req.args.get("runId") if req else None
+    run = EpisodeRun.load_or_create(bucket, podcast, run_id=run_id)
 
-    episode_id = "ep_" + str(round(time.time() * 1000)) + "_" + str(random.randrange(0, 9999))
-    db_insert(collection_name="episodes", data={
-        # id is ep_[current time in ms]_[random number 0 to 9999]
-        "episode_id": episode_id,
-        "podcast_id": 1, 
-        "user_id": "testUser",
-        "title": f"Daily Podcast for {date_as_text}", 
-        "description": f"This is your daily podcast for {date_as_text}. It was created at {time_as_text}", 
-        "script_text": podcast_response.model_dump_json(),
-        "created_at": firestore.SERVER_TIMESTAMP,
-        "updated_at": firestore.SERVER_TIMESTAMP,
-        "file_name": upload_results.get("file_name"),
-        "url": upload_results.get("url"),
-        "duration": 0,
-        "audio_generated": True,
-    })
-
-    print_in_red("db updated")
-
-    rss_text = generate_rss_text()
-
-    print_in_red("rss generated")
-
-    # write the rss to a file in the blob storage
-    blob = bucket.blob("rss/testUser/podcastId/testRss.xml")    
-    # blob.upload_from_string(rss_text, content_type="application/rss+xml")
-    blob.upload_from_string(rss_text, content_type="text/xml")
-    blob.make_public()
-
-    rss_url = blob.public_url
-
-    print_in_red("rss uploaded. done. rss url is: " + rss_url)
-    
-    # downloaded_text = blob.download_as_text()
-    # print_in_red("content:")
-    # print("Uploaded content length:", len(downloaded_text))
+    rss_url = run_episode_pipeline(run, openai_client, bucket, tts_workers)
     
     # send the rss as a response
     # response = make_response(rss_text)
     # response.headers.set('Content-Type', 'application/rss+xml')
 
     return f"<p>Episode audio generated. Rss url is {rss_url}</p>"
+
+
+def is_admin_request(req):
+    # admin endpoints need the ADMIN_KEY secret in an "Authorization: Bearer <key>" header
+    admin_key = ADMIN_KEY.value
+    if not admin_key:
+        return False
+    return hmac.compare_digest(req.headers.get("Authorization", ""), "Bearer " + admin_key)
+
+
+def parse_line_numbers(values):
+    # raises ValueError for anything that isn't a line number
+    line_numbers = [int(value) for value in values]
+    if any(line_number < 0 for line_number in line_numbers):
+        raise ValueError("Negative line number:", line_numbers)
+    return line_numbers
+
+
+# make some lines of an episode again and splice them into its audio
+# visit url with ?episodeId=x&lines=3,7 to make lines 3 and 7 again (line numbers start at 0)
+# to change what a line says, post json like {"texts": {"3": "new text for line 3"}}
+# needs the admin key, since it changes what listeners hear and pays for tts
+@https_fn.on_request(secrets=[OPENAI_KEY, ADMIN_KEY])
+def resynthesize_lines_https(req: https_fn.Request) -> https_fn.Response:
+    from lib.utils.episode_edits import find_episode, get_lines_error, resynthesize_episode_lines
+
+    if not is_admin_request(req):
+        return https_fn.Response("unauthorized", status=401)
+    episode_id = req.args.get("episodeId")
+    if not episode_id or "/" in episode_id:
+        return https_fn.Response("episodeId is required", status=400)
+    body = req.get_json(silent=True) or {}
+    texts = body.get("texts") if isinstance(body, dict) else None
+    if texts is not None and not isinstance(texts, dict):
+        return https_fn.Response("texts must be an object of line number to text", status=400)
+    try:
+        line_numbers = parse_line_numbers(line_number for line_number in req.args.get("lines", "").split(",") if line_number)
+        new_lines = parse_line_numbers((texts or {}).keys())
+    except ValueError:
+        return https_fn.Response("lines must be line numbers", status=400)
+    new_texts = dict(zip(new_lines, (texts or {}).values()))
+    if not line_numbers and not new_texts:
+        return https_fn.Response("no lines to make again", status=400)
+
+    episode = find_episode(episode_id)
+    if episode is None:
+        return https_fn.Response("episode not found", status=404)
+    lines_error = get_lines_error(episode, line_numbers, new_texts)
+    if lines_error:
+        return https_fn.Response(lines_error, status=400)
+
+    result = resynthesize_episode_lines(episode_id, line_numbers, get_openai_client(), get_bucket(), new_texts=new_texts,
+                                        episode=episode)
+    return {key: result[key] for key in ["episode_id", "lines", "duration", "size"]}